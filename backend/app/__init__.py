@@ -55,7 +55,23 @@ with app.app_context():
     fb = firebase_admin.initialize_app() 
     db = firestore.client()
     storage_client = storage.Client()
-    gemini_client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+    # GEMINI_VERTEX=1: Gemini through Vertex AI, which reads gs:// inputs
+    # straight from the bucket (no download / inline upload by the worker)
+    if os.getenv("GEMINI_VERTEX", "0").lower() in ("1", "true", "yes"):
+        gemini_client = genai.Client(
+            vertexai=True,
+            project=os.environ.get("GOOGLE_CLOUD_PROJECT"),
+            location=os.environ.get("GOOGLE_CLOUD_LOCATION", "global"),
+        )
+    else:
+        gemini_client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
 
 
-from app import signin,token,upload_image,upload_image_cdn,generate_from_disk,models
+from app import signin,token,upload_image,upload_image_cdn,generate_from_disk,models,worker,job_stream,metrics
+
+
+# jobs journaled by a previous process (restart, deploy) are
+# scheduled again, stale running jobs are re-queued periodically
+if os.getenv("ENV", "dev") == "dev":
+    from queue_manager import start_journal_replayer
+    start_journal_replayer(db)
@@ -1,5 +1,6 @@
 # app.py
 import os
+import inspect
 from uuid import uuid4
 from datetime import datetime
 from flask import request, jsonify
@@ -8,16 +9,38 @@ from jobs import (
     run_nano_banana_job,
     run_sync_nano_banana_job,
     run_gemini_nano_banana_job,
-    run_sync_gemini_nano_banana
+    run_gemini_nano_banana_job_async,
+    run_sync_gemini_nano_banana,
+    run_routed_job,
+    run_sync_routed,
+    provider_routing_enabled,
+    provider_router,
+    run_fanout_job,
+    validate_fanout_options,
+    BACKEND_MODELS,
+    generation_key,
+    fingerprint_gcs_paths,
+    fingerprint_urls,
+    find_cached_job,
+    find_cached_result,
+    remember_job,
+    remember_result,
+    record_interrupted,
+    CANCELED,
+    prestager,
 )
-from firestore import jobs_set,jobs_get,jobs_get_all,jobs_delete_all,delete_job
-from queue_manager import enqueue
+from firestore import jobs_set,jobs_get,jobs_update,jobs_get_all,jobs_delete_all,delete_job,listener_hub
+from queue_manager import enqueue,QueueFull,PRIORITIES,INTERACTIVE,admission,Overloaded,scheduler,cancel_job,JobCancelled
 from .collect_media import collect_media,_safe_upload_disk_path,_to_abs_url
 from prompts import dress_prompt,background_prompt
-from gcs import get_signed_url,delete_gcs_folder,copy_blob_within_bucket,delete_gcs_folder
+from gcs import get_signed_url,delete_gcs_folder,copy_blob_within_bucket,delete_gcs_folder,gcs_uri
 
 from app import db,storage_client
 
+# GEMINI_ASYNC=1 runs single gemini jobs on the asyncio job runner
+# instead of a scheduler thread
+USE_ASYNC_GEMINI = os.getenv("GEMINI_ASYNC", "0").lower() in ("1", "true", "yes")
+
 
 def prepare_job(data,jobid):
     """
@@ -63,7 +86,9 @@ def prepare_job(data,jobid):
 
   
     # prepare the output for preview
-    file_inputs.append(preview_url)
+    # the job carries the storage uri of its copy, signed only
+    # for the providers that cannot read the bucket
+    file_inputs.append(gcs_uri(dest_gcs_path))
     
     out['preview'] = {
         'filename':preview.get('filename'),
@@ -78,7 +103,6 @@ def prepare_job(data,jobid):
         if not isinstance(gallery_item, dict):
             raise Exception("'gallery_item' must be an object")
         
-        gallery_item_url = gallery_item.get("url")
         gallery_item_gcs_path = gallery_item.get("gcs_path")
 
         # important: copy files from the tmp folder
@@ -96,7 +120,7 @@ def prepare_job(data,jobid):
 
 
         # prepare the output for gallery
-        file_inputs.append(gallery_item_url)
+        file_inputs.append(gcs_uri(dest_gcs_path))
         #file_inputs.reverse()
 
         gallery_out.append({
@@ -114,6 +138,53 @@ def prepare_job(data,jobid):
     return {'file_inputs':file_inputs,'db_entry':out}
 
 
+def job_input_gcs_paths(data):
+    '''
+    Ordered gcs paths of the job inputs (preview first),
+    or None if the payload does not carry them all
+    '''
+    preview = data.get("preview")
+    gallery = data.get("gallery")
+    if not isinstance(preview, dict) or not isinstance(gallery, list):
+        return None
+
+    paths = [preview.get("gcs_path")]
+    paths += [g.get("gcs_path") for g in gallery if isinstance(g, dict)]
+    if not all(isinstance(p, str) and p for p in paths):
+        return None
+    return paths
+
+
+def single_runner():
+    '''
+    Runner of a single generation and the provider it is queued under:
+    the backend the router would pick first when routing is enabled
+    '''
+    if USE_ASYNC_GEMINI:
+        return run_gemini_nano_banana_job_async, "gemini"
+    if provider_routing_enabled():
+        return run_routed_job, provider_router.choose()
+    return run_gemini_nano_banana_job, "gemini"
+
+
+def overloaded_response(e):
+    '''
+    429 with a Retry-After computed from the provider backlog
+    '''
+    resp = jsonify({"error": str(e), "queue": e.info})
+    resp.headers["Retry-After"] = str(e.retry_after)
+    return resp, 429
+
+
+def discard_job(job_id, uid):
+    '''
+    Removes the firestore entry and the gcs folder
+    of a job that could not be queued
+    '''
+    delete_job(db=db, job_id=job_id, uid=uid)
+    delete_gcs_folder(storage_client, folder_path=f'user/{uid}/jobs/{job_id}')
+
+
 @app.post("/queue_generation_job_test")
 def queue_generation_job_test():
     
@@ -129,6 +200,51 @@ def queue_generation_job_test():
     
     user_prompt = data.get('prompt','')
     print(user_prompt)
+
+    priority = data.get('priority', INTERACTIVE)
+    if priority not in PRIORITIES:
+        return jsonify({"error": f"priority must be one of {list(PRIORITIES)}"}), 400
+
+    prompt = f'{dress_prompt} {user_prompt}'
+
+    # fan-out: several prompt variants and/or aspect ratios in one job
+    options = {}
+    run_fn, provider = single_runner()
+    if data.get('variants') is not None or data.get('aspect_ratios') is not None:
+        try:
+            validate_fanout_options(data.get('variants'), data.get('aspect_ratios'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        provider = data.get('backend', 'gemini')
+        if provider not in ('gemini', 'replicate'):
+            return jsonify({"error": "backend must be 'gemini' or 'replicate'"}), 400
+        options = {"variants": data.get('variants'), "aspect_ratios": data.get('aspect_ratios'), "backend": provider}
+        run_fn = run_fanout_job
+
+    # identical inputs + prompt + model -> hand back the existing job.
+    # clients can opt out with "dedup": false
+    dedup_key = None
+    input_paths = job_input_gcs_paths(data)
+    if data.get('dedup', True) is not False and input_paths:
+        try:
+            dedup_key = generation_key(
+                fingerprint_gcs_paths(storage_client, input_paths),
+                prompt,
+                BACKEND_MODELS[provider],
+                options=options,
+            )
+            cached = find_cached_job(db, uid, dedup_key, backend=provider)
+            if cached:
+                return jsonify({"ok": True, "cached": True, **cached}), 200
+        except Exception as e:
+            print(f"dedup lookup failed: {e}")
+            dedup_key = None
+
+    # refuse new work when the provider backlog is too deep
+    try:
+        queue_info = admission.check(provider, async_pool=inspect.iscoroutinefunction(run_fn))
+    except Overloaded as e:
+        return overloaded_response(e)
     
     # prepare the job
     job_id = str(uuid4())
@@ -149,6 +265,9 @@ def queue_generation_job_test():
     file_inputs = media.get('file_inputs')
     db_entry = media.get('db_entry')
 
+    # the uploads pre-staged for this job are in use now
+    prestager.claim(input_paths)
+
     if not file_inputs:
         return jsonify({'error':'No Files To process'}),400
 
@@ -157,16 +276,26 @@ def queue_generation_job_test():
     
     # start the job
     #enqueue(run_nano_banana_job, db=db, job_id=job_id, uid=uid, media=file_inputs, prompt=dress_prompt)
-    enqueue(
-        run_gemini_nano_banana_job, 
-        db=db, 
-        job_id=job_id, 
-        uid=uid, 
-        media=file_inputs, 
-        prompt=f'{dress_prompt} {user_prompt}'
-    )
+    try:
+        enqueue(
+            run_fn, 
+            db=db, 
+            job_id=job_id, 
+            uid=uid, 
+            media=file_inputs, 
+            prompt=prompt,
+            provider=provider,
+            priority=priority,
+            **options,
+        )
+    except QueueFull as e:
+        discard_job(job_id, uid)
+        return jsonify({'error':str(e)}),429
+
+    if dedup_key:
+        remember_job(db, uid, dedup_key, job_id)
 
-    return jsonify({"ok": True, "job_id": job_id, "status": "running"}), 202
+    return jsonify({"ok": True, "job_id": job_id, "status": "running", "queue": queue_info}), 202
 
 
 @app.post("/send_generation_job")
@@ -188,13 +317,45 @@ def send_generation_job():
     file_inputs = data.get('file_inputs')
     if not file_inputs:
         return jsonify({'error':'No Files To process'}),400
+    # gs:// inputs are only built by prepare_job: jobs read them with our credentials
+    if not isinstance(file_inputs, list) or any(not isinstance(u, str) or not u.startswith(("https://", "http://")) for u in file_inputs):
+        return jsonify({'error':'file_inputs must be http(s) urls'}),400
+
+    routed = provider_routing_enabled()
+    provider = provider_router.choose() if routed else "gemini"
+
+    # serve identical generations from the cache, opt out with "dedup": false.
+    # keyed on the model of the backend: remote inputs are only HEAD-requested
+    fingerprints = None
+    if data.get('dedup', True) is not False:
+        try:
+            fingerprints = fingerprint_urls(storage_client, file_inputs)
+            if fingerprints is not None:
+                dedup_key = generation_key(fingerprints, background_prompt, BACKEND_MODELS[provider])
+                cached = find_cached_result(db, storage_client, uid, dedup_key)
+                if cached:
+                    return jsonify({**cached, "cached": True}),200
+        except Exception as e:
+            print(f"dedup lookup failed: {e}")
+            fingerprints = None
     
     # start the generation job
     #result = run_sync_nano_banana_job(uid=uid, media=file_inputs, prompt=background_prompt)
-    result = run_sync_gemini_nano_banana(uid=uid, media=file_inputs, prompt=background_prompt)
+    try:
+        with admission.track_sync(provider):
+            if routed:
+                result = run_sync_routed(uid=uid, media=file_inputs, prompt=background_prompt)
+            else:
+                result = run_sync_gemini_nano_banana(uid=uid, media=file_inputs, prompt=background_prompt)
+    except Overloaded as e:
+        return overloaded_response(e)
 
 
     if result.get("status") == "succeeded":
+        if fingerprints is not None:
+            # the router may have failed over: remember under the model that ran
+            ran_on = (result.get("routing") or {}).get("backend", provider)
+            remember_result(db, uid, generation_key(fingerprints, background_prompt, BACKEND_MODELS[ran_on]), result)
         return jsonify(result),200
     
     return jsonify(result),400
@@ -227,6 +388,11 @@ def queue_generation_job():
     if not file_inputs:
         return jsonify({'error':'No Files To process'}),400
 
+    try:
+        queue_info = admission.check("replicate")
+    except Overloaded as e:
+        return overloaded_response(e)
+
     # start a job
     job_id = str(uuid4())
    
@@ -246,17 +412,36 @@ def queue_generation_job():
         "gallery": {"count": len(items), "items": items},
     }) 
 
-    enqueue(run_nano_banana_job, db=db, job_id=job_id, uid=uid, media=file_inputs, prompt=dress_prompt)
+    try:
+        enqueue(
+            run_nano_banana_job,
+            db=db,
+            job_id=job_id,
+            uid=uid,
+            media=file_inputs,
+            prompt=dress_prompt,
+            provider="replicate",
+        )
+    except QueueFull as e:
+        delete_job(db=db, job_id=job_id, uid=uid)
+        return jsonify({'error':str(e)}),429
+
+    return jsonify({"ok": True, "job_id": job_id, "status": "running", "queue": queue_info}), 202
 
-    return jsonify({"ok": True, "job_id": job_id, "status": "running"}), 202
 
 
+# longest a /job_status request may wait for a change
+JOB_STATUS_MAX_WAIT = int(os.getenv("JOB_STATUS_MAX_WAIT", 25))
+
 
 @app.route("/job_status", methods=["GET"])
 def job_status():
     """
-    Example: GET /job_status?job_id=abc123&uid=user001
+    Example: GET /job_status?job_id=abc123&uid=user001[&wait=20]
     Returns JSON like { "ok": true, "job_id": "...", "data": { ... job document ... } }
+
+    With wait=<seconds> an unfinished job is answered when it changes
+    (long polling, at most JOB_STATUS_MAX_WAIT seconds).
     """
     job_id = request.args.get("job_id")
     #job_id = 'e0b7edef-32db-46c0-ab85-a8aedd0c9b08'
@@ -266,10 +451,21 @@ def job_status():
         return jsonify({"ok": False, "error": "Missing job_id or uid"}), 400
 
     try:
-        job_data = jobs_get(db, job_id, uid)
+        # served from the shared listener of this user when one is open
+        job_data = listener_hub.get(uid, job_id) or jobs_get(db, job_id, uid)
         if not job_data:
             return jsonify({"ok": False, "error": f"Job {job_id} not found"}), 404
 
+        wait = min(_parse_int(request.args.get("wait")) or 0, JOB_STATUS_MAX_WAIT)
+        if wait > 0 and job_data.get("status") not in ("succeeded", "failed", CANCELED):
+            job_data = listener_hub.wait_for_change(uid, job_id, wait) or job_data
+
+        # jobs still waiting or running in this process
+        # report the backlog of their provider
+        queued = scheduler.find(job_id)
+        if queued:
+            job_data["queue"] = {**admission.snapshot(queued["provider"]), **queued}
+
         # Optionally include job_id in response
         return jsonify({
             "ok": True,
@@ -280,6 +476,50 @@ def job_status():
     except Exception as e:
         print(f"Error fetching job {job_id}: {e}")
         return jsonify({"ok": False, "error": str(e)}), 500
+
+
+@app.route("/api/cancel_job", methods=["POST"])
+def api_cancel_job():
+    """
+    Stops a queued or running job.
+    Body: { "uid": "...", "jobid": "..." }
+
+    Queued jobs are dropped right away (200, status "canceled").
+    Running jobs are signalled (202, status "canceling"): the runner
+    releases its slot, marks the job "canceled" and removes its
+    partial results.
+    """
+    data = request.get_json(silent=True)
+    if data is None:
+        return jsonify({"error": "invalid or missing JSON body"}), 400
+
+    uid = data.get('uid')
+    jobid = data.get('jobid')
+    if not uid or not jobid:
+        return jsonify({"error": "Missing uid or jobid"}), 400
+
+    job = jobs_get(db, jobid, uid)
+    if not job:
+        return jsonify({"ok": False, "error": f"Job {jobid} not found"}), 404
+    if job.get("status") in ("succeeded", "failed", CANCELED):
+        return jsonify({"ok": False, "job_id": jobid, "status": job.get("status"), "error": "job already finished"}), 409
+
+    try:
+        state = cancel_job(jobid)
+
+        if state == "running":
+            jobs_update(db, jobid, uid, {"cancel_requested": True})
+            return jsonify({"ok": True, "job_id": jobid, "status": "canceling"}), 202
+
+        # dropped from a local queue, or still waiting in a queue this
+        # process cannot reach (Cloud Tasks): the runner skips canceled jobs
+        record_interrupted(db, jobid, uid, JobCancelled(f"job {jobid} was cancelled"))
+
+    except Exception as e:
+        print(f"Error cancelling job {jobid}: {e}")
+        return jsonify({"ok": False, "error": str(e)}), 500
+
+    return jsonify({"ok": True, "job_id": jobid, "status": CANCELED}), 200
     
 
 
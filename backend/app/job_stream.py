@@ -0,0 +1,165 @@
+# job_stream.py
+# Server-Sent Events stream of job status, replaces polling /job_status.
+# Updates come from the shared Firestore listener of the user, so every
+# update costs at most one document read and reaches the stream whatever
+# instance runs the job. The in-process event bus (JOB_STREAM_SOURCE=local)
+# only sees the jobs of its own process: single-process setups only.
+import os
+import time
+import queue
+import threading
+from flask import request, jsonify, Response, stream_with_context
+from app import app, db
+from firestore import jobs_get, job_events, listener_hub
+
+FINAL_STATUSES = ("succeeded", "failed", "canceled")
+
+# every open stream holds a server thread (gunicorn runs 8), extra
+# clients get a 503 and fall back to polling
+STREAM_MAX_OPEN = int(os.getenv("JOB_STREAM_MAX_OPEN", 4))
+# open streams of one user in this process (a stream can watch many jobs)
+STREAM_MAX_PER_USER = int(os.getenv("JOB_STREAM_MAX_PER_USER", 1))
+STREAM_MAX_JOBS = int(os.getenv("JOB_STREAM_MAX_JOBS", 20))
+# streams are closed after this, EventSource reconnects by itself
+STREAM_MAX_SECONDS = int(os.getenv("JOB_STREAM_MAX_SECONDS", 300))
+STREAM_HEARTBEAT_SECONDS = 15
+
+_open_streams = threading.BoundedSemaphore(STREAM_MAX_OPEN)
+_user_streams = {}
+_user_streams_lock = threading.Lock()
+
+
+def _acquire_stream(uid: str) -> bool:
+    '''A stream slot of the process and of the user, False when either is full.'''
+    with _user_streams_lock:
+        if _user_streams.get(uid, 0) >= STREAM_MAX_PER_USER:
+            return False
+        if not _open_streams.acquire(blocking=False):
+            return False
+        _user_streams[uid] = _user_streams.get(uid, 0) + 1
+        return True
+
+
+def _release_stream(uid: str):
+    with _user_streams_lock:
+        left = _user_streams.get(uid, 1) - 1
+        if left > 0:
+            _user_streams[uid] = left
+        else:
+            _user_streams.pop(uid, None)
+        _open_streams.release()
+
+
+def stream_source() -> str:
+    '''
+    "firestore" unless JOB_STREAM_SOURCE=local: the local bus only sees
+    the jobs of this process, another instance may run the job
+    '''
+    return "local" if os.getenv("JOB_STREAM_SOURCE") == "local" else "firestore"
+
+
+def sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {app.json.dumps(data)}\n\n"
+
+
+def _offer(events: queue.Queue, event: dict):
+    # never block a Firestore listener thread on a slow client
+    try:
+        events.put_nowait(event)
+    except queue.Full:
+        print(f"job stream buffer full, dropping {event['type']} of {event['job_id']}")
+
+
+def _event_status(event: dict):
+    if event["type"] == "snapshot":
+        return (event.get("data") or {}).get("status")
+    if event["type"] == "update":
+        return event["fields"].get("status")
+    return None
+
+
+@app.route("/job_events", methods=["GET"])
+def job_events_stream():
+    """
+    Example: GET /job_events?uid=user001&job_id=abc&job_id=def
+    Streams, per job:
+      snapshot  {job_id, data}                               full document
+      update    {job_id, fields, appended, incremented}     what changed
+      deleted   {job_id}
+    and a final 'end' event once every job reached a final status.
+    """
+    uid = request.args.get("uid")
+    job_ids = list(dict.fromkeys(
+        j for arg in request.args.getlist("job_id") for j in arg.split(",") if j
+    ))
+
+    if not uid or not job_ids:
+        return jsonify({"ok": False, "error": "Missing uid or job_id"}), 400
+    if len(job_ids) > STREAM_MAX_JOBS:
+        return jsonify({"ok": False, "error": f"at most {STREAM_MAX_JOBS} jobs per stream"}), 400
+
+    if not _acquire_stream(uid):
+        resp = jsonify({"ok": False, "error": "too many open streams, poll /job_status"})
+        resp.headers["Retry-After"] = "5"
+        return resp, 503
+
+    source = stream_source()
+    events = queue.Queue(maxsize=100)
+    closed = threading.Lock()
+
+    def close():
+        # runs from the generator or from the response, only the first call counts
+        if not closed.acquire(blocking=False):
+            return
+        job_events.unsubscribe(uid, job_ids, events)
+        listener_hub.unsubscribe(uid, events)
+        _release_stream(uid)
+
+    try:
+        if source == "local":
+            # subscribe before reading, so no update falls in between
+            job_events.subscribe(uid, job_ids, events)
+            for job_id in job_ids:
+                data = jobs_get(db, job_id, uid)
+                events.put({"type": "snapshot", "job_id": job_id, "data": data} if data else {"type": "deleted", "job_id": job_id})
+        else:
+            # one listener per user shared by all streams, its cache gives the current documents
+            _, current = listener_hub.subscribe(uid, job_ids, events)
+            for job_id, data in current.items():
+                data = data or jobs_get(db, job_id, uid)
+                _offer(events, {"type": "snapshot", "job_id": job_id, "data": data} if data else {"type": "deleted", "job_id": job_id})
+    except Exception as e:
+        close()
+        print(f"Error opening job stream for {uid}: {e}")
+        return jsonify({"ok": False, "error": str(e)}), 500
+
+    def generate():
+        pending = set(job_ids)
+        closes_at = time.monotonic() + STREAM_MAX_SECONDS
+        try:
+            yield "retry: 2000\n\n"
+            while pending and time.monotonic() < closes_at:
+                try:
+                    event = events.get(timeout=STREAM_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+
+                if event["job_id"] not in pending:
+                    continue
+                yield sse(event["type"], event)
+                if event["type"] == "deleted" or _event_status(event) in FINAL_STATUSES:
+                    pending.discard(event["job_id"])
+
+            if not pending:
+                yield sse("end", {"job_ids": job_ids})
+        finally:
+            close()
+
+    resp = Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    resp.call_on_close(close)
+    return resp
@@ -0,0 +1,72 @@
+# metrics.py
+# Read-only runtime metrics of the job infrastructure.
+from flask import jsonify
+from app import app
+from firestore import listener_hub, job_events
+from queue_manager import scheduler
+from queue_manager.concurrency import concurrency
+from resilience import breaker_stats, retry_budget_stats, hedge_stats
+from jobs import provider_router, gemini_files, prestager, prompt_cache
+from imaging import transform_pool, input_cache
+
+
+@app.get("/metrics/listeners")
+def metrics_listeners():
+    """
+    Shared Firestore listeners (count, subscribers, fan-out lag)
+    and in-process job event subscriptions.
+    """
+    return jsonify({
+        "listener_hub": listener_hub.stats(),
+        "job_events": job_events.stats(),
+    }), 200
+
+
+
+@app.get("/metrics/concurrency")
+def metrics_concurrency():
+    """
+    Adaptive concurrency window per provider:model (limit, in flight,
+    latency vs baseline, last change and its reason) and the
+    scheduler pools that follow it.
+    """
+    return jsonify({
+        "windows": concurrency.stats(),
+        "scheduler": scheduler.stats(),
+        "transform_pool": transform_pool.stats(),
+    }), 200
+
+
+@app.get("/metrics/resilience")
+def metrics_resilience():
+    """
+    Circuit breaker state and retry budget left per provider.
+    """
+    return jsonify({
+        "breakers": breaker_stats(),
+        "retry_budgets": retry_budget_stats(),
+    }), 200
+
+
+@app.get("/metrics/routing")
+def metrics_routing():
+    """
+    Gemini / Replicate routing: live latency, success rate and score
+    per backend, current order, failovers so far and hedging.
+    """
+    return jsonify({**provider_router.snapshot(), "hedging": hedge_stats()}), 200
+
+
+@app.get("/metrics/cache")
+def metrics_cache():
+    """
+    Input image cache: items and bytes per tier, hits and misses,
+    the Gemini Files API uploads sent by reference, the uploads
+    pre-staged for jobs and the cached prompt prefixes.
+    """
+    return jsonify({
+        "inputs": input_cache.stats(),
+        "gemini_files": gemini_files.stats(),
+        "prestage": prestager.stats(),
+        "prompt_cache": prompt_cache.stats(),
+    }), 200
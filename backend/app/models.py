@@ -2,6 +2,7 @@
 from flask import request, jsonify
 from app import app  
 from gcs import copy_blob_within_bucket,get_files_in_folder, get_signed_url,delete_gcs_file
+from jobs import register_model_images, GEMINI_IMAGE_MODEL
 from app import storage_client
 
 
@@ -38,6 +39,9 @@ def api_get_models():
                 "cdn": "gcs-signed",
             })
 
+        # saved before the Files API registry, or expired meanwhile
+        register_model_images([r["gcs_path"] for r in results], GEMINI_IMAGE_MODEL)
+
         return jsonify({"ok": True, "message": "Success", "results": results}), 200
 
     except Exception as e:
@@ -74,6 +78,8 @@ def api_save_model():
             new_folder=dest_gcs_folder,
         )
 
+        # uploaded once to the Gemini Files API, jobs send a reference
+        register_model_images([dest_gcs_path], GEMINI_IMAGE_MODEL)
 
         return jsonify({"ok": True, "message": "Model Correctly Saved"}), 202
     except Exception as e:
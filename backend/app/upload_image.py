@@ -3,9 +3,8 @@
 from app import app  # keep your existing import
 
 import os
-from uuid import uuid4
 from flask import request, jsonify, send_from_directory
-from werkzeug.utils import secure_filename
+from .upload_image_cdn import probe_upload, safe_filename
 
 
 # ----------------------------
@@ -14,11 +13,6 @@ from werkzeug.utils import secure_filename
 UPLOAD_DIR = app.config['UPLOAD_DIR']  # e.g. "./uploads" (local) or "/tmp/uploads" (Cloud Run)
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-ALLOWED = {"png", "jpg", "jpeg", "webp"}
-
-def allowed(filename: str) -> bool:
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED
-
 
 # ----------------------------
 # upload endpoint
@@ -31,20 +25,28 @@ def upload_image_to_dir():
     f = request.files["file"]
     if f.filename == "":
         return jsonify({"error": "empty filename"}), 400
-    if not allowed(f.filename):
-        return jsonify({"error": "file type not allowed"}), 400
 
-    fname = f"{uuid4().hex}_{secure_filename(f.filename)}"
+    raw = f.read()
+    # sniffed from the content (see upload_image_cdn)
+    image, error = probe_upload(raw)
+    if error:
+        return error
+
+    fname = safe_filename(f.filename, image)
     path = os.path.join(UPLOAD_DIR, fname)
 
     # save to disk
-    f.save(path)
+    with open(path, "wb") as out:
+        out.write(raw)
 
     # return a preview URL
     return jsonify({
         "ok": True,
         "filename": fname,
-        "url": f"/uploads/{fname}"
+        "url": f"/uploads/{fname}",
+        "mimetype": image["mimetype"],
+        "width": image["width"],
+        "height": image["height"],
     }), 200
 
 # ----------------------------
@@ -2,14 +2,38 @@
 from app import app  # keep your existing import
 from app import storage_client
 
+import os
 from uuid import uuid4
 from flask import request, jsonify
 from werkzeug.utils import secure_filename
 from gcs import upload_bytes_signed
+from gemini_api import INPUT_MAX_BYTES
+from imaging import probe_complete, info_to_metadata, InvalidImage, ImageTooLarge, FORMAT_EXTENSIONS
+from jobs import prestager
 
-ALLOWED = {"png", "jpg", "jpeg", "webp"}
-def allowed(filename: str) -> bool:
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED
+# formats are sniffed from the content, the client's file name and type are not trusted
+ALLOWED_FORMATS = {"PNG", "JPEG", "WEBP"}
+
+
+def probe_upload(raw: bytes):
+    '''(probe result, None) of an acceptable upload, (None, error response) otherwise.'''
+    if len(raw) > INPUT_MAX_BYTES:
+        return None, (jsonify({"error": f"file is over the {INPUT_MAX_BYTES} bytes limit"}), 413)
+    try:
+        image = probe_complete(raw)
+    except ImageTooLarge as e:
+        return None, (jsonify({"error": str(e)}), 413)
+    except InvalidImage as e:
+        return None, (jsonify({"error": f"not a valid image: {e}"}), 400)
+    if image["format"] not in ALLOWED_FORMATS:
+        return None, (jsonify({"error": f"{image['format']} images are not allowed"}), 400)
+    return image, None
+
+
+def safe_filename(filename: str, image: dict) -> str:
+    # the extension of the sniffed format
+    stem = os.path.splitext(secure_filename(filename))[0] or "image"
+    return f"{uuid4().hex}_{stem}{FORMAT_EXTENSIONS[image['format']]}"
 
 
 @app.post("/upload_image_to_gcs_signed")
@@ -18,19 +42,26 @@ def upload_image_to_gcs_signed():
         return jsonify({"error": "missing 'file'"}), 400
 
     f = request.files["file"]
-    if not f.filename or not allowed(f.filename):
-        return jsonify({"error": "empty filename or not allowed"}), 400
+    if not f.filename:
+        return jsonify({"error": "empty filename"}), 400
 
     raw = f.read()
     if not raw:
         return jsonify({"error": "empty file content"}), 400
 
-    safe_name = f"{uuid4().hex}_{secure_filename(f.filename)}"
+    # before anything is written
+    image, error = probe_upload(raw)
+    if error:
+        return error
+
+    safe_name = safe_filename(f.filename, image)
     info = upload_bytes_signed(
         storage_client,
-        raw, 
-        safe_name, 
-        f.mimetype or "application/octet-stream"
+        file_bytes=raw,
+        gcs_path="uploads",
+        filename=safe_name,
+        content_type=image["mimetype"],
+        metadata=info_to_metadata(image),
     )
 
 
@@ -38,7 +69,9 @@ def upload_image_to_gcs_signed():
         "ok": True,
         "filename": safe_name,
         "size": len(raw),
-        "mimetype": f.mimetype,
+        "mimetype": image["mimetype"],
+        "width": image["width"],
+        "height": image["height"],
         "url": info["signed_url"],   # <— time-limited public link for preview
         "thumbUrl": info["signed_url"],
         "gcs_path": info["gcs_path"],
@@ -60,29 +93,39 @@ def upload_image_to_gcs_signed_tmp():
     tmp_path = f'tmp/uploads/users/{uid}'
 
     f = request.files["file"]
-    if not f.filename or not allowed(f.filename):
-        return jsonify({"error": "empty filename or not allowed"}), 400
+    if not f.filename:
+        return jsonify({"error": "empty filename"}), 400
 
     raw = f.read()
     if not raw:
         return jsonify({"error": "empty file content"}), 400
 
-    safe_name = f"{uuid4().hex}_{secure_filename(f.filename)}"
+    # before anything is written or staged
+    image, error = probe_upload(raw)
+    if error:
+        return error
+
+    safe_name = safe_filename(f.filename, image)
     
     info = upload_bytes_signed(
         storage_client,
         file_bytes =raw, 
         gcs_path= tmp_path,
         filename= safe_name,
-        content_type= f.mimetype or "application/octet-stream"
+        content_type= image["mimetype"],
+        metadata= info_to_metadata(image),
     )
 
+    # get the job work done while the user composes it
+    prestager.submit(info["gcs_path"], raw, image["mimetype"], info.get("generation"), info.get("md5_hash"), image)
 
     return jsonify({
         "ok": True,
         "filename": safe_name,
         "size": len(raw),
-        "mimetype": f.mimetype,
+        "mimetype": image["mimetype"],
+        "width": image["width"],
+        "height": image["height"],
         "url": info["signed_url"], 
         "thumbUrl": info["signed_url"],
         "gcs_path": info["gcs_path"],
@@ -0,0 +1,106 @@
+# worker.py
+import os
+import hmac
+import inspect
+from flask import request, jsonify
+from app import app, limiter
+from jobs import get_job_runner, runner_options
+from queue_manager import worker_oidc
+from queue_manager.async_runner import get_async_runner
+
+from app import db
+
+# modes where the worker is only reached from this machine
+LOCAL_ENVS = ("dev", "local_tasks")
+
+_auth_request = None
+
+
+def _valid_oidc(account: str, audience: str) -> bool:
+    '''The Bearer token is a Google-signed ID token of `account` for `audience`.'''
+    global _auth_request
+    header = request.headers.get("Authorization", "")
+    if not header.startswith("Bearer "):
+        return False
+    from google.oauth2 import id_token
+    from google.auth.transport import requests as google_requests
+    if _auth_request is None:
+        _auth_request = google_requests.Request()
+    try:
+        claims = id_token.verify_oauth2_token(header[len("Bearer "):], _auth_request, audience=audience)
+    except Exception as e:
+        print(f"[worker] rejected OIDC token: {repr(e)}")
+        return False
+    return claims.get("email") == account and bool(claims.get("email_verified"))
+
+
+def worker_authorized() -> bool:
+    '''
+    Every configured credential must match (X-Worker-Token, Cloud Tasks
+    OIDC token). Without any, only the local modes may call the worker.
+    '''
+    worker_token = os.getenv("WORKER_TOKEN")
+    oidc = worker_oidc()
+    if not worker_token and oidc is None:
+        return os.getenv("ENV", "dev") in LOCAL_ENVS
+    if worker_token and not hmac.compare_digest(request.headers.get("X-Worker-Token", ""), worker_token):
+        return False
+    if oidc is not None and not _valid_oidc(*oidc):
+        return False
+    return True
+
+
+@app.post("/run_job")
+@limiter.exempt
+def run_job():
+    """
+    Worker endpoint targeted by Cloud Tasks (or the local stand-in).
+    Body: { "runner", "job_id", "uid", "media", "prompt", "options" }
+
+    Returns 2xx once the runner finished (the job document holds the
+    outcome), 4xx for malformed tasks and 5xx when the runner itself
+    crashed, so that the queue retries it.
+    """
+
+    if not worker_authorized():
+        return jsonify({"error": "forbidden"}), 403
+
+    data = request.get_json(silent=True)
+    if data is None:
+        return jsonify({"error": "invalid or missing JSON body"}), 400
+
+    job_id = data.get("job_id")
+    uid = data.get("uid")
+    if not job_id or not uid:
+        return jsonify({"error": "Missing job_id or uid"}), 400
+
+    media = data.get("media")
+    if not media or not isinstance(media, list):
+        return jsonify({"error": "Missing media"}), 400
+
+    runner = data.get("runner")
+    run_fn = get_job_runner(runner)
+    if run_fn is None:
+        return jsonify({"error": f"Unknown runner {runner}"}), 400
+
+    options = data.get("options") or {}
+    if not isinstance(options, dict):
+        return jsonify({"error": "options must be an object"}), 400
+    dropped = set(options) - set(runner_options(runner, options))
+    if dropped:
+        print(f"[worker] job {job_id} dropping unknown options {sorted(dropped)}")
+    options = runner_options(runner, options)
+
+    retry_count = request.headers.get("X-CloudTasks-TaskRetryCount", "0")
+    print(f"[worker] job {job_id} runner={runner} retry={retry_count}")
+
+    try:
+        if inspect.iscoroutinefunction(run_fn):
+            get_async_runner().run(run_fn, db, job_id, uid, media, data.get("prompt", ""), **options)
+        else:
+            run_fn(db, job_id, uid, media, data.get("prompt", ""), **options)
+    except Exception as e:
+        print(f"[worker] job {job_id} crashed: {repr(e)}")
+        return jsonify({"ok": False, "job_id": job_id, "error": repr(e)}), 500
+
+    return jsonify({"ok": True, "job_id": job_id}), 200
@@ -1 +1,5 @@
-from .jobs import *
\ No newline at end of file
+from .job_events import *
+from .jobs import *
+from .dedup import *
+from .listener_hub import *
+from .gemini_files import *
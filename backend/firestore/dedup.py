@@ -0,0 +1,41 @@
+# dedup.py
+from datetime import datetime, timedelta, timezone
+from google.cloud import firestore
+from typing import Optional
+
+COLLECTION = "users"
+DEDUP_COLLECTION = "generation_cache"
+
+
+def _dedup_ref(db, uid: str, key: str):
+    return db.collection(COLLECTION).document(uid).collection(DEDUP_COLLECTION).document(key)
+
+
+def dedup_set(db, uid: str, key: str, data: dict, ttl_seconds: int):
+    """
+    Store a dedup entry. 'expires_at' can also be used as the
+    field of a Firestore TTL policy so stale entries get purged.
+    """
+    data = {
+        **data,
+        "created_at": firestore.SERVER_TIMESTAMP,
+        "expires_at": datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds),
+    }
+    _dedup_ref(db, uid, key).set(data)
+
+
+def dedup_get(db, uid: str, key: str) -> Optional[dict]:
+    """Return the dedup entry if present and not expired, else None."""
+    doc = _dedup_ref(db, uid, key).get()
+    if not doc.exists:
+        return None
+
+    data = doc.to_dict() or {}
+    expires_at = data.get("expires_at")
+    if expires_at is None or expires_at <= datetime.now(timezone.utc):
+        return None
+    return data
+
+
+def dedup_delete(db, uid: str, key: str):
+    _dedup_ref(db, uid, key).delete()
@@ -0,0 +1,24 @@
+# gemini_files.py
+from google.cloud import firestore
+from typing import Optional
+
+# content digest -> Gemini Files API handle, shared by all users
+# (the files belong to the project, the key is the content)
+GEMINI_FILES_COLLECTION = "gemini_files"
+
+
+def _gemini_file_ref(db, key: str):
+    return db.collection(GEMINI_FILES_COLLECTION).document(key)
+
+
+def gemini_file_get(db, key: str) -> Optional[dict]:
+    doc = _gemini_file_ref(db, key).get()
+    return (doc.to_dict() or {}) if doc.exists else None
+
+
+def gemini_file_set(db, key: str, data: dict):
+    _gemini_file_ref(db, key).set({**data, "updated_at": firestore.SERVER_TIMESTAMP})
+
+
+def gemini_file_delete(db, key: str):
+    _gemini_file_ref(db, key).delete()
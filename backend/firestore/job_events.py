@@ -0,0 +1,84 @@
+# job_events.py
+# In-process publish/subscribe of job document changes.
+# jobs_set / jobs_update publish what they wrote, so a job streamed from
+# the process that runs it costs no Firestore read per update.
+import queue
+import threading
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+from google.cloud.firestore_v1.transforms import ArrayUnion, Increment, Sentinel
+
+# events buffered per subscriber, a slow client loses the oldest
+# updates and gets a fresh snapshot when it reconnects
+SUBSCRIBER_BUFFER = 100
+
+
+def job_delta(data: dict) -> Dict[str, Any]:
+    '''
+    Turn a Firestore update dict into a json friendly delta:
+      fields:      plain values (dotted keys are field paths)
+      appended:    ArrayUnion values by field
+      incremented: Increment values by field
+    Server timestamps and other sentinels are left out.
+    '''
+    fields, appended, incremented = {}, {}, {}
+    for key, value in data.items():
+        if isinstance(value, ArrayUnion):
+            appended[key] = list(value.values)
+        elif isinstance(value, Increment):
+            incremented[key] = value.value
+        elif isinstance(value, Sentinel):
+            continue
+        else:
+            fields[key] = value
+    return {"fields": fields, "appended": appended, "incremented": incremented}
+
+
+class JobEventBus:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (uid, job_id) -> subscriber queues
+        self.subscribers: Dict[Tuple[str, str], Set[queue.Queue]] = {}
+
+    def subscribe(self, uid: str, job_ids: Iterable[str], q: Optional[queue.Queue] = None) -> queue.Queue:
+        q = q or queue.Queue(maxsize=SUBSCRIBER_BUFFER)
+        with self.lock:
+            for job_id in job_ids:
+                self.subscribers.setdefault((uid, job_id), set()).add(q)
+        return q
+
+    def unsubscribe(self, uid: str, job_ids: Iterable[str], q: queue.Queue):
+        with self.lock:
+            for job_id in job_ids:
+                subs = self.subscribers.get((uid, job_id))
+                if subs is None:
+                    continue
+                subs.discard(q)
+                if not subs:
+                    del self.subscribers[(uid, job_id)]
+
+    def has_subscribers(self, uid: str, job_id: str) -> bool:
+        return (uid, job_id) in self.subscribers
+
+    def publish(self, uid: str, job_id: str, event: dict):
+        with self.lock:
+            subs = list(self.subscribers.get((uid, job_id), ()))
+        for q in subs:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                try:
+                    q.get_nowait()
+                    q.put_nowait(event)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "jobs": len(self.subscribers),
+                "subscriptions": sum(len(s) for s in self.subscribers.values()),
+            }
+
+
+job_events = JobEventBus()
@@ -4,6 +4,7 @@ from datetime import datetime
 from google.cloud import firestore
 from google.cloud.firestore_v1.base_query import FieldFilter
 from typing import Dict, Optional, Any,  Iterable, List
+from .job_events import job_events, job_delta
 
 COLLECTION = "users"
 
@@ -16,6 +17,8 @@ def jobs_set(db, job_id: str, uid : str, data: dict):
         "modified_at": firestore.SERVER_TIMESTAMP,
     }
     db.collection(COLLECTION).document(uid).collection("jobs").document(job_id).set(data)
+    if job_events.has_subscribers(uid, job_id):
+        job_events.publish(uid, job_id, {"type": "snapshot", "job_id": job_id, "data": job_delta(data)["fields"]})
     
 
 def jobs_update(db, job_id: str, uid : str, data: dict):
@@ -25,6 +28,8 @@ def jobs_update(db, job_id: str, uid : str, data: dict):
         "modified_at": firestore.SERVER_TIMESTAMP,
     }
     db.collection(COLLECTION).document(uid).collection("jobs").document(job_id).update(data)
+    if job_events.has_subscribers(uid, job_id):
+        job_events.publish(uid, job_id, {"type": "update", "job_id": job_id, **job_delta(data)})
 
 
 def jobs_get(db, job_id: str, uid : str):
@@ -95,6 +100,8 @@ def delete_job(db, job_id: str, uid : str):
         .document(job_id)
     )
     jobs_ref.delete()
+    if job_events.has_subscribers(uid, job_id):
+        job_events.publish(uid, job_id, {"type": "deleted", "job_id": job_id})
 
     return
 
@@ -0,0 +1,232 @@
+# listener_hub.py
+# One Firestore snapshot listener per user jobs collection, shared by
+# every stream and waiting request of that user. The listener keeps the
+# most recent job documents cached and fans each change out to its
+# subscribers, so N clients watching a user cost one read per change.
+import os
+import time
+import queue
+import threading
+from typing import Any, Dict, Iterable, Optional, Set
+from google.cloud import firestore
+
+from app import db as default_db
+
+COLLECTION = "users"
+
+# most recently modified jobs kept in the listener window (initial reads)
+HUB_WINDOW = int(os.getenv("LISTENER_HUB_WINDOW", 25))
+# listeners without subscribers are closed after this many seconds
+HUB_IDLE_SECONDS = int(os.getenv("LISTENER_HUB_IDLE_SECONDS", 60))
+# how often listeners are checked for eviction and broken streams
+HUB_CHECK_SECONDS = 5
+# reconnect backoff of a listener whose stream died
+HUB_RECONNECT_MIN = 1
+HUB_RECONNECT_MAX = 30
+
+LAG_EWMA_ALPHA = 0.2
+
+
+def _offer(q: queue.Queue, event: dict):
+    try:
+        q.put_nowait(event)
+    except queue.Full:
+        print(f"[listener_hub] subscriber full, dropping {event['type']} of {event['job_id']}")
+
+
+class _UserListener:
+
+    def __init__(self, uid: str):
+        self.uid = uid
+        self.watch = None
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.docs: Dict[str, dict] = {}
+        # subscriber queue -> job ids it follows (None = every job)
+        self.subscribers: Dict[queue.Queue, Optional[Set[str]]] = {}
+        self.refs = 0
+        self.idle_since: Optional[float] = time.monotonic()
+        self.reconnects = 0
+        self.next_reconnect = 0.0
+        self.backoff = HUB_RECONNECT_MIN
+
+
+class ListenerHub:
+
+    def __init__(self, db=default_db, window: int = HUB_WINDOW, idle_seconds: int = HUB_IDLE_SECONDS):
+        self.db = db
+        self.window = window
+        self.idle_seconds = idle_seconds
+        self.lock = threading.Lock()
+        self.listeners: Dict[str, _UserListener] = {}
+        self.evictions = 0
+        self.reconnects = 0
+        self.events = 0
+        self.lag_avg: Optional[float] = None
+        self.lag_max = 0.0
+        self._janitor: Optional[threading.Thread] = None
+
+    # ---------------- public api ----------------
+
+    def subscribe(
+        self,
+        uid: str,
+        job_ids: Optional[Iterable[str]] = None,
+        q: Optional[queue.Queue] = None,
+        timeout: float = 10,
+    ):
+        '''
+        Follow the jobs of a user. Returns (queue, current docs of job_ids):
+        the queue receives {"type": "snapshot", "job_id", "data"} events.
+        Docs outside the listener window are None, read them once.
+        '''
+        q = q or queue.Queue(maxsize=100)
+        listener = self._acquire(uid)
+        listener.ready.wait(timeout)
+
+        with listener.lock:
+            listener.subscribers[q] = set(job_ids) if job_ids is not None else None
+            current = {j: listener.docs.get(j) for j in job_ids} if job_ids is not None else dict(listener.docs)
+        return q, current
+
+    def unsubscribe(self, uid: str, q: queue.Queue):
+        with self.lock:
+            listener = self.listeners.get(uid)
+            if listener is None:
+                return
+            with listener.lock:
+                if q not in listener.subscribers:
+                    return
+                del listener.subscribers[q]
+            listener.refs -= 1
+            if listener.refs == 0:
+                listener.idle_since = time.monotonic()
+
+    def get(self, uid: str, job_id: str) -> Optional[dict]:
+        '''
+        Cached job document, None when no live listener covers it
+        '''
+        listener = self.listeners.get(uid)
+        if listener is None or not listener.ready.is_set():
+            return None
+        with listener.lock:
+            doc = listener.docs.get(job_id)
+            return dict(doc) if doc is not None else None
+
+    def wait_for_change(self, uid: str, job_id: str, timeout: float) -> Optional[dict]:
+        '''
+        Block until the job document changes (long polling).
+        Returns the new document, None on timeout.
+        '''
+        q, _ = self.subscribe(uid, [job_id])
+        try:
+            event = q.get(timeout=timeout)
+            return event.get("data")
+        except queue.Empty:
+            return None
+        finally:
+            self.unsubscribe(uid, q)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            listeners = list(self.listeners.values())
+            return {
+                "listeners": len(listeners),
+                "active_listeners": sum(1 for l in listeners if l.refs > 0),
+                "subscribers": sum(l.refs for l in listeners),
+                "cached_docs": sum(len(l.docs) for l in listeners),
+                "events": self.events,
+                "reconnects": self.reconnects,
+                "evictions": self.evictions,
+                "fanout_lag_ms_avg": round(self.lag_avg * 1000, 1) if self.lag_avg is not None else None,
+                "fanout_lag_ms_max": round(self.lag_max * 1000, 1),
+            }
+
+    # ---------------- internals ----------------
+
+    def _acquire(self, uid: str) -> _UserListener:
+        with self.lock:
+            if self._janitor is None:
+                self._janitor = threading.Thread(target=self._janitor_loop, name="listener-hub", daemon=True)
+                self._janitor.start()
+            listener = self.listeners.get(uid)
+            if listener is None:
+                listener = _UserListener(uid)
+                self.listeners[uid] = listener
+                self._start(listener)
+            listener.refs += 1
+            listener.idle_since = None
+            return listener
+
+    def _query(self, uid: str):
+        # recently modified jobs only: a running job is updated, so it stays in the window
+        return (
+            self.db.collection(COLLECTION).document(uid).collection("jobs")
+            .order_by("modified_at", direction=firestore.Query.DESCENDING)
+            .limit(self.window)
+        )
+
+    def _start(self, listener: _UserListener):
+        listener.ready.clear()
+        try:
+            listener.watch = self._query(listener.uid).on_snapshot(
+                lambda docs, changes, read_time: self._on_snapshot(listener, changes, read_time)
+            )
+        except Exception as e:
+            listener.watch = None
+            print(f"[listener_hub] could not listen to jobs of {listener.uid}: {repr(e)}")
+
+    def _on_snapshot(self, listener: _UserListener, changes, read_time):
+        started = time.time()
+        with listener.lock:
+            for change in changes:
+                job_id = change.document.id
+                if change.type.name == "REMOVED":
+                    # left the window or deleted, nothing new for the subscribers
+                    listener.docs.pop(job_id, None)
+                    continue
+
+                data = change.document.to_dict() or {}
+                data.setdefault("job_id", job_id)
+                listener.docs[job_id] = data
+                event = {"type": "snapshot", "job_id": job_id, "data": data}
+
+                for q, job_ids in listener.subscribers.items():
+                    if job_ids is None or job_id in job_ids:
+                        _offer(q, event)
+            listener.ready.set()
+            listener.backoff = HUB_RECONNECT_MIN
+
+        # lag between the change being read by Firestore and handed to the subscribers
+        ref = read_time.timestamp() if read_time is not None else started
+        lag = max(0.0, time.time() - ref)
+        with self.lock:
+            self.events += len(changes)
+            self.lag_avg = lag if self.lag_avg is None else self.lag_avg + LAG_EWMA_ALPHA * (lag - self.lag_avg)
+            self.lag_max = max(self.lag_max, lag)
+
+    def _closed(self, listener: _UserListener) -> bool:
+        # the watch closes itself when its stream fails for good
+        return listener.watch is None or getattr(listener.watch, "_closed", False)
+
+    def _janitor_loop(self):
+        while True:
+            time.sleep(HUB_CHECK_SECONDS)
+            now = time.monotonic()
+            with self.lock:
+                for uid, listener in list(self.listeners.items()):
+                    if listener.refs == 0 and listener.idle_since is not None and now - listener.idle_since > self.idle_seconds:
+                        if listener.watch is not None:
+                            listener.watch.unsubscribe()
+                        del self.listeners[uid]
+                        self.evictions += 1
+                    elif self._closed(listener) and now >= listener.next_reconnect:
+                        print(f"[listener_hub] reconnecting listener of {uid}")
+                        listener.reconnects += 1
+                        self.reconnects += 1
+                        listener.next_reconnect = now + listener.backoff
+                        listener.backoff = min(HUB_RECONNECT_MAX, listener.backoff * 2)
+                        self._start(listener)
+
+
+listener_hub = ListenerHub()
@@ -3,6 +3,7 @@ import os
 import io
 import time
 from datetime import timedelta
+from urllib.parse import urlparse, unquote
 
 GCS_BUCKET = os.environ["GCS_BUCKET"]
 
@@ -106,4 +107,72 @@ def set_tmp_expiration_rule(client, bucket_name: str = GCS_BUCKET, days: int = 3
     ]
 
     bucket.patch()
-    print(f"✅ All objects under {TMP_PREFIX} will auto-delete after {days} days.")
\ No newline at end of file
+    print(f"✅ All objects under {TMP_PREFIX} will auto-delete after {days} days.")
+
+
+def get_blob_fingerprint(client, gcs_path: str) -> str:
+    """
+    Return a content fingerprint for an object without downloading it.
+    Uses the md5 (or crc32c for composite objects) stored by GCS and
+    falls back to the object generation.
+    """
+    object_name = gcs_path.partition(f"gs://{GCS_BUCKET}/")[2] or gcs_path
+    blob = client.bucket(GCS_BUCKET).get_blob(object_name)
+    if blob is None:
+        raise FileNotFoundError(f"Blob not found: {object_name}")
+
+    if blob.md5_hash:
+        return f"md5:{blob.md5_hash}"
+    if blob.crc32c:
+        return f"crc32c:{blob.crc32c}:{blob.size}"
+    return f"gen:{object_name}:{blob.generation}"
+
+
+def gcs_path_from_signed_url(url: str):
+    """
+    Return the object name referenced by a signed url of GCS_BUCKET,
+    e.g. https://storage.googleapis.com/<bucket>/<object>?X-Goog-... -> <object>.
+    Returns None for urls that do not point to the bucket.
+    """
+    parsed = urlparse(url)
+    path = unquote(parsed.path).lstrip("/")
+
+    if parsed.netloc == "storage.googleapis.com":
+        bucket_name, _, object_name = path.partition("/")
+    elif parsed.netloc == f"{GCS_BUCKET}.storage.googleapis.com":
+        bucket_name, object_name = GCS_BUCKET, path
+    else:
+        return None
+
+    if bucket_name != GCS_BUCKET or not object_name:
+        return None
+    return object_name
+
+
+def gcs_uri(object_name: str, bucket: str = GCS_BUCKET) -> str:
+    """gs:// uri of an object, e.g. user/1/jobs/2/preview/a.png -> gs://<bucket>/user/1/jobs/2/preview/a.png"""
+    return f"gs://{bucket}/{object_name}"
+
+
+def parse_gcs_uri(uri: str):
+    """(bucket, object name) of a gs:// uri, None for anything else."""
+    if not uri.startswith("gs://"):
+        return None
+    bucket_name, _, object_name = uri[len("gs://"):].partition("/")
+    if not bucket_name or not object_name:
+        return None
+    return bucket_name, object_name
+
+
+def sign_gcs_uris(client, uris, expires_hours: int = 1):
+    """
+    Signed GET urls for the gs:// uris of GCS_BUCKET, for providers that
+    can only fetch over https (Replicate). Other urls are returned as is.
+    """
+    out = []
+    for uri in uris:
+        parsed = parse_gcs_uri(uri)
+        if parsed and parsed[0] == GCS_BUCKET:
+            uri = get_signed_url(client, parsed[1], expires_hours=expires_hours)["signed_url"]
+        out.append(uri)
+    return out
@@ -7,6 +7,7 @@ import requests
 from urllib.parse import urlparse
 import mimetypes
 from datetime import timedelta
+from resilience import call_with_retry, host_provider
 
 GCS_BUCKET = os.environ["GCS_BUCKET"]
 
@@ -16,13 +17,21 @@ def gcs_object_name(filename: str, prefix: str = "uploads") -> str:
     return f"{prefix}/{ts}_{filename}"
 
 
+def _upload(blob, file_bytes: bytes, content_type: str):
+    # a fresh stream per attempt, retried by the gcs policy (see resilience)
+    call_with_retry(
+        lambda: blob.upload_from_file(io.BytesIO(file_bytes), size=len(file_bytes), content_type=content_type),
+        provider="gcs",
+    )
+
+
 def upload_bytes_public(client,file_bytes: bytes, filename: str, content_type: str) -> str:
     """Upload and make publicly readable; return public URL."""
     #client = storage_client()
     bucket = client.bucket(GCS_BUCKET)
     blob = bucket.blob(gcs_object_name(filename))
     blob.cache_control = "public, max-age=31536000, immutable"
-    blob.upload_from_file(io.BytesIO(file_bytes), size=len(file_bytes), content_type=content_type)
+    _upload(blob, file_bytes, content_type)
     blob.make_public()  # object ACL → public
     return blob.public_url  # https://storage.googleapis.com/<bucket>/<path>
 
@@ -34,15 +43,21 @@ def upload_bytes_signed(
         gcs_path: str, 
         filename: str, 
         content_type: str, 
-        expires_hours: int = 24
+        expires_hours: int = 24,
+        metadata: dict = None,
     ) -> dict:
-    """Upload to private bucket; return a signed URL for GET preview."""
+    """
+    Upload to private bucket; return a signed URL for GET preview.
+    metadata: custom object metadata (e.g. the image probe, see imaging.probe).
+    """
     
     #client = storage_client()
     bucket = client.bucket(GCS_BUCKET)
     blob = bucket.blob(f'{gcs_path}/{filename}')
     blob.cache_control = "public, max-age=3600"
-    blob.upload_from_file(io.BytesIO(file_bytes), size=len(file_bytes), content_type=content_type)
+    if metadata:
+        blob.metadata = metadata
+    _upload(blob, file_bytes, content_type)
 
     signed_url = blob.generate_signed_url(
         version="v4",
@@ -54,6 +69,8 @@ def upload_bytes_signed(
         "signed_url": signed_url,
         "gcs_path": blob.name,
         "content_type": content_type,
+        "generation": blob.generation,
+        "md5_hash": blob.md5_hash,
     }
 
 
@@ -70,9 +87,13 @@ def upload_url_to_gcs_signed(
     using `upload_bytes_signed`, returning a signed preview URL.
     """
 
-    # 1️⃣ Fetch the remote file
-    r = requests.get(file_url, stream=True, timeout=timeout)
-    r.raise_for_status()
+    # 1️⃣ Fetch the remote file (whole body, so a broken transfer is retried too)
+    def fetch():
+        r = requests.get(file_url, timeout=timeout)
+        r.raise_for_status()
+        return r
+
+    r = call_with_retry(fetch, provider=host_provider("fetch", file_url))
 
     # 2️⃣ Determine content type and filename
     content_type = r.headers.get("Content-Type", "application/octet-stream")
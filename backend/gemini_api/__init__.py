@@ -1 +1,5 @@
-from .generate import *
\ No newline at end of file
+from .inputs import *
+from .files import *
+from .prompt_cache import *
+from .generate import *
+from .generate_async import *
\ No newline at end of file
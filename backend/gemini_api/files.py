@@ -0,0 +1,171 @@
+# files.py
+# Registry of images uploaded once to the Gemini Files API: registered
+# content (saved models, pre-staged uploads) is sent to Gemini as a file
+# reference instead of inline bytes. Handles expire (48h), expired ones
+# are uploaded again the next time a job needs them.
+import io
+import os
+import time
+import threading
+from typing import Callable, Dict, Optional
+from google import genai
+from google.genai import types
+from imaging.cache import content_digest
+from queue_manager.cancellation import call_with_deadline
+from resilience import call_with_retry
+
+# handles closer than this to their expiry are uploaded again
+GEMINI_FILES_MIN_TTL = float(os.getenv("GEMINI_FILES_MIN_TTL", 3600))
+# Files API retention, used when the upload answer has no expiry
+GEMINI_FILES_TTL = 48 * 3600
+# seconds an unregistered digest is remembered as such
+GEMINI_FILES_NEGATIVE_TTL = 60
+
+
+def gemini_files_enabled() -> bool:
+    return os.getenv("GEMINI_FILES", "1").lower() in ("1", "true", "yes")
+
+
+class GeminiFileRegistry:
+    '''
+    content digest -> {"name", "uri", "mimetype", "expires_at"}, kept in
+    memory and in the store given by load(key) / save(key, entry) /
+    delete(key), so that all workers share the uploads.
+    '''
+
+    def __init__(
+        self,
+        client: genai.Client,
+        load: Callable[[str], Optional[dict]],
+        save: Callable[[str, dict], None],
+        delete: Optional[Callable[[str], None]] = None,
+    ):
+        self.client = client
+        self.load = load
+        self.save = save
+        self.delete = delete
+        self.lock = threading.Lock()
+        self.entries: Dict[str, dict] = {}
+        self.unknown: Dict[str, float] = {}
+        self.upload_locks: Dict[str, threading.Lock] = {}
+        self.counts = {"references": 0, "uploads": 0, "upload_errors": 0, "deleted": 0}
+
+    @property
+    def available(self) -> bool:
+        # Vertex AI has no Files API (it reads gs:// instead)
+        return gemini_files_enabled() and not getattr(self.client, "vertexai", False)
+
+    def _upload_lock(self, key: str) -> threading.Lock:
+        with self.lock:
+            return self.upload_locks.setdefault(key, threading.Lock())
+
+    def _entry(self, key: str) -> Optional[dict]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                return entry
+            seen = self.unknown.get(key)
+            if seen is not None and time.monotonic() - seen < GEMINI_FILES_NEGATIVE_TTL:
+                return None
+        entry = self.load(key)
+        with self.lock:
+            if entry is None:
+                self.unknown[key] = time.monotonic()
+            else:
+                self.entries[key] = entry
+        return entry
+
+    @staticmethod
+    def _fresh(entry: dict) -> bool:
+        return bool(entry.get("uri")) and entry.get("expires_at", 0) - time.time() > GEMINI_FILES_MIN_TTL
+
+    def _upload(self, key: str, data: bytes, mimetype: str) -> dict:
+        file = call_with_retry(
+            lambda: call_with_deadline(
+                self.client.files.upload,
+                provider="gemini",
+                file=io.BytesIO(data),
+                config=types.UploadFileConfig(mime_type=mimetype, display_name=key[:40]),
+            ),
+            provider="gemini",
+        )
+        expires = file.expiration_time.timestamp() if file.expiration_time else time.time() + GEMINI_FILES_TTL
+        entry = {"name": file.name, "uri": file.uri, "mimetype": mimetype, "expires_at": expires}
+        self.save(key, entry)
+        with self.lock:
+            self.entries[key] = entry
+            self.unknown.pop(key, None)
+            self.counts["uploads"] += 1
+        print(f"[gemini-files] uploaded {key[:12]} ({len(data)} bytes) as {file.name}")
+        return entry
+
+    def _ensure(self, key: str, data: bytes, mimetype: str, entry: Optional[dict]) -> dict:
+        if entry is not None and self._fresh(entry):
+            return entry
+        # one upload for the jobs that need the same content at once
+        with self._upload_lock(key):
+            with self.lock:
+                entry = self.entries.get(key, entry)
+            if entry is not None and self._fresh(entry):
+                return entry
+            return self._upload(key, data, mimetype)
+
+    def register(self, data: bytes, mimetype: str) -> dict:
+        '''Upload data unless a fresh handle exists, returns the handle.'''
+        key = content_digest(data)
+        return self._ensure(key, data, mimetype, self._entry(key))
+
+    def part(self, data: bytes, mimetype: str) -> Optional[types.Part]:
+        '''
+        File reference of registered content, uploaded again when its
+        handle expired. None for other content (or when the upload
+        fails): the caller sends the bytes inline.
+        '''
+        if not self.available:
+            return None
+        key = content_digest(data)
+        entry = self._entry(key)
+        if entry is None:
+            return None
+        try:
+            entry = self._ensure(key, data, mimetype, entry)
+        except Exception as e:
+            with self.lock:
+                self.counts["upload_errors"] += 1
+            print(f"[gemini-files] re-upload of {key[:12]} failed, sending it inline: {repr(e)}")
+            return None
+        with self.lock:
+            self.counts["references"] += 1
+        return types.Part.from_uri(file_uri=entry["uri"], mime_type=entry["mimetype"])
+
+    def lookup(self, data: bytes) -> Optional[dict]:
+        '''Handle of data (maybe expired), None when it was never registered.'''
+        return self._entry(content_digest(data))
+
+    def forget(self, key: str):
+        '''Delete the uploaded file of a content digest and its handle.'''
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            self.unknown[key] = time.monotonic()
+        entry = entry or self.load(key)
+        if entry is None:
+            return
+        if self.delete is not None:
+            self.delete(key)
+        try:
+            call_with_retry(lambda: self.client.files.delete(name=entry["name"]), provider="gemini")
+            with self.lock:
+                self.counts["deleted"] += 1
+        except Exception as e:
+            # it expires on its own
+            print(f"[gemini-files] could not delete {entry.get('name')}: {repr(e)}")
+
+    def stats(self) -> dict:
+        with self.lock:
+            now = time.time()
+            return {
+                "available": self.available,
+                "known": len(self.entries),
+                "fresh": sum(1 for e in self.entries.values() if e.get("expires_at", 0) > now),
+                **self.counts,
+            }
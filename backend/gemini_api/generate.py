@@ -1,59 +1,136 @@
-import requests
+import os
+import time
+import mimetypes
 from typing import List, Tuple, Optional
 from google import genai
-from google.genai import types
+from google.genai import types, errors
+from queue_manager.cancellation import call_with_deadline, check_cancelled, provider_deadline
+from queue_manager.rate_limiter import wait_for_model, penalize_model
+from queue_manager.concurrency import concurrency
+from resilience import call_with_retry
+from imaging.renditions import renditions
+from .inputs import fetch_inputs, check_gcs_input
+from .files import GeminiFileRegistry
+from .prompt_cache import PromptCache, gemini_prompt_cache_enabled
 
 
-def generate_image(
-    client: genai.Client,
-    prompt: str,
-    image_urls: Optional[List[str]] = None,
-    model: str = "gemini-2.5-flash-image",
-    aspect_ratio: Optional[str] = None,
-) -> Tuple[Optional[bytes], str]:
+def guess_mime_type(url: str) -> str:
+    # only for inputs passed by reference: fetched ones are sniffed (see inputs)
+    mime = mimetypes.guess_type(url.split("?", 1)[0])[0]
+    return mime if mime and mime.startswith("image/") else "image/jpeg"
+
+
+def gemini_reads_gcs(client: genai.Client) -> bool:
     """
-    Generate an image using Gemini (Nano Banana).
-    Returns: (raw_bytes, mime_type)
+    Whether gs:// inputs can be handed to the client by reference:
+    Vertex AI reads them from the bucket, the Gemini API cannot.
+    GEMINI_GCS_BY_REFERENCE=0 turns it off.
     """
-    image_urls = image_urls or []
+    if os.getenv("GEMINI_GCS_BY_REFERENCE", "1").lower() not in ("1", "true", "yes"):
+        return False
+    return bool(getattr(client, "vertexai", False))
 
-    # Prepare prompt as the first part
-    parts = [types.Part.from_text(text=prompt)]
 
-    # Add input image(s) if any
-    for u in image_urls:
-        mime = "image/png" if u.lower().endswith(".png") else "image/jpeg"
+def model_input_spec(model: Optional[str]):
+    # targets are declared on the model configs, next to MODEL_REGISTRY
+    from replicate_api.models import model_input_spec as _spec
+    return _spec(model) if model else None
 
-        if u.startswith("gs://"):
-            part = types.Part.from_uri(file_uri=u, mime_type=mime)
-        else:
-            # safer for signed / expiring URLs
-            resp = requests.get(u, timeout=30)
-            resp.raise_for_status()
-            part = types.Part.from_bytes(data=resp.content, mime_type=mime)
 
-        parts.append(part)
+def load_image_parts(
+    image_urls: Optional[List[str]] = None,
+    timings: Optional[List[dict]] = None,
+    by_reference: bool = False,
+    model: Optional[str] = None,
+    files: Optional[GeminiFileRegistry] = None,
+) -> List[types.Part]:
+    """
+    Build the Gemini parts for the input image(s).
+    Done once per job so that several generations can share them.
+    With by_reference, gs:// inputs are passed as uris (nothing is
+    downloaded), everything else is fetched concurrently (see inputs),
+    turned into the model's input rendition (see imaging.renditions)
+    and inlined, or sent as a Files API reference when `files` has it.
+    Fetch timings are appended to `timings` when given.
+    """
+    check_cancelled()
+    urls = [u for u in image_urls or [] if not (by_reference and u.startswith("gs://"))]
+    data, content_types, fetch_timings = fetch_inputs(urls)
+    if timings is not None:
+        timings.extend(fetch_timings)
+    images = [t.get("image") for t in fetch_timings]
+    fetched = dict(zip(urls, renditions(list(zip(data, content_types)), model_input_spec(model), images)))
 
-    # config aspect ratio
-    img_config = types.ImageConfig(aspect_ratio=aspect_ratio) if aspect_ratio else None
+    parts = []
+    for u in image_urls or []:
+        if u not in fetched:
+            # read with our credentials by Vertex
+            check_gcs_input(u)
+            parts.append(types.Part.from_uri(file_uri=u, mime_type=guess_mime_type(u)))
+            continue
+        d, mime = fetched[u]
+        part = files.part(d, mime) if files is not None else None
+        parts.append(part or types.Part.from_bytes(data=d, mime_type=mime))
+    return parts
 
-    # Generate image
-    response = client.models.generate_content(
-        model=model,
-        contents=parts,
-        config=types.GenerateContentConfig(
-            response_modalities=["IMAGE"],
-            image_config=img_config,
-        ),
+
+def build_generate_config(aspect_ratio: Optional[str] = None, cached_content: Optional[str] = None) -> types.GenerateContentConfig:
+    """
+    Image-only response config, with the aspect ratio if any and the
+    cached prompt prefix if any (see prompt_cache).
+    The http timeout matches the gemini job deadline (milliseconds).
+    """
+    img_config = types.ImageConfig(aspect_ratio=aspect_ratio) if aspect_ratio else None
+    return types.GenerateContentConfig(
+        response_modalities=["IMAGE"],
+        image_config=img_config,
+        cached_content=cached_content,
+        http_options=types.HttpOptions(timeout=int(provider_deadline("gemini") * 1000)),
     )
 
+
+def cached_prompt(prompt_cache: Optional[PromptCache], model: str, prompt: str) -> Tuple[Optional[str], str, Optional[dict]]:
+    """
+    (cached content, text to send, usage) of a prompt: with a cached
+    prefix only the rest of the prompt is sent, the whole prompt otherwise.
+    usage is None when there is no prompt cache or caching is off.
+    """
+    if prompt_cache is None or not gemini_prompt_cache_enabled():
+        return None, prompt, None
+    usage = {"prefix": None, "cached": False, "status": "none"}
+    split = prompt_cache.split(prompt)
+    if split is None:
+        return None, prompt, usage
+    key, rest = split
+    cached_content, status = prompt_cache.cached_content(model, key)
+    usage.update(prefix=key, cached=cached_content is not None, status=status)
+    return cached_content, rest if cached_content else prompt, usage
+
+
+def record_prompt_usage(prompt_cache: PromptCache, model: str, usage: dict, response, started: float) -> dict:
+    """Token counts and latency of a call into usage (see PromptCache.record)."""
+    meta = getattr(response, "usage_metadata", None)
+    usage["prompt_tokens"] = getattr(meta, "prompt_token_count", None)
+    usage["cached_tokens"] = getattr(meta, "cached_content_token_count", None) or 0
+    usage["latency_ms"] = round((time.monotonic() - started) * 1000)
+    prompt_cache.record(model, usage)
+    return usage
+
+
+def text_parts(text: str, image_parts: Optional[List[types.Part]]) -> List[types.Part]:
+    # the prompt (or what is left of it after the cached prefix) first
+    return ([types.Part.from_text(text=text)] if text else []) + list(image_parts or [])
+
+
+def extract_image(response) -> Tuple[Optional[bytes], str]:
+    """Return (raw_bytes, mime_type) of the first image in a response."""
     # Extract first image part as bytes
-    for part in getattr(response, "parts", []):
+    for part in getattr(response, "parts", None) or []:
         if getattr(part, "inline_data", None):
             return part.inline_data.data, part.inline_data.mime_type
 
     # Fallback: iterate candidates
-    for cand in getattr(response, "candidates", []):
+    for cand in getattr(response, "candidates", None) or []:
         for part in cand.content.parts:
             if getattr(part, "inline_data", None):
                 return part.inline_data.data, part.inline_data.mime_type
@@ -62,6 +139,96 @@ def generate_image(
     return None, "image/png"
 
 
+def _generate_once(client: genai.Client, model: str, parts: List[types.Part], aspect_ratio: Optional[str], cached_content: Optional[str] = None):
+    # paced by the shared token bucket of the model, held to its adaptive
+    # concurrency window, then bounded by the gemini deadline and the job cancel token
+    wait_for_model(model)
+    try:
+        with concurrency.slot("gemini", model):
+            return call_with_deadline(
+                client.models.generate_content,
+                provider="gemini",
+                model=model,
+                contents=parts,
+                config=build_generate_config(aspect_ratio, cached_content),
+            )
+    except errors.APIError as e:
+        if e.code == 429:
+            penalize_model(model)
+        raise
+
+
+def generate_image_from_parts(
+    client: genai.Client,
+    prompt: str,
+    image_parts: Optional[List[types.Part]] = None,
+    model: str = "gemini-2.5-flash-image",
+    aspect_ratio: Optional[str] = None,
+    prompt_cache: Optional[PromptCache] = None,
+    prompt_usage: Optional[List[dict]] = None,
+) -> Tuple[Optional[bytes], str]:
+    """
+    Generate an image from already prepared input parts.
+    Transient errors are retried, see resilience.
+    A prompt prefix cached in `prompt_cache` is sent by reference, the
+    tokens and latency of the call are appended to `prompt_usage`.
+    Returns: (raw_bytes, mime_type)
+    """
+    cached_content, text, usage = cached_prompt(prompt_cache, model, prompt)
+    started = time.monotonic()
+    try:
+        response = call_with_retry(_generate_once, client, model, text_parts(text, image_parts), aspect_ratio, cached_content, provider="gemini")
+    except errors.APIError as e:
+        if not cached_content or e.code not in (400, 403, 404):
+            raise
+        # the cache is gone or refused: the plain prompt
+        print(f"[prompt-cache] {cached_content} failed ({e.code}), sending the whole prompt")
+        prompt_cache.invalidate(model, usage["prefix"])
+        usage.update(cached=False, status="fallback")
+        response = call_with_retry(_generate_once, client, model, text_parts(prompt, image_parts), aspect_ratio, provider="gemini")
+
+    if usage is not None:
+        usage = record_prompt_usage(prompt_cache, model, usage, response, started)
+        if prompt_usage is not None:
+            prompt_usage.append(usage)
+    return extract_image(response)
+
+
+def generate_image(
+    client: genai.Client,
+    prompt: str,
+    image_urls: Optional[List[str]] = None,
+    model: str = "gemini-2.5-flash-image",
+    aspect_ratio: Optional[str] = None,
+    input_timings: Optional[List[dict]] = None,
+    files: Optional[GeminiFileRegistry] = None,
+    prompt_cache: Optional[PromptCache] = None,
+    prompt_usage: Optional[List[dict]] = None,
+) -> Tuple[Optional[bytes], str]:
+    """
+    Generate an image using Gemini (Nano Banana).
+    input_timings, if given, receives the fetch timing of each input.
+    Inputs registered in `files` are sent by reference, and so is a
+    prompt prefix cached in `prompt_cache` (usage in `prompt_usage`).
+    Returns: (raw_bytes, mime_type)
+    """
+    return generate_image_from_parts(
+        client=client,
+        prompt=prompt,
+        image_parts=load_image_parts(
+            image_urls,
+            timings=input_timings,
+            by_reference=gemini_reads_gcs(client),
+            model=model,
+            files=files,
+        ),
+        model=model,
+        aspect_ratio=aspect_ratio,
+        prompt_cache=prompt_cache,
+        prompt_usage=prompt_usage,
+    )
+
+
 
 # upload to GCS
 # storage_client = storage.Client()
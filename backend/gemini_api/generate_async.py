@@ -0,0 +1,118 @@
+import time
+import asyncio
+import contextvars
+from typing import List, Tuple, Optional
+from google import genai
+from google.genai import types, errors
+from imaging.renditions import rendition, input_renditions_enabled
+from .generate import (
+    guess_mime_type, gemini_reads_gcs, model_input_spec, build_generate_config, extract_image,
+    cached_prompt, record_prompt_usage, text_parts,
+)
+from .inputs import fetch_input_async, check_gcs_input, INPUT_FETCH_DEADLINE
+from .files import GeminiFileRegistry
+from .prompt_cache import PromptCache
+from queue_manager.cancellation import await_with_deadline
+from queue_manager.rate_limiter import wait_for_model_async, penalize_model_async
+from queue_manager.concurrency import concurrency
+from resilience import call_with_retry_async
+
+
+async def _in_thread(fn, *args):
+    # blocking work (storage client, transform pool) off the event loop
+    return await asyncio.get_running_loop().run_in_executor(None, contextvars.copy_context().run, fn, *args)
+
+
+async def _load_image_part(
+    url: str,
+    by_reference: bool = False,
+    spec: Optional[dict] = None,
+    files: Optional[GeminiFileRegistry] = None,
+) -> types.Part:
+    if url.startswith("gs://") and by_reference:
+        # read with our credentials by Vertex
+        check_gcs_input(url)
+        return types.Part.from_uri(file_uri=url, mime_type=guess_mime_type(url))
+    # same path as the sync inputs: size limit, deadline, input cache and
+    # header probe (corrupt / oversized inputs fail here, before the model call)
+    data, mime, timing = await fetch_input_async(url, time.monotonic() + INPUT_FETCH_DEADLINE)
+    image = timing.get("image")
+
+    if spec:
+        data, mime = await _in_thread(rendition, data, mime, spec, image)
+    part = await _in_thread(files.part, data, mime) if files is not None else None
+    return part or types.Part.from_bytes(data=data, mime_type=mime)
+
+
+async def load_image_parts_async(
+    image_urls: Optional[List[str]] = None,
+    by_reference: bool = False,
+    model: Optional[str] = None,
+    files: Optional[GeminiFileRegistry] = None,
+) -> List[types.Part]:
+    """
+    Async version of load_image_parts: all inputs are fetched
+    concurrently on the input fetch pool (see inputs.fetch_input_async).
+    """
+    if not image_urls:
+        return []
+
+    spec = model_input_spec(model) if input_renditions_enabled() else None
+    return list(await asyncio.gather(*(_load_image_part(u, by_reference, spec, files) for u in image_urls)))
+
+
+async def generate_image_async(
+    client: genai.Client,
+    prompt: str,
+    image_urls: Optional[List[str]] = None,
+    model: str = "gemini-2.5-flash-image",
+    aspect_ratio: Optional[str] = None,
+    files: Optional[GeminiFileRegistry] = None,
+    prompt_cache: Optional[PromptCache] = None,
+    prompt_usage: Optional[List[dict]] = None,
+) -> Tuple[Optional[bytes], str]:
+    """
+    Non-blocking generate_image: uses the genai async client (client.aio),
+    so a single event loop can keep many generations in flight.
+    Returns: (raw_bytes, mime_type)
+    """
+    image_parts = await load_image_parts_async(
+        image_urls, by_reference=gemini_reads_gcs(client), model=model, files=files,
+    )
+    # creating the cache blocks
+    cached_content, text, usage = await _in_thread(cached_prompt, prompt_cache, model, prompt)
+
+    async def generate_once(parts, cached_content):
+        await wait_for_model_async(model)
+        try:
+            async with concurrency.slot_async("gemini", model):
+                return await await_with_deadline(
+                    client.aio.models.generate_content(
+                        model=model,
+                        contents=parts,
+                        config=build_generate_config(aspect_ratio, cached_content),
+                    ),
+                    provider="gemini",
+                )
+        except errors.APIError as e:
+            if e.code == 429:
+                await penalize_model_async(model)
+            raise
+
+    started = time.monotonic()
+    try:
+        response = await call_with_retry_async(lambda: generate_once(text_parts(text, image_parts), cached_content), provider="gemini")
+    except errors.APIError as e:
+        if not cached_content or e.code not in (400, 403, 404):
+            raise
+        # the cache is gone or refused: the plain prompt
+        print(f"[prompt-cache] {cached_content} failed ({e.code}), sending the whole prompt")
+        prompt_cache.invalidate(model, usage["prefix"])
+        usage.update(cached=False, status="fallback")
+        response = await call_with_retry_async(lambda: generate_once(text_parts(prompt, image_parts), None), provider="gemini")
+
+    if usage is not None:
+        usage = record_prompt_usage(prompt_cache, model, usage, response, started)
+        if prompt_usage is not None:
+            prompt_usage.append(usage)
+    return extract_image(response)
@@ -0,0 +1,325 @@
+# inputs.py
+# Input image fetching: every input of a job is downloaded at once over
+# one pooled keep-alive session (no TLS handshake per image), with a
+# size limit per input, an overall deadline and a timing per input.
+# Inputs stored in our bucket are read through the input cache (see
+# imaging.cache), by object name and checked against its generation.
+# gs:// inputs are read with the storage client, for the models that
+# cannot take them by reference, and only within the objects of the
+# job (gcs_input_scope): the service account can read more than what
+# belongs to the user. Every input is probed (imaging.probe)
+# as its first bytes arrive: corrupt or oversized images fail the job
+# before any model call, and the content type is the sniffed one.
+import os
+import time
+import base64
+import asyncio
+import threading
+import contextvars
+import requests
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from typing import Dict, List, Mapping, Optional, Tuple
+from requests.adapters import HTTPAdapter
+from queue_manager.cancellation import current_token, JobCancelled, JobTimeout, POLL_INTERVAL
+from resilience import call_with_retry, host_provider
+from gcs import gcs_path_from_signed_url, parse_gcs_uri, GCS_BUCKET
+from imaging.cache import input_cache, input_cache_enabled, CacheRef
+from imaging.probe import probe_image, probe_complete, info_from_metadata, NeedMoreData, PROBE_MAX_HEAD
+
+# largest input accepted, bigger ones fail the job
+INPUT_MAX_BYTES = int(os.getenv("INPUT_MAX_BYTES", 20 * 1024 * 1024))
+# all inputs of a job must be fetched within this many seconds
+INPUT_FETCH_DEADLINE = float(os.getenv("INPUT_FETCH_DEADLINE", 30))
+# parallel downloads (shared by all jobs of the process) and pooled connections
+INPUT_FETCH_WORKERS = int(os.getenv("INPUT_FETCH_WORKERS", 8))
+INPUT_FETCH_CHUNK = 64 * 1024
+# cached objects confirmed within this many seconds are served without
+# asking GCS, older ones are revalidated with a conditional GET (no body)
+INPUT_CACHE_FRESH_SECONDS = float(os.getenv("INPUT_CACHE_FRESH_SECONDS", 300))
+
+
+class InputTooLarge(ValueError):
+    """An input image is bigger than INPUT_MAX_BYTES."""
+
+
+class InputNotAllowed(ValueError):
+    """A gs:// input outside GCS_BUCKET or the objects the current job may read."""
+
+
+# object name prefixes of GCS_BUCKET the current job may read as gs:// inputs
+_gcs_scope: contextvars.ContextVar = contextvars.ContextVar("gcs_input_scope", default=())
+
+
+@contextmanager
+def gcs_input_scope(*prefixes: str):
+    '''Let the code run here read the GCS_BUCKET objects under prefixes (e.g. user/<uid>/).'''
+    reset = _gcs_scope.set(tuple(p for p in prefixes if p))
+    try:
+        yield
+    finally:
+        _gcs_scope.reset(reset)
+
+
+def check_gcs_input(uri: str) -> Tuple[str, str]:
+    '''
+    (bucket, object name) of a gs:// input the current job may read,
+    raises InputNotAllowed otherwise (nothing is readable outside a scope).
+    '''
+    parsed = parse_gcs_uri(uri)
+    if parsed is None:
+        raise InputNotAllowed(f"not a gs:// uri: {uri}")
+    bucket_name, object_name = parsed
+    if bucket_name != GCS_BUCKET or not any(object_name.startswith(p) for p in _gcs_scope.get()):
+        raise InputNotAllowed(f"{uri} is not an input of this job")
+    return parsed
+
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+_storage_client = None
+_executor = ThreadPoolExecutor(max_workers=INPUT_FETCH_WORKERS, thread_name_prefix="input-fetch")
+
+
+def http_session() -> requests.Session:
+    '''Process-wide keep-alive session, one connection pool per host.'''
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=10, pool_maxsize=INPUT_FETCH_WORKERS)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def storage_client():
+    '''Storage client of the gs:// reads, created on first use.'''
+    global _storage_client
+    with _session_lock:
+        if _storage_client is None:
+            from google.cloud import storage
+            _storage_client = storage.Client()
+        return _storage_client
+
+
+def _label(url: str) -> str:
+    # signed urls carry credentials in the query string, keep them out of logs
+    parsed = urlparse(url)
+    return f"{parsed.netloc}{parsed.path}"
+
+
+def _download(url: str, timeout: float, max_bytes: int, etag: Optional[str] = None) -> Tuple[Optional[bytes], Mapping[str, str], Optional[Dict]]:
+    '''
+    Body, headers and image probe of url. The body is None when etag
+    still matches (304). Not an image: stops at the first bytes.
+    '''
+    headers = {"If-None-Match": etag} if etag else None
+    with http_session().get(url, timeout=timeout, stream=True, headers=headers) as resp:
+        if etag and resp.status_code == 304:
+            return None, resp.headers, None
+        resp.raise_for_status()
+        length = resp.headers.get("Content-Length")
+        if length and int(length) > max_bytes:
+            raise InputTooLarge(f"{_label(url)} is {int(length)} bytes, the limit is {max_bytes}")
+        chunks, size, image = [], 0, None
+        for chunk in resp.iter_content(INPUT_FETCH_CHUNK):
+            size += len(chunk)
+            if size > max_bytes:
+                raise InputTooLarge(f"{_label(url)} is over the {max_bytes} bytes limit")
+            chunks.append(chunk)
+            if image is None and size <= PROBE_MAX_HEAD:
+                try:
+                    image = probe_image(b"".join(chunks))
+                except NeedMoreData:
+                    pass
+        data = b"".join(chunks)
+        return data, resp.headers, image or probe_complete(data)
+
+
+def _image(data: bytes, ref: Optional[CacheRef] = None, metadata: Optional[Dict[str, str]] = None) -> Dict:
+    # recorded by an earlier probe (cache entry, object metadata), probed otherwise
+    return (ref.image if ref is not None and ref.image else None) or info_from_metadata(metadata) or probe_complete(data)
+
+
+def _gcs_cache_name(bucket_name: str, object_name: str) -> Optional[str]:
+    if not input_cache_enabled():
+        return None
+    # same name as the signed urls of the object, they share the entry
+    return f"gcs:{object_name}" if bucket_name == GCS_BUCKET else f"gcs:{bucket_name}/{object_name}"
+
+
+def fetch_gcs_input(uri: str, expires: float, max_bytes: int = INPUT_MAX_BYTES) -> Tuple[bytes, str, Dict]:
+    '''
+    fetch_input for gs:// uris: the object metadata gives its generation,
+    the bytes come from the input cache when that generation is cached.
+    '''
+    started = time.monotonic()
+    bucket_name, object_name = check_gcs_input(uri)
+    name = _gcs_cache_name(bucket_name, object_name)
+
+    def remaining() -> float:
+        left = expires - time.monotonic()
+        if left <= 0:
+            raise JobTimeout(f"input fetch exceeded its deadline ({uri})")
+        return left
+
+    def timing(data: bytes, source: str, image: Dict) -> Dict:
+        return {"input": uri, "bytes": len(data), "ms": round((time.monotonic() - started) * 1000), "cache": source, "image": image}
+
+    blob = call_with_retry(lambda: storage_client().bucket(bucket_name).get_blob(object_name, timeout=remaining()), provider="gcs")
+    if blob is None:
+        raise FileNotFoundError(f"Blob not found: {uri}")
+    if blob.size and blob.size > max_bytes:
+        raise InputTooLarge(f"{uri} is {blob.size} bytes, the limit is {max_bytes}")
+
+    generation = str(blob.generation)
+    ref, cached = input_cache.lookup(name) if name else (None, None)
+    if cached is not None and ref.generation == generation:
+        image = _image(cached, ref, blob.metadata)
+        if ref.image is None:
+            ref.image = image
+        input_cache.touch(name, ref)
+        return cached, image["mimetype"], timing(cached, "hit", image)
+
+    # a copy of cached content (job inputs copied from uploads / models)
+    content_ref, content = input_cache.lookup(f"md5:{blob.md5_hash}") if name and blob.md5_hash else (None, None)
+    if content is not None:
+        image = _image(content, content_ref, blob.metadata)
+        remember_gcs_object(name, content, image["mimetype"], generation, blob.md5_hash, image)
+        return content, image["mimetype"], timing(content, "hit", image)
+
+    # the generation read above, not a newer one written meanwhile
+    data = call_with_retry(
+        lambda: blob.download_as_bytes(if_generation_match=blob.generation, timeout=remaining()),
+        provider="gcs",
+    )
+    image = _image(data, metadata=blob.metadata)
+    if name:
+        remember_gcs_object(name, data, image["mimetype"], generation, blob.md5_hash, image)
+    return data, image["mimetype"], timing(data, "miss" if name else "none", image)
+
+
+def remember_gcs_object(
+    name: str,
+    data: bytes,
+    mimetype: Optional[str],
+    generation: Optional[str],
+    md5_hash: Optional[str],
+    image: Optional[Dict] = None,
+):
+    '''
+    Put an object in the input cache under its name (gcs:<object>) and
+    its md5, so that copies of the object are found without a download.
+    image is its probe result, when known.
+    '''
+    # the ETag signed urls see (quoted hex md5), so they can revalidate the entry
+    etag = f'"{base64.b64decode(md5_hash).hex()}"' if md5_hash else None
+    ref = input_cache.store(name, data, mimetype=mimetype, generation=generation, etag=etag, image=image)
+    if md5_hash:
+        input_cache.set_ref(f"md5:{md5_hash}", ref)
+
+
+def _cache_name(url: str) -> Optional[str]:
+    # only objects of our bucket: they are immutable between generations
+    if not input_cache_enabled():
+        return None
+    object_name = gcs_path_from_signed_url(url)
+    return f"gcs:{object_name}" if object_name else None
+
+
+def fetch_input(url: str, expires: float, max_bytes: int = INPUT_MAX_BYTES) -> Tuple[bytes, str, Dict]:
+    '''
+    Download one input before `expires` (monotonic), or read it from the
+    input cache. Transient errors are retried (see resilience).
+    Returns (bytes, sniffed content type, timing with the probe result).
+    Raises InvalidImage (imaging.probe) for corrupt / oversized images.
+    '''
+    if url.startswith("gs://"):
+        return fetch_gcs_input(url, expires, max_bytes)
+
+    started = time.monotonic()
+    name = _cache_name(url)
+    ref, cached = input_cache.lookup(name) if name else (None, None)
+
+    def timing(data: bytes, source: str, image: Dict) -> Dict:
+        return {"input": _label(url), "bytes": len(data), "ms": round((time.monotonic() - started) * 1000), "cache": source, "image": image}
+
+    if cached is not None and time.time() - ref.validated < INPUT_CACHE_FRESH_SECONDS:
+        image = _image(cached, ref)
+        return cached, image["mimetype"], timing(cached, "hit", image)
+
+    def attempt():
+        remaining = expires - time.monotonic()
+        if remaining <= 0:
+            raise JobTimeout(f"input fetch exceeded its deadline ({_label(url)})")
+        return _download(url, timeout=remaining, max_bytes=max_bytes, etag=ref.etag if cached is not None else None)
+
+    data, headers, image = call_with_retry(attempt, provider=host_provider("fetch", url))
+    if data is None:
+        image = _image(cached, ref)
+        ref.image = image
+        input_cache.touch(name, ref)
+        return cached, image["mimetype"], timing(cached, "revalidated", image)
+
+    if name:
+        input_cache.store(
+            name, data,
+            mimetype=image["mimetype"],
+            generation=headers.get("x-goog-generation"),
+            etag=headers.get("ETag"),
+            image=image,
+        )
+    return data, image["mimetype"], timing(data, "miss" if name else "none", image)
+
+
+async def fetch_input_async(url: str, expires: float, max_bytes: int = INPUT_MAX_BYTES) -> Tuple[bytes, str, Dict]:
+    '''
+    fetch_input awaited from an event loop. It runs on the input fetch
+    pool (INPUT_FETCH_WORKERS, sized to the keep-alive session), not on
+    the loop's default executor.
+    '''
+    future = _executor.submit(contextvars.copy_context().run, fetch_input, url, expires, max_bytes)
+    return await asyncio.wrap_future(future)
+
+
+def fetch_inputs(
+    urls: List[str],
+    deadline: float = INPUT_FETCH_DEADLINE,
+    max_bytes: int = INPUT_MAX_BYTES,
+) -> Tuple[List[bytes], List[str], List[Dict]]:
+    '''
+    Download all urls concurrently within `deadline` seconds.
+    Returns (bytes, sniffed content types, timings), in the order of urls.
+    Raises JobTimeout past the deadline, the first error otherwise.
+    '''
+    if not urls:
+        return [], [], []
+
+    token = current_token()
+    expires = time.monotonic() + deadline
+    started = time.monotonic()
+    futures = [
+        _executor.submit(contextvars.copy_context().run, fetch_input, u, expires, max_bytes)
+        for u in urls
+    ]
+
+    pending = set(futures)
+    while pending:
+        remaining = expires - time.monotonic()
+        if remaining <= 0:
+            raise JobTimeout(f"input fetch exceeded {deadline:g}s")
+        done, pending = wait(pending, timeout=min(POLL_INTERVAL, remaining), return_when=FIRST_EXCEPTION)
+        for fut in done:
+            if fut.exception() is not None:
+                raise fut.exception()
+        if token is not None and token.cancelled:
+            raise JobCancelled(f"job {token.job_id} was cancelled")
+
+    results = [f.result() for f in futures]
+    timings = [r[2] for r in results]
+    total_ms = round((time.monotonic() - started) * 1000)
+    print(f"[inputs] fetched {len(urls)} inputs in {total_ms}ms: " + ", ".join(f"{t['bytes']}B/{t['ms']}ms/{t['cache']}" for t in timings))
+    return [r[0] for r in results], [r[1] for r in results], timings
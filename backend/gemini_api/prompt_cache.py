@@ -0,0 +1,220 @@
+# prompt_cache.py
+# Gemini context caching of the static prompt prefixes (the dress /
+# background instructions): a prompt that starts with a registered
+# prefix is sent as a reference to a cached content holding the prefix,
+# plus its own suffix. Caches are created on first use, their TTL is
+# extended while they are used and they are deleted on shutdown.
+# Prefixes under the model's minimum cache size, models without
+# caching and any provider error fall back to the plain prompt.
+# Off by default (GEMINI_PROMPT_CACHE=1 to turn it on): the current
+# prefixes are under the 1024 tokens minimum, they would be sent plain.
+import os
+import time
+import threading
+from typing import Dict, Optional, Tuple
+from google import genai
+from google.genai import types
+from queue_manager.cancellation import call_with_deadline, JobTimeout
+from resilience import call_with_retry
+
+# lifetime asked for a cache, extended when less than GEMINI_PROMPT_CACHE_MIN_TTL is left
+GEMINI_PROMPT_CACHE_TTL = int(os.getenv("GEMINI_PROMPT_CACHE_TTL", 3600))
+GEMINI_PROMPT_CACHE_MIN_TTL = float(os.getenv("GEMINI_PROMPT_CACHE_MIN_TTL", 300))
+# smallest cacheable content (1024 tokens on the flash models, more on pro)
+GEMINI_PROMPT_CACHE_MIN_TOKENS = int(os.getenv("GEMINI_PROMPT_CACHE_MIN_TOKENS", 1024))
+# seconds a prefix that could not be cached is sent plain before trying again
+GEMINI_PROMPT_CACHE_RETRY = float(os.getenv("GEMINI_PROMPT_CACHE_RETRY", 3600))
+# seconds a cache call (count, create, extend) may take before the prompt is sent plain
+GEMINI_PROMPT_CACHE_DEADLINE = float(os.getenv("GEMINI_PROMPT_CACHE_DEADLINE", 10))
+# weight of the last call in the latency averages
+LATENCY_ALPHA = 0.2
+
+
+def gemini_prompt_cache_enabled() -> bool:
+    return os.getenv("GEMINI_PROMPT_CACHE", "0").lower() in ("1", "true", "yes")
+
+
+class PromptCache:
+    '''
+    Cached contents of static prompt prefixes, per (model, prefix key).
+    prefixes: key -> prefix text (e.g. {"dress": dress_prompt}).
+    '''
+
+    def __init__(self, client: genai.Client, prefixes: Dict[str, str]):
+        self.client = client
+        # longest first, a prompt uses the longest prefix it starts with
+        self.prefixes = dict(sorted(prefixes.items(), key=lambda kv: -len(kv[1])))
+        self.lock = threading.Lock()
+        self.entries: Dict[Tuple[str, str], dict] = {}
+        self.tokens: Dict[Tuple[str, str], int] = {}
+        # (model, key) -> (reason, monotonic time to try again)
+        self.unavailable: Dict[Tuple[str, str], Tuple[str, float]] = {}
+        self.create_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        # mean latency of the plain and cached calls, per model
+        self.latency: Dict[Tuple[str, bool], float] = {}
+        self.counts = {"cached_calls": 0, "plain_calls": 0, "cached_tokens": 0, "created": 0, "extended": 0, "errors": 0, "deleted": 0}
+
+    def split(self, prompt: str) -> Optional[Tuple[str, str]]:
+        '''(prefix key, rest of the prompt) when prompt starts with a registered prefix.'''
+        for key, prefix in self.prefixes.items():
+            if prefix and prompt.startswith(prefix):
+                return key, prompt[len(prefix):].strip()
+        return None
+
+    def _create_lock(self, slot: Tuple[str, str]) -> threading.Lock:
+        with self.lock:
+            return self.create_locks.setdefault(slot, threading.Lock())
+
+    def _mark_unavailable(self, slot: Tuple[str, str], reason: str):
+        with self.lock:
+            self.unavailable[slot] = (reason, time.monotonic() + GEMINI_PROMPT_CACHE_RETRY)
+
+    def _count_tokens(self, model: str, key: str) -> int:
+        slot = (model, key)
+        with self.lock:
+            tokens = self.tokens.get(slot)
+        if tokens is None:
+            response = call_with_retry(
+                lambda: call_with_deadline(
+                    self.client.models.count_tokens, model=model, contents=self.prefixes[key],
+                    provider="gemini", deadline=GEMINI_PROMPT_CACHE_DEADLINE,
+                ),
+                provider="gemini",
+            )
+            tokens = response.total_tokens or 0
+            with self.lock:
+                self.tokens[slot] = tokens
+        return tokens
+
+    def _create(self, model: str, key: str) -> dict:
+        cache = call_with_retry(
+            lambda: call_with_deadline(
+                self.client.caches.create,
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    contents=[types.Content(role="user", parts=[types.Part.from_text(text=self.prefixes[key])])],
+                    ttl=f"{GEMINI_PROMPT_CACHE_TTL}s",
+                    display_name=f"prompt-{key}",
+                ),
+                provider="gemini",
+                deadline=GEMINI_PROMPT_CACHE_DEADLINE,
+            ),
+            provider="gemini",
+        )
+        entry = {"name": cache.name, "expires_at": time.time() + GEMINI_PROMPT_CACHE_TTL}
+        with self.lock:
+            self.counts["created"] += 1
+        print(f"[prompt-cache] cached the {key} prefix for {model} as {cache.name}")
+        return entry
+
+    def _extend(self, entry: dict) -> dict:
+        call_with_retry(
+            lambda: call_with_deadline(
+                self.client.caches.update,
+                name=entry["name"],
+                config=types.UpdateCachedContentConfig(ttl=f"{GEMINI_PROMPT_CACHE_TTL}s"),
+                provider="gemini",
+                deadline=GEMINI_PROMPT_CACHE_DEADLINE,
+            ),
+            provider="gemini",
+        )
+        with self.lock:
+            self.counts["extended"] += 1
+        return {**entry, "expires_at": time.time() + GEMINI_PROMPT_CACHE_TTL}
+
+    def cached_content(self, model: str, key: str) -> Tuple[Optional[str], str]:
+        '''
+        (cached content name, status) of a prefix for model. The name is
+        None when the prefix is sent plain; status says why
+        ("too_small", "unavailable", "disabled").
+        '''
+        if not gemini_prompt_cache_enabled():
+            return None, "disabled"
+        slot = (model, key)
+        with self.lock:
+            entry = self.entries.get(slot)
+            if entry is not None and entry["expires_at"] - time.time() > GEMINI_PROMPT_CACHE_MIN_TTL:
+                return entry["name"], "hit"
+            reason, retry_at = self.unavailable.get(slot, (None, 0.0))
+            if reason and time.monotonic() < retry_at:
+                return None, reason
+
+        # one creation / extension for the calls that need it at once
+        with self._create_lock(slot):
+            with self.lock:
+                entry = self.entries.get(slot)
+            if entry is not None and entry["expires_at"] - time.time() > GEMINI_PROMPT_CACHE_MIN_TTL:
+                return entry["name"], "hit"
+            try:
+                # still alive: extend it, expired: create a new one
+                if entry is not None and entry["expires_at"] > time.time():
+                    try:
+                        entry, status = self._extend(entry), "extended"
+                    except (Exception, JobTimeout) as e:
+                        print(f"[prompt-cache] could not extend {entry['name']}, creating a new one: {repr(e)}")
+                        entry = None
+                else:
+                    entry = None
+                if entry is None:
+                    tokens = self._count_tokens(model, key)
+                    if tokens < GEMINI_PROMPT_CACHE_MIN_TOKENS:
+                        self._mark_unavailable(slot, "too_small")
+                        print(f"[prompt-cache] {key} prefix is {tokens} tokens, under {GEMINI_PROMPT_CACHE_MIN_TOKENS}: sent plain")
+                        return None, "too_small"
+                    entry, status = self._create(model, key), "created"
+            except (Exception, JobTimeout) as e:
+                # a slow cache call must not cost the generation its deadline
+                with self.lock:
+                    self.counts["errors"] += 1
+                self._mark_unavailable(slot, "unavailable")
+                print(f"[prompt-cache] {key} prefix not cached for {model}, sent plain: {repr(e)}")
+                return None, "unavailable"
+            with self.lock:
+                self.entries[slot] = entry
+                self.unavailable.pop(slot, None)
+            return entry["name"], status
+
+    def invalidate(self, model: str, key: str):
+        '''The provider no longer knows the cache (deleted, expired): create it again next time.'''
+        with self.lock:
+            self.entries.pop((model, key), None)
+
+    def record(self, model: str, usage: dict):
+        '''
+        Account for a call ({"cached", "cached_tokens", "latency_ms"}) and
+        estimate its latency saving against the mean of the plain calls.
+        '''
+        cached = bool(usage.get("cached"))
+        with self.lock:
+            plain_mean = self.latency.get((model, False))
+            if cached and plain_mean is not None:
+                usage["saved_ms_estimate"] = round(plain_mean - usage["latency_ms"])
+            mean = self.latency.get((model, cached))
+            self.latency[(model, cached)] = usage["latency_ms"] if mean is None else mean + LATENCY_ALPHA * (usage["latency_ms"] - mean)
+            self.counts["cached_calls" if cached else "plain_calls"] += 1
+            self.counts["cached_tokens"] += usage.get("cached_tokens") or 0
+
+    def close(self):
+        '''Delete the caches of this process (they would expire on their own).'''
+        with self.lock:
+            entries = list(self.entries.values())
+            self.entries.clear()
+        for entry in entries:
+            try:
+                self.client.caches.delete(name=entry["name"])
+                with self.lock:
+                    self.counts["deleted"] += 1
+            except Exception as e:
+                print(f"[prompt-cache] could not delete {entry['name']}: {repr(e)}")
+
+    def stats(self) -> dict:
+        with self.lock:
+            now = time.monotonic()
+            return {
+                "enabled": gemini_prompt_cache_enabled(),
+                "caches": {f"{m}/{k}": e["name"] for (m, k), e in self.entries.items()},
+                "unavailable": {f"{m}/{k}": r for (m, k), (r, at) in self.unavailable.items() if at > now},
+                "prefix_tokens": {f"{m}/{k}": t for (m, k), t in self.tokens.items()},
+                "latency_ms": {f"{m}/{'cached' if c else 'plain'}": round(v) for (m, c), v in self.latency.items()},
+                **self.counts,
+            }
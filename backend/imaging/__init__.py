@@ -0,0 +1,6 @@
+from .process_pool import *
+from .transforms import *
+from .stage import *
+from .cache import *
+from .renditions import *
+from .probe import *
@@ -0,0 +1,140 @@
+# benchmark.py
+# Latency of a light "request" handler while CPU-bound transforms run,
+# in job threads (GIL contention) vs in the transform process pool.
+#
+#   python -m imaging.benchmark                  # synthetic pure-python transform
+#   python -m imaging.benchmark --transform reencode --size 2048
+#
+# Prints p50 / p95 / p99 / max of the request latency per phase.
+import io
+import json
+import time
+import argparse
+import threading
+import statistics
+from typing import List, Tuple
+from .process_pool import TransformPool
+
+
+def burn(data: bytes, mimetype: str, rounds: int = 40) -> Tuple[bytes, str]:
+    '''Synthetic CPU-bound transform: pure python, holds the GIL.'''
+    acc = 0
+    for _ in range(rounds):
+        for b in data[:200_000]:
+            acc = (acc * 31 + b) & 0xFFFFFFFF
+    return data[:16] + acc.to_bytes(4, "big"), mimetype
+
+
+def _sample_image(size: int) -> Tuple[bytes, str]:
+    from PIL import Image
+    import os as _os
+    img = Image.frombytes("RGB", (size, size), _os.urandom(size * size * 3))
+    out = io.BytesIO()
+    img.save(out, format="PNG")
+    return out.getvalue(), "image/png"
+
+
+def _request():
+    # what a status request does: build and serialize a small document
+    doc = {"job_id": "x", "status": "running", "results": [{"i": i, "url": f"https://x/{i}"} for i in range(50)]}
+    return json.dumps(doc)
+
+
+def _probe(stop: threading.Event, latencies: List[float], interval: float):
+    # latency counts from when the request is due, so the wait
+    # for the GIL before the handler runs is included
+    while not stop.is_set():
+        due = time.perf_counter() + interval
+        time.sleep(interval)
+        _request()
+        latencies.append((time.perf_counter() - due) * 1000)
+
+
+def _phase(name: str, run_transforms, jobs: int, interval: float) -> dict:
+    latencies: List[float] = []
+    stop = threading.Event()
+    probe = threading.Thread(target=_probe, args=(stop, latencies, interval), daemon=True)
+    probe.start()
+
+    started = time.perf_counter()
+    run_transforms(jobs)
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    probe.join()
+    ordered = sorted(latencies)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    return {
+        "phase": name,
+        "transforms_s": round(elapsed, 2),
+        "requests": len(ordered),
+        "p50_ms": round(statistics.median(ordered), 3),
+        "p95_ms": round(pct(95), 3),
+        "p99_ms": round(pct(99), 3),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="request latency while transforms run")
+    parser.add_argument("--transform", default="burn", help="burn (synthetic) or a name of imaging.TRANSFORMS")
+    parser.add_argument("--size", type=int, default=1024, help="side of the sample image (Pillow transforms)")
+    parser.add_argument("--jobs", type=int, default=8, help="transforms per phase")
+    parser.add_argument("--threads", type=int, default=4, help="job threads, like the scheduler")
+    parser.add_argument("--workers", type=int, default=2, help="transform pool processes")
+    parser.add_argument("--interval", type=float, default=0.005, help="seconds between two requests")
+    args = parser.parse_args()
+
+    if args.transform == "burn":
+        fn, (data, mimetype) = burn, (bytes(range(256)) * 800, "application/octet-stream")
+    else:
+        from .transforms import TRANSFORMS
+        fn, (data, mimetype) = TRANSFORMS[args.transform], _sample_image(args.size)
+    steps = [(fn, {})]
+    pool = TransformPool(workers=args.workers)
+
+    def in_threads(jobs):
+        def worker(n):
+            for _ in range(n):
+                fn(data, mimetype)
+        per_thread = [jobs // args.threads + (1 if i < jobs % args.threads else 0) for i in range(args.threads)]
+        threads = [threading.Thread(target=worker, args=(n,)) for n in per_thread]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def in_pool(jobs):
+        def worker(n):
+            for _ in range(n):
+                pool.run(steps, data, mimetype)
+        per_thread = [jobs // args.threads + (1 if i < jobs % args.threads else 0) for i in range(args.threads)]
+        threads = [threading.Thread(target=worker, args=(n,)) for n in per_thread]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    # start the workers before measuring
+    pool.run(steps, data, mimetype)
+
+    rows = [
+        _phase("idle", lambda jobs: time.sleep(1), args.jobs, args.interval),
+        _phase("job threads", in_threads, args.jobs, args.interval),
+        _phase("process pool", in_pool, args.jobs, args.interval),
+    ]
+    pool.shutdown()
+
+    print(f"transform={args.transform} jobs={args.jobs} threads={args.threads} workers={args.workers}")
+    for row in rows:
+        print(
+            f"{row['phase']:<13} transforms {row['transforms_s']:>6}s  requests {row['requests']:>5}  "
+            f"p50 {row['p50_ms']:>8}ms  p95 {row['p95_ms']:>8}ms  p99 {row['p99_ms']:>8}ms  max {row['max_ms']:>8}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
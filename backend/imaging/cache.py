@@ -0,0 +1,331 @@
+# cache.py
+# Two-tier cache of image bytes: a memory LRU with a byte budget, and
+# a disk tier that takes what the memory evicts (LRU by mtime, byte
+# budget too). Content is stored once by sha256, named references
+# (e.g. a GCS object and its generation) point to it, so copies of an
+# object (gallery, models) share one entry. The disk tier is off by
+# default: on Cloud Run /tmp is memory, give it a real disk
+# (INPUT_CACHE_DIR) and a budget (INPUT_CACHE_DISK_BYTES) to use it.
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+INPUT_CACHE_MEMORY_BYTES = int(os.getenv("INPUT_CACHE_MEMORY_BYTES", 256 * 1024 * 1024))
+INPUT_CACHE_DISK_BYTES = int(os.getenv("INPUT_CACHE_DISK_BYTES", 0))
+INPUT_CACHE_DIR = os.getenv("INPUT_CACHE_DIR", "/tmp/input-cache")
+# references kept in memory, the rest is read back from disk
+INPUT_CACHE_MAX_REFS = 10_000
+# reference files kept on disk, the oldest are removed (and so are the
+# ones of content evicted from the disk)
+INPUT_CACHE_MAX_REF_FILES = int(os.getenv("INPUT_CACHE_MAX_REF_FILES", 50_000))
+
+
+def input_cache_enabled() -> bool:
+    return os.getenv("INPUT_CACHE", "1").lower() in ("1", "true", "yes")
+
+
+def content_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+@dataclass
+class CacheRef:
+    '''What a name (e.g. gcs:<object>) resolves to.'''
+    digest: str
+    mimetype: Optional[str] = None
+    generation: Optional[str] = None
+    etag: Optional[str] = None
+    # last time the origin confirmed the content (time.time())
+    validated: float = 0.0
+    # header probe of the content (imaging.probe), so it is not probed again
+    image: Optional[Dict[str, Any]] = None
+
+
+class ByteCache:
+
+    def __init__(self, directory: str, memory_bytes: int, disk_bytes: int):
+        self.directory = directory
+        self.memory_budget = memory_bytes
+        self.disk_budget = disk_bytes
+        self.lock = threading.Lock()
+        self.memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self.memory_size = 0
+        self.disk: "OrderedDict[str, int]" = OrderedDict()
+        self.disk_size = 0
+        self.refs: "OrderedDict[str, CacheRef]" = OrderedDict()
+        # reference files on disk (oldest first) -> digest, and digest -> its reference files
+        self.ref_files: "OrderedDict[str, str]" = OrderedDict()
+        self.digest_refs: Dict[str, Set[str]] = {}
+        self.counts = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "spilled": 0, "evicted": 0}
+        self.disk_ok = self._scan()
+
+    # ---- disk layout: <dir>/blobs/<digest>, <dir>/refs/<sha1 of name>.json
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.directory, "blobs", digest)
+
+    def _ref_file(self, name: str) -> str:
+        return hashlib.sha1(name.encode("utf-8")).hexdigest() + ".json"
+
+    def _ref_path(self, name: str) -> str:
+        return os.path.join(self.directory, "refs", self._ref_file(name))
+
+    def _scan(self) -> bool:
+        '''Rebuild the disk index, oldest first. False if the disk tier is unusable.'''
+        if self.disk_budget <= 0:
+            return False
+        try:
+            os.makedirs(os.path.join(self.directory, "blobs"), exist_ok=True)
+            os.makedirs(os.path.join(self.directory, "refs"), exist_ok=True)
+            entries = []
+            for entry in os.scandir(os.path.join(self.directory, "blobs")):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, entry.name, st.st_size))
+        except OSError as e:
+            print(f"[cache] disk tier disabled ({self.directory}): {repr(e)}")
+            return False
+        for _, digest, size in sorted(entries):
+            self.disk[digest] = size
+            self.disk_size += size
+
+        # references, dropping the ones whose content is gone
+        refs, stale = [], []
+        try:
+            for entry in os.scandir(os.path.join(self.directory, "refs")):
+                if not entry.is_file():
+                    continue
+                if not entry.name.endswith(".json"):
+                    # left over by an interrupted write
+                    stale.append(entry.name)
+                    continue
+                try:
+                    with open(entry.path) as f:
+                        digest = json.load(f).get("digest")
+                    refs.append((entry.stat().st_mtime, entry.name, digest))
+                except (OSError, ValueError, AttributeError):
+                    stale.append(entry.name)
+        except OSError as e:
+            print(f"[cache] could not read the references: {repr(e)}")
+        for _, filename, digest in sorted(refs):
+            if digest in self.disk:
+                self._index_ref_file(filename, digest)
+            else:
+                stale.append(filename)
+        self._remove_ref_files(stale + self._trim_ref_files())
+        return True
+
+    # ---- reference files, pruned with the content they point to
+
+    def _index_ref_file(self, filename: str, digest: str):
+        old = self.ref_files.pop(filename, None)
+        if old is not None and old != digest:
+            self.digest_refs.get(old, set()).discard(filename)
+        self.ref_files[filename] = digest
+        self.digest_refs.setdefault(digest, set()).add(filename)
+
+    def _unindex_digest(self, digest: str) -> List[str]:
+        filenames = list(self.digest_refs.pop(digest, ()))
+        for filename in filenames:
+            self.ref_files.pop(filename, None)
+        return filenames
+
+    def _trim_ref_files(self) -> List[str]:
+        drop = []
+        while len(self.ref_files) > INPUT_CACHE_MAX_REF_FILES:
+            filename, digest = self.ref_files.popitem(last=False)
+            self.digest_refs.get(digest, set()).discard(filename)
+            drop.append(filename)
+        return drop
+
+    def _remove_ref_files(self, filenames: List[str]):
+        for filename in filenames:
+            try:
+                os.remove(os.path.join(self.directory, "refs", filename))
+            except OSError:
+                pass
+
+    def _write_file(self, path: str, data: bytes):
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _spill(self, items: List[Tuple[str, bytes]]):
+        '''Write what the memory evicted to disk, then evict the disk down to its budget.'''
+        if not self.disk_ok:
+            with self.lock:
+                self.counts["evicted"] += len(items)
+            return
+        for digest, data in items:
+            with self.lock:
+                on_disk = digest in self.disk
+            if on_disk:
+                continue
+            try:
+                self._write_file(self._blob_path(digest), data)
+            except OSError as e:
+                print(f"[cache] could not spill {digest[:12]}: {repr(e)}")
+                continue
+            with self.lock:
+                self.disk[digest] = len(data)
+                self.disk_size += len(data)
+                self.counts["spilled"] += 1
+
+        drop, drop_refs = [], []
+        with self.lock:
+            while self.disk_size > self.disk_budget and self.disk:
+                digest, size = self.disk.popitem(last=False)
+                self.disk_size -= size
+                self.counts["evicted"] += 1
+                drop.append(digest)
+                drop_refs.extend(self._unindex_digest(digest))
+        for digest in drop:
+            try:
+                os.remove(self._blob_path(digest))
+            except OSError:
+                pass
+        self._remove_ref_files(drop_refs)
+
+    # ---- content
+
+    def get(self, digest: str) -> Optional[bytes]:
+        with self.lock:
+            data = self.memory.get(digest)
+            if data is not None:
+                self.memory.move_to_end(digest)
+                self.counts["memory_hits"] += 1
+                return data
+            on_disk = digest in self.disk
+
+        if on_disk:
+            try:
+                path = self._blob_path(digest)
+                with open(path, "rb") as f:
+                    data = f.read()
+                os.utime(path)
+            except OSError:
+                with self.lock:
+                    self.disk_size -= self.disk.pop(digest, 0)
+                data = None
+            if data is not None and content_digest(data) == digest:
+                with self.lock:
+                    if digest in self.disk:
+                        self.disk.move_to_end(digest)
+                    self.counts["disk_hits"] += 1
+                # hot again: back into memory
+                self._remember(digest, data)
+                return data
+            if data is not None:
+                # truncated / corrupted file
+                with self.lock:
+                    self.disk_size -= self.disk.pop(digest, 0)
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+        with self.lock:
+            self.counts["misses"] += 1
+        return None
+
+    def _remember(self, digest: str, data: bytes):
+        if len(data) > self.memory_budget:
+            self._spill([(digest, data)])
+            return
+        evicted = []
+        with self.lock:
+            if digest not in self.memory:
+                self.memory[digest] = data
+                self.memory_size += len(data)
+            self.memory.move_to_end(digest)
+            while self.memory_size > self.memory_budget:
+                old, old_data = self.memory.popitem(last=False)
+                self.memory_size -= len(old_data)
+                evicted.append((old, old_data))
+        if evicted:
+            self._spill(evicted)
+
+    def put(self, data: bytes) -> str:
+        '''Store data, returns its digest.'''
+        digest = content_digest(data)
+        self._remember(digest, data)
+        return digest
+
+    # ---- named references
+
+    def ref(self, name: str) -> Optional[CacheRef]:
+        with self.lock:
+            ref = self.refs.get(name)
+            if ref is not None:
+                self.refs.move_to_end(name)
+                return ref
+        if not self.disk_ok:
+            return None
+        try:
+            with open(self._ref_path(name)) as f:
+                ref = CacheRef(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+        self._keep_ref(name, ref)
+        return ref
+
+    def _keep_ref(self, name: str, ref: CacheRef):
+        with self.lock:
+            self.refs[name] = ref
+            self.refs.move_to_end(name)
+            while len(self.refs) > INPUT_CACHE_MAX_REFS:
+                self.refs.popitem(last=False)
+
+    def set_ref(self, name: str, ref: CacheRef):
+        self._keep_ref(name, ref)
+        if self.disk_ok:
+            try:
+                self._write_file(self._ref_path(name), json.dumps(asdict(ref)).encode("utf-8"))
+            except OSError as e:
+                print(f"[cache] could not write ref {name}: {repr(e)}")
+                return
+            with self.lock:
+                self._index_ref_file(self._ref_file(name), ref.digest)
+                drop = self._trim_ref_files()
+            self._remove_ref_files(drop)
+
+    def lookup(self, name: str) -> Tuple[Optional[CacheRef], Optional[bytes]]:
+        '''(ref, bytes) of a name; bytes is None when the content is gone.'''
+        ref = self.ref(name)
+        if ref is None:
+            return None, None
+        return ref, self.get(ref.digest)
+
+    def store(self, name: str, data: bytes, **fields) -> CacheRef:
+        '''Store data under name (fields: mimetype, generation, etag, image).'''
+        ref = CacheRef(digest=self.put(data), validated=time.time(), **fields)
+        self.set_ref(name, ref)
+        return ref
+
+    def touch(self, name: str, ref: CacheRef):
+        '''The origin confirmed the content of name is unchanged.'''
+        ref.validated = time.time()
+        self.set_ref(name, ref)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "memory_items": len(self.memory),
+                "memory_bytes": self.memory_size,
+                "memory_budget": self.memory_budget,
+                "disk_items": len(self.disk),
+                "disk_bytes": self.disk_size,
+                "disk_budget": self.disk_budget if self.disk_ok else 0,
+                "refs": len(self.refs),
+                "ref_files": len(self.ref_files),
+                **self.counts,
+            }
+
+
+input_cache = ByteCache(INPUT_CACHE_DIR, INPUT_CACHE_MEMORY_BYTES, INPUT_CACHE_DISK_BYTES)
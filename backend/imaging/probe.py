@@ -0,0 +1,192 @@
+# probe.py
+# Header-only image probing: format, dimensions and EXIF orientation are
+# read from the first bytes (magic numbers and the header structures of
+# PNG / JPEG / WebP / GIF), without decoding. Used to reject corrupt or
+# oversized inputs and uploads early and to trust the content over
+# file names and Content-Type headers.
+import os
+import struct
+from typing import Any, Dict, Optional
+
+# decoded size limit (decompression bombs, useless resolutions)
+INPUT_MAX_PIXELS = int(os.getenv("INPUT_MAX_PIXELS", 50_000_000))
+# the header of any supported file fits in this many bytes
+PROBE_MAX_HEAD = 512 * 1024
+
+FORMAT_MIMETYPES = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+    "GIF": "image/gif",
+}
+FORMAT_EXTENSIONS = {
+    "PNG": ".png",
+    "JPEG": ".jpg",
+    "WEBP": ".webp",
+    "GIF": ".gif",
+}
+
+# JPEG start-of-frame markers (they carry the dimensions)
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class InvalidImage(ValueError):
+    """Not an image of a supported format, or a corrupt one."""
+
+
+class ImageTooLarge(InvalidImage):
+    """More pixels than INPUT_MAX_PIXELS."""
+
+
+class NeedMoreData(Exception):
+    """The header is not complete in the bytes given so far."""
+
+
+def _need(data: bytes, size: int):
+    if len(data) < size:
+        raise NeedMoreData()
+
+
+def _exif_orientation(segment: bytes) -> Optional[int]:
+    # APP1 payload: b"Exif\0\0" + TIFF header + IFD0
+    if not segment.startswith(b"Exif\x00\x00"):
+        return None
+    tiff = segment[6:]
+    if len(tiff) < 8 or tiff[:2] not in (b"II", b"MM"):
+        return None
+    endian = "<" if tiff[:2] == b"II" else ">"
+    (ifd,) = struct.unpack(endian + "I", tiff[4:8])
+    if ifd + 2 > len(tiff):
+        return None
+    (count,) = struct.unpack(endian + "H", tiff[ifd:ifd + 2])
+    for i in range(count):
+        entry = tiff[ifd + 2 + i * 12: ifd + 14 + i * 12]
+        if len(entry) < 12:
+            return None
+        tag, kind = struct.unpack(endian + "HH", entry[:4])
+        if tag == 0x0112 and kind == 3:
+            (value,) = struct.unpack(endian + "H", entry[8:10])
+            return value if 1 <= value <= 8 else None
+    return None
+
+
+def _probe_png(data: bytes) -> Dict[str, Any]:
+    _need(data, 24)
+    if data[12:16] != b"IHDR":
+        raise InvalidImage("PNG without IHDR header")
+    width, height = struct.unpack(">II", data[16:24])
+    return {"format": "PNG", "width": width, "height": height}
+
+
+def _probe_gif(data: bytes) -> Dict[str, Any]:
+    _need(data, 10)
+    width, height = struct.unpack("<HH", data[6:10])
+    return {"format": "GIF", "width": width, "height": height}
+
+
+def _probe_webp(data: bytes) -> Dict[str, Any]:
+    _need(data, 30)
+    chunk = data[12:16]
+    if chunk == b"VP8 ":
+        if data[23:26] != b"\x9d\x01\x2a":
+            raise InvalidImage("WebP (VP8) without a key frame")
+        width, height = struct.unpack("<HH", data[26:30])
+        width, height = width & 0x3FFF, height & 0x3FFF
+    elif chunk == b"VP8L":
+        if data[20] != 0x2F:
+            raise InvalidImage("WebP (VP8L) with a bad signature")
+        (bits,) = struct.unpack("<I", data[21:25])
+        width, height = (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    elif chunk == b"VP8X":
+        width = int.from_bytes(data[24:27], "little") + 1
+        height = int.from_bytes(data[27:30], "little") + 1
+    else:
+        raise InvalidImage(f"WebP with unknown chunk {chunk!r}")
+    return {"format": "WEBP", "width": width, "height": height}
+
+
+def _probe_jpeg(data: bytes) -> Dict[str, Any]:
+    orientation = None
+    pos = 2
+    while True:
+        _need(data, pos + 4)
+        if data[pos] != 0xFF:
+            raise InvalidImage("JPEG with a broken marker sequence")
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # fill byte
+            pos += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            raise InvalidImage("JPEG without a frame header")
+        (length,) = struct.unpack(">H", data[pos + 2:pos + 4])
+        if length < 2:
+            raise InvalidImage("JPEG with a bad segment length")
+        if marker in _SOF_MARKERS:
+            _need(data, pos + 9)
+            height, width = struct.unpack(">HH", data[pos + 5:pos + 9])
+            return {"format": "JPEG", "width": width, "height": height, "orientation": orientation}
+        if marker == 0xE1 and orientation is None:
+            _need(data, pos + 2 + length)
+            orientation = _exif_orientation(data[pos + 4:pos + 2 + length])
+        pos += 2 + length
+
+
+def probe_image(data: bytes, max_pixels: int = INPUT_MAX_PIXELS) -> Dict[str, Any]:
+    '''
+    {"format", "mimetype", "width", "height", "orientation"} of an image
+    from its first bytes (a prefix is enough). Raises NeedMoreData when
+    the prefix ends inside the header, InvalidImage / ImageTooLarge.
+    '''
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        info = _probe_png(data)
+    elif data[:3] == b"\xff\xd8\xff":
+        info = _probe_jpeg(data)
+    elif data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        info = _probe_webp(data)
+    elif data[:6] in (b"GIF87a", b"GIF89a"):
+        info = _probe_gif(data)
+    elif len(data) < 12:
+        raise NeedMoreData()
+    else:
+        raise InvalidImage("not a PNG, JPEG, WebP or GIF image")
+
+    if not info["width"] or not info["height"]:
+        raise InvalidImage(f"{info['format']} with empty dimensions")
+    if info["width"] * info["height"] > max_pixels:
+        raise ImageTooLarge(f"{info['width']}x{info['height']} is over the {max_pixels} pixels limit")
+    info.setdefault("orientation", None)
+    info["mimetype"] = FORMAT_MIMETYPES[info["format"]]
+    return info
+
+
+def probe_complete(data: bytes, max_pixels: int = INPUT_MAX_PIXELS) -> Dict[str, Any]:
+    '''probe_image for a whole file: a header cut short is invalid too.'''
+    try:
+        return probe_image(data, max_pixels)
+    except NeedMoreData:
+        raise InvalidImage("truncated image header")
+
+
+def info_to_metadata(info: Dict[str, Any]) -> Dict[str, str]:
+    '''Probe result as GCS object metadata (strings), so readers skip the probe.'''
+    return {f"image_{k}": str(v) for k, v in info.items() if v is not None}
+
+
+def info_from_metadata(metadata: Optional[Dict[str, str]]) -> Optional[Dict[str, Any]]:
+    if not metadata or "image_format" not in metadata:
+        return None
+    try:
+        orientation = metadata.get("image_orientation")
+        return {
+            "format": metadata["image_format"],
+            "mimetype": metadata["image_mimetype"],
+            "width": int(metadata["image_width"]),
+            "height": int(metadata["image_height"]),
+            "orientation": int(orientation) if orientation else None,
+        }
+    except (KeyError, ValueError):
+        return None
@@ -0,0 +1,119 @@
+# process_pool.py
+# Process pool for CPU-bound image work (decode / resize / re-encode),
+# so it does not hold the GIL against the request and job threads.
+# Image bytes cross the process boundary through shared memory, only
+# the segment names and the transform references are pickled.
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from queue_manager.cancellation import current_token, JobCancelled, POLL_INTERVAL
+
+# a transform is a top-level function fn(data, mimetype, **params) -> (data, mimetype)
+Transform = Callable[..., Tuple[bytes, str]]
+Step = Tuple[Transform, Dict[str, Any]]
+
+TRANSFORM_WORKERS = int(os.getenv("TRANSFORM_WORKERS", min(2, os.cpu_count() or 1)))
+# forkserver: workers do not inherit the threads / grpc channels of the app
+TRANSFORM_START_METHOD = os.getenv("TRANSFORM_START_METHOD", "forkserver")
+
+
+def _to_shared(data: bytes) -> SharedMemory:
+    shm = SharedMemory(create=True, size=max(1, len(data)))
+    shm.buf[:len(data)] = data
+    return shm
+
+
+def _from_shared(name: str, size: int, unlink: bool = True) -> bytes:
+    shm = SharedMemory(name=name)
+    try:
+        return bytes(shm.buf[:size])
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+
+
+def _run_steps(in_name: str, in_size: int, mimetype: str, steps: List[Step]) -> Tuple[str, int, str]:
+    # runs in a worker process: read the input segment, write the output to a new one
+    data = _from_shared(in_name, in_size, unlink=False)
+    for fn, params in steps:
+        data, mimetype = fn(data, mimetype, **params)
+    out = _to_shared(data)
+    out.close()
+    return out.name, len(data), mimetype
+
+
+def _discard_output(fut):
+    # the caller gave up (cancel): drop the segment the worker created
+    try:
+        name, size, _ = fut.result()
+        _from_shared(name, 0)
+    except Exception:
+        pass
+
+
+class TransformPool:
+
+    def __init__(self, workers: int = TRANSFORM_WORKERS, start_method: str = TRANSFORM_START_METHOD):
+        self.workers = max(1, workers)
+        self.start_method = start_method
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.busy = 0
+
+    def executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                )
+            return self._executor
+
+    def run(self, steps: List[Step], data: bytes, mimetype: str) -> Tuple[bytes, str]:
+        '''
+        Apply steps to the image in a worker process, blocks the calling
+        thread (not the GIL) until done. Interrupted by job cancel.
+        '''
+        if not steps:
+            return data, mimetype
+
+        token = current_token()
+        shm = _to_shared(data)
+        with self._lock:
+            self.submitted += 1
+            self.busy += 1
+        try:
+            fut = self.executor().submit(_run_steps, shm.name, len(data), mimetype, steps)
+            while True:
+                try:
+                    out_name, out_size, out_mime = fut.result(timeout=POLL_INTERVAL)
+                    break
+                except FutureTimeout:
+                    if token is not None and token.cancelled:
+                        fut.add_done_callback(_discard_output)
+                        raise JobCancelled(f"job {token.job_id} was cancelled")
+        finally:
+            with self._lock:
+                self.busy -= 1
+            shm.close()
+            shm.unlink()
+
+        return _from_shared(out_name, out_size), out_mime
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"workers": self.workers, "submitted": self.submitted, "busy": self.busy}
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+transform_pool = TransformPool()
@@ -0,0 +1,81 @@
+# renditions.py
+# Model input renditions: inputs are downscaled to what the model can
+# use, EXIF-oriented and re-encoded (transforms.prepare_input) before
+# they are sent. The targets are declared per model (ModelConfig), the
+# renditions are kept in the input cache by source content and target.
+# Inputs whose header probe (imaging.probe) shows there is nothing to
+# do are returned as they are, without a decode in the transform pool.
+import os
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from .cache import input_cache, content_digest
+from .process_pool import transform_pool
+from .transforms import prepare_input
+
+
+def input_renditions_enabled() -> bool:
+    return os.getenv("INPUT_RENDITIONS", "1").lower() in ("1", "true", "yes")
+
+
+def spec_key(spec: Dict[str, Any]) -> str:
+    return ",".join(f"{k}={spec[k]}" for k in sorted(spec))
+
+
+def rendition_name(data: bytes, spec: Dict[str, Any]) -> str:
+    '''Cache name of the rendition of data for spec, also usable as a storage key.'''
+    return f"rendition:{content_digest(data)}:{spec_key(spec)}"
+
+
+def unchanged(image: Optional[Dict[str, Any]], spec: Dict[str, Any]) -> bool:
+    '''Whether prepare_input would return an input with this probe result as is.'''
+    # orientation is only read from JPEG headers, other formats go through the pool
+    if not image or image.get("format") != "JPEG":
+        return False
+    fmt = spec.get("format", "JPEG").upper()
+    return (
+        fmt in ("JPEG", "JPG")
+        and (image.get("orientation") or 1) == 1
+        and max(image["width"], image["height"]) <= spec.get("max_side", 1536)
+    )
+
+
+def rendition(data: bytes, mimetype: str, spec: Dict[str, Any], image: Optional[Dict[str, Any]] = None) -> Tuple[bytes, str]:
+    '''prepare_input(data, **spec) in the transform pool, cached. image: probe of data.'''
+    if unchanged(image, spec):
+        return data, mimetype
+    name = rendition_name(data, spec)
+    ref, cached = input_cache.lookup(name)
+    if cached is not None:
+        return cached, ref.mimetype
+    out, out_mimetype = transform_pool.run([(prepare_input, spec)], data, mimetype)
+    input_cache.store(name, out, mimetype=out_mimetype)
+    return out, out_mimetype
+
+
+def renditions(
+    items: List[Tuple[bytes, str]],
+    spec: Optional[Dict[str, Any]],
+    images: Optional[List[Optional[Dict[str, Any]]]] = None,
+) -> List[Tuple[bytes, str]]:
+    '''
+    Renditions of (bytes, mimetype) items for a model input spec,
+    in parallel. Items are returned as is without a spec.
+    images are the probe results of the items, when known.
+    '''
+    if not spec or not items or not input_renditions_enabled():
+        return list(items)
+
+    started = time.monotonic()
+    images = images or [None] * len(items)
+    if len(items) == 1:
+        out = [rendition(items[0][0], items[0][1], spec, images[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=len(items), thread_name_prefix="rendition") as ex:
+            futures = [ex.submit(contextvars.copy_context().run, rendition, d, m, spec, i) for (d, m), i in zip(items, images)]
+            out = [f.result() for f in futures]
+
+    before, after = sum(len(d) for d, _ in items), sum(len(d) for d, _ in out)
+    print(f"[renditions] {len(items)} inputs {before / 1e6:.1f}MB -> {after / 1e6:.1f}MB in {(time.monotonic() - started) * 1000:.0f}ms ({spec_key(spec)})")
+    return out
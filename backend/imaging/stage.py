@@ -0,0 +1,42 @@
+# stage.py
+# The transform stage of the job pipelines: generated images go through
+# the steps of RESULT_TRANSFORMS in the process pool before upload, e.g.
+#   RESULT_TRANSFORMS="resize_max:max_side=2048;reencode:format=WEBP,quality=90"
+import os
+from typing import Any, Dict, List, Tuple
+from .process_pool import transform_pool, Step
+from .transforms import TRANSFORMS
+
+
+def _param(value: str) -> Any:
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def parse_steps(spec: str) -> List[Step]:
+    '''"name:key=value,key=value;name2" -> [(fn, params), ...]'''
+    steps = []
+    for part in filter(None, (p.strip() for p in spec.split(";"))):
+        name, _, args = part.partition(":")
+        if name not in TRANSFORMS:
+            raise ValueError(f"unknown transform '{name}', expected one of {sorted(TRANSFORMS)}")
+        params: Dict[str, Any] = {}
+        for arg in filter(None, args.split(",")):
+            key, _, value = arg.partition("=")
+            params[key.strip()] = _param(value.strip())
+        steps.append((TRANSFORMS[name], params))
+    return steps
+
+
+def result_steps() -> List[Step]:
+    return parse_steps(os.getenv("RESULT_TRANSFORMS", ""))
+
+
+def apply_result_transforms(data: bytes, mimetype: str) -> Tuple[bytes, str]:
+    '''Run the configured result transforms, unchanged when there are none.'''
+    steps = result_steps()
+    if not steps or not data:
+        return data, mimetype
+    return transform_pool.run(steps, data, mimetype)
@@ -0,0 +1,87 @@
+# transforms.py
+# CPU-bound image transforms, run in the transform pool.
+# Each one is fn(data, mimetype, **params) -> (data, mimetype) and
+# must stay a top-level function (workers import it by name).
+import io
+from typing import Callable, Dict, Tuple
+from PIL import Image, ImageOps
+
+FORMAT_MIMETYPES = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+}
+
+
+def _save(img, fmt: str, quality: int = 90) -> Tuple[bytes, str]:
+    fmt = fmt.upper()
+    if fmt == "JPG":
+        fmt = "JPEG"
+    if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    out = io.BytesIO()
+    params = {"optimize": True} if fmt == "PNG" else {"quality": quality}
+    img.save(out, format=fmt, **params)
+    return out.getvalue(), FORMAT_MIMETYPES.get(fmt, f"image/{fmt.lower()}")
+
+
+def reencode(data: bytes, mimetype: str, format: str = "WEBP", quality: int = 90) -> Tuple[bytes, str]:
+    '''Re-encode to another format (smaller results, faster downloads).'''
+    with Image.open(io.BytesIO(data)) as img:
+        img.load()
+        return _save(img, format, quality)
+
+
+def resize_max(data: bytes, mimetype: str, max_side: int = 2048, quality: int = 90) -> Tuple[bytes, str]:
+    '''Downscale so that the longest side is at most max_side, same format.'''
+    with Image.open(io.BytesIO(data)) as img:
+        if max(img.size) <= max_side:
+            return data, mimetype
+        fmt = img.format or "PNG"
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+        return _save(img, fmt, quality)
+
+
+def exif_transpose(data: bytes, mimetype: str) -> Tuple[bytes, str]:
+    '''Apply the EXIF orientation to the pixels (and drop it).'''
+    with Image.open(io.BytesIO(data)) as img:
+        orientation = img.getexif().get(0x0112, 1)
+        if orientation == 1:
+            return data, mimetype
+        fmt = img.format or "PNG"
+        return _save(ImageOps.exif_transpose(img), fmt)
+
+
+def prepare_input(data: bytes, mimetype: str, max_side: int = 1536, format: str = "JPEG", quality: int = 90) -> Tuple[bytes, str]:
+    '''
+    Model input in one decode: EXIF orientation applied, longest side
+    at most max_side, re-encoded to format (WEBP when JPEG would drop
+    transparency). Unchanged when there is nothing to do.
+    '''
+    fmt = format.upper()
+    if fmt == "JPG":
+        fmt = "JPEG"
+    with Image.open(io.BytesIO(data)) as img:
+        orientation = img.getexif().get(0x0112, 1)
+        if orientation == 1 and max(img.size) <= max_side and img.format == fmt:
+            return data, mimetype
+        # jpeg: let the decoder scale down by 2/4/8 (much faster than full size)
+        img.draft("RGB", (max_side, max_side))
+        out = ImageOps.exif_transpose(img)
+        out.thumbnail((max_side, max_side), Image.LANCZOS)
+        if fmt == "JPEG" and (out.mode in ("RGBA", "LA") or "transparency" in out.info):
+            fmt = "WEBP"
+        return _save(out, fmt, quality)
+
+
+TRANSFORMS: Dict[str, Callable[..., Tuple[bytes, str]]] = {
+    "reencode": reencode,
+    "resize_max": resize_max,
+    "exif_transpose": exif_transpose,
+    "prepare_input": prepare_input,
+}
+
+
+def register_transform(name: str, fn: Callable[..., Tuple[bytes, str]]):
+    '''Make a (top-level) transform available to RESULT_TRANSFORMS.'''
+    TRANSFORMS[name] = fn
@@ -1,3 +1,13 @@
 from .replicate_jobs import *
+from .gemini_files import *
+from .prompt_cache import *
 from .nano_banana_job import *
-from .gemini_jobs import *
\ No newline at end of file
+from .gemini_jobs import *
+from .fanout_jobs import *
+from .async_jobs import *
+from .registry import *
+from .dedup import *
+from .interrupts import *
+from .router import *
+from .result_uploads import *
+from .prestage import *
\ No newline at end of file
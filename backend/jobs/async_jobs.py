@@ -0,0 +1,51 @@
+# async_jobs.py
+import asyncio
+from google.genai import errors
+from gemini_api import generate_image_async
+from firestore import jobs_update
+from .gemini_jobs import prepare_gemini_job_update, handle_error, GEMINI_IMAGE_MODEL
+from queue_manager.cancellation import check_cancelled
+from .interrupts import interruptible
+from .result_uploads import partial_results_writer
+from .gemini_files import gemini_files
+from .prompt_cache import prompt_cache
+
+from app import gemini_client
+
+
+@interruptible
+async def run_gemini_nano_banana_job_async(db, job_id: str, uid: str, media: dict, prompt: str):
+    '''
+    Coroutine twin of run_gemini_nano_banana_job. The generation is awaited
+    on the genai async client; Firestore and GCS writes are still blocking
+    and run in the default thread pool.
+    '''
+    print(f"updating job {job_id}")
+    await asyncio.to_thread(jobs_update, db, job_id, uid, {"status": "running"})
+
+    try:
+        prompt_usage = []
+        img_bytes, mime_type = await generate_image_async(
+            client=gemini_client,
+            prompt=prompt,
+            image_urls=media,
+            model=GEMINI_IMAGE_MODEL,
+            aspect_ratio=None,
+            files=gemini_files,
+            prompt_cache=prompt_cache,
+            prompt_usage=prompt_usage,
+        )
+
+        check_cancelled()
+        payload = await asyncio.to_thread(
+            prepare_gemini_job_update,
+            results={"results": [{"bytes": img_bytes, "mimetype": mime_type}], "prompt_cache": prompt_usage},
+            dest_gcs_folder=f'user/{uid}/jobs/{job_id}/results',
+            on_item=partial_results_writer(db, job_id, uid),
+        )
+        await asyncio.to_thread(jobs_update, db, job_id, uid, payload)
+
+    except errors.APIError as e:
+        await asyncio.to_thread(jobs_update, db, job_id, uid, handle_error(e, errtype="api"))
+    except Exception as e:
+        await asyncio.to_thread(jobs_update, db, job_id, uid, handle_error(e, errtype="internal"))
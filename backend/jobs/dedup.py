@@ -0,0 +1,122 @@
+# dedup.py
+# Content-addressed deduplication of generation jobs.
+# A generation is identified by the content of its input images,
+# the final prompt and the model slug: if the same combination was
+# already generated (or is being generated) we hand back that result.
+import os
+import hashlib
+import json
+from typing import List, Optional
+from urllib.parse import urlparse
+from firestore import dedup_get, dedup_set, dedup_delete, jobs_get
+from gcs import get_blob_fingerprint, gcs_path_from_signed_url, get_signed_url
+from gemini_api.inputs import http_session
+
+DEDUP_TTL_SECONDS = int(os.getenv("DEDUP_TTL_SECONDS", 24 * 3600))
+# HEAD request of a remote input, it runs in the request thread
+DEDUP_HEAD_TIMEOUT = float(os.getenv("DEDUP_HEAD_TIMEOUT", 5))
+
+# job statuses that can be shared with a new identical request
+REUSABLE_STATUSES = ("succeeded", "running", "partial")
+
+
+def generation_key(fingerprints: List[str], prompt: str, model_slug: str, options: Optional[dict] = None) -> str:
+    '''
+    Hash of the ordered input fingerprints, prompt, model and runner options.
+    Order matters: the first image is the base image of the prompt.
+    '''
+    raw = json.dumps(
+        {"inputs": list(fingerprints), "prompt": prompt.strip(), "model": model_slug, "options": options or {}},
+        sort_keys=True,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def fingerprint_gcs_paths(client, gcs_paths: List[str]) -> List[str]:
+    '''
+    Fingerprints of objects already on GCS (metadata only, no download)
+    '''
+    return [get_blob_fingerprint(client, p) for p in gcs_paths]
+
+
+def _url_fingerprint(url: str, timeout: float) -> Optional[str]:
+    '''
+    Fingerprint of a remote url from a HEAD request: its strong ETag, or
+    Last-Modified and size. None when the server sends neither.
+    '''
+    resp = http_session().head(url, timeout=timeout, allow_redirects=True)
+    resp.raise_for_status()
+    etag = resp.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        validator = f"etag:{etag}"
+    elif resp.headers.get("Last-Modified") and resp.headers.get("Content-Length"):
+        validator = f"modified:{resp.headers['Last-Modified']}:{resp.headers['Content-Length']}"
+    else:
+        return None
+    parsed = urlparse(resp.url)
+    return "url:" + hashlib.sha256(f"{parsed.netloc}{parsed.path}|{validator}".encode("utf-8")).hexdigest()
+
+
+def fingerprint_urls(client, urls: List[str], timeout: float = DEDUP_HEAD_TIMEOUT) -> Optional[List[str]]:
+    '''
+    Fingerprints of input urls. Signed urls of our bucket are resolved
+    through the object metadata, anything else with a HEAD request
+    (nothing is downloaded). None when an input cannot be fingerprinted.
+    '''
+    out = []
+    for u in urls:
+        gcs_path = gcs_path_from_signed_url(u)
+        fingerprint = get_blob_fingerprint(client, gcs_path) if gcs_path else _url_fingerprint(u, timeout)
+        if fingerprint is None:
+            return None
+        out.append(fingerprint)
+    return out
+
+
+def find_cached_job(db, uid: str, key: str, backend: Optional[str] = None) -> Optional[dict]:
+    '''
+    Return {"job_id", "status"} of a previous identical job that
+    succeeded or is still running. Stale entries are dropped, and so
+    are routed jobs that failed over to another backend than `backend`.
+    '''
+    entry = dedup_get(db, uid, key)
+    if not entry or not entry.get("job_id"):
+        return None
+
+    job = jobs_get(db, entry["job_id"], uid)
+    ran_on = ((job or {}).get("routing") or {}).get("backend")
+    if not job or job.get("status") not in REUSABLE_STATUSES or (backend and ran_on and ran_on != backend):
+        dedup_delete(db, uid, key)
+        return None
+
+    return {"job_id": entry["job_id"], "status": job.get("status")}
+
+
+def remember_job(db, uid: str, key: str, job_id: str):
+    dedup_set(db, uid, key, {"job_id": job_id}, ttl_seconds=DEDUP_TTL_SECONDS)
+
+
+def find_cached_result(db, client, uid: str, key: str) -> Optional[dict]:
+    '''
+    Return a previous synchronous generation payload with fresh
+    signed urls, or None if missing, expired or deleted from storage.
+    '''
+    entry = dedup_get(db, uid, key)
+    if not entry or not entry.get("payload"):
+        return None
+
+    payload = entry["payload"]
+    try:
+        for item in payload.get("results", []):
+            signed = get_signed_url(client, item["gcs_path"])
+            item["signed_url"] = signed["signed_url"]
+            item["url"] = signed["signed_url"]
+    except (KeyError, FileNotFoundError):
+        dedup_delete(db, uid, key)
+        return None
+
+    return payload
+
+
+def remember_result(db, uid: str, key: str, payload: dict):
+    dedup_set(db, uid, key, {"payload": payload}, ttl_seconds=DEDUP_TTL_SECONDS)
@@ -0,0 +1,186 @@
+# fanout_jobs.py
+# One job, N generations: the same inputs with several prompt
+# variants and/or aspect ratios, generated concurrently and recorded
+# into the job document as each one lands.
+import contextvars
+from itertools import product
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional, Dict, Any
+from google.cloud import firestore
+from google.genai import errors
+from gemini_api import load_image_parts, generate_image_from_parts, gemini_reads_gcs
+from firestore import jobs_update
+from .gemini_jobs import prepare_gemini_job_update, handle_error, GEMINI_IMAGE_MODEL
+from .gemini_files import gemini_files
+from .prompt_cache import prompt_cache
+from .nano_banana_job import prepare_job_update
+from .replicate_jobs import generate_nano_banana
+from .interrupts import interruptible
+from .result_uploads import PARTIAL
+from queue_manager.cancellation import JobTimeout
+from queue_manager.concurrency import concurrency
+
+from app import gemini_client
+
+FANOUT_MAX_VARIANTS = 8
+# upper bound, the provider concurrency window may allow fewer
+FANOUT_MAX_PARALLEL = 4
+
+# aspect ratios accepted by both gemini image models and nano-banana
+ALLOWED_ASPECT_RATIOS = {"1:1", "2:3", "3:2", "3:4", "4:3", "4:5", "5:4", "9:16", "16:9", "21:9"}
+
+
+def build_variants(
+    prompt: str,
+    variants: Optional[List[str]] = None,
+    aspect_ratios: Optional[List[str]] = None,
+) -> List[Dict[str, Any]]:
+    '''
+    Every combination of prompt variant and aspect ratio.
+    Each variant is appended to the base prompt.
+    '''
+    prompts = [f"{prompt} {v}".strip() for v in variants] if variants else [prompt]
+    ratios = list(aspect_ratios) if aspect_ratios else [None]
+
+    combos = [
+        {"prompt": p, "variant": v, "aspect_ratio": ar}
+        for (p, v), ar in product(zip(prompts, variants or [None]), ratios)
+    ]
+    if len(combos) > FANOUT_MAX_VARIANTS:
+        raise ValueError(f"at most {FANOUT_MAX_VARIANTS} variants per job, got {len(combos)}")
+    return combos
+
+
+def validate_fanout_options(variants, aspect_ratios):
+    '''
+    Raises ValueError if the fan-out options sent by a client are malformed
+    '''
+    if variants is not None:
+        if not isinstance(variants, list) or not all(isinstance(v, str) for v in variants):
+            raise ValueError("'variants' must be a list of strings")
+    if aspect_ratios is not None:
+        if not isinstance(aspect_ratios, list) or not all(ar in ALLOWED_ASPECT_RATIOS for ar in aspect_ratios):
+            raise ValueError(f"'aspect_ratios' must be a list of {sorted(ALLOWED_ASPECT_RATIOS)}")
+    build_variants("", variants, aspect_ratios)
+
+
+def _generate_gemini_variant(image_parts, combo, dest_gcs_folder):
+    # the variants share the cached prompt prefix
+    prompt_usage = []
+    img_bytes, mime_type = generate_image_from_parts(
+        client=gemini_client,
+        prompt=combo["prompt"],
+        image_parts=image_parts,
+        model=GEMINI_IMAGE_MODEL,
+        aspect_ratio=combo["aspect_ratio"],
+        prompt_cache=prompt_cache,
+        prompt_usage=prompt_usage,
+    )
+    return prepare_gemini_job_update(
+        results={"results": [{"bytes": img_bytes, "mimetype": mime_type}], "prompt_cache": prompt_usage},
+        dest_gcs_folder=dest_gcs_folder,
+    )
+
+
+def _generate_replicate_variant(image_urls, combo, dest_gcs_folder):
+    results = generate_nano_banana(
+        image_urls=image_urls,
+        prompt=combo["prompt"],
+        aspect_ratio=combo["aspect_ratio"] or "match_input_image",
+        output_format="png",
+        model_slug="google/nano-banana",
+    )
+    return prepare_job_update(results=results, dest_gcs_folder=dest_gcs_folder)
+
+
+@interruptible
+def run_fanout_job(
+    db,
+    job_id: str,
+    uid: str,
+    media: list,
+    prompt: str,
+    variants: Optional[List[str]] = None,
+    aspect_ratios: Optional[List[str]] = None,
+    backend: str = "gemini",
+):
+    '''
+    Runs every variant concurrently. Each finished variant is appended
+    to 'results' right away, so the frontend sees images as they land.
+    '''
+    combos = build_variants(prompt, variants, aspect_ratios)
+    dest_gcs_folder = f'user/{uid}/jobs/{job_id}/results'
+
+    print(f"updating job {job_id} ({len(combos)} variants)")
+    jobs_update(db, job_id, uid, {
+        "status": "running",
+        "results": [],
+        "fanout": {"total": len(combos), "done": 0, "failed": 0},
+    })
+
+    try:
+        if backend == "gemini":
+            # inputs are fetched once and shared by all the generations
+            image_parts = load_image_parts(
+                media,
+                by_reference=gemini_reads_gcs(gemini_client),
+                model=GEMINI_IMAGE_MODEL,
+                files=gemini_files,
+            )
+            generate = lambda combo: _generate_gemini_variant(image_parts, combo, dest_gcs_folder)
+        elif backend == "replicate":
+            generate = lambda combo: _generate_replicate_variant(media, combo, dest_gcs_folder)
+        else:
+            raise ValueError(f"unknown backend '{backend}'")
+    except Exception as e:
+        jobs_update(db, job_id, uid, handle_error(e, errtype="internal"))
+        return
+
+    window = concurrency.window(*(("gemini", GEMINI_IMAGE_MODEL) if backend == "gemini" else ("replicate", "google/nano-banana")))
+    succeeded, errors_out, prompt_usage = 0, [], []
+    with ThreadPoolExecutor(max_workers=min(len(combos), FANOUT_MAX_PARALLEL, window)) as ex:
+        # each variant runs in the job context, so it sees the cancel token
+        futures = {
+            ex.submit(contextvars.copy_context().run, generate, combo): i
+            for i, combo in enumerate(combos)
+        }
+
+        for fut in as_completed(futures):
+            i = futures[fut]
+            combo = combos[i]
+            try:
+                payload = fut.result()
+            except JobTimeout as e:
+                # one slow variant does not fail the others
+                errors_out.append({"variant": i, "status": "DEADLINE_EXCEEDED", "reason": "JobTimeout", "message": str(e), "details": None})
+                jobs_update(db, job_id, uid, {"fanout.failed": firestore.Increment(1)})
+                continue
+            except errors.APIError as e:
+                errors_out.append({"variant": i, **handle_error(e, errtype="api")["error"]})
+                jobs_update(db, job_id, uid, {"fanout.failed": firestore.Increment(1)})
+                continue
+            except Exception as e:
+                errors_out.append({"variant": i, **handle_error(e, errtype="internal")["error"]})
+                jobs_update(db, job_id, uid, {"fanout.failed": firestore.Increment(1)})
+                continue
+
+            items = [
+                {**item, "variant": i, "prompt_variant": combo["variant"], "aspect_ratio": combo["aspect_ratio"]}
+                for item in payload.get("results", [])
+            ]
+            succeeded += 1
+            prompt_usage.extend({**u, "variant": i} for u in payload.get("prompt_cache", []))
+            jobs_update(db, job_id, uid, {
+                "status": PARTIAL,
+                "results": firestore.ArrayUnion(items),
+                "fanout.done": firestore.Increment(1),
+            })
+
+    final = {"status": "succeeded" if succeeded else "failed"}
+    if prompt_usage:
+        final["prompt_cache"] = prompt_usage
+    if errors_out:
+        final["errors"] = errors_out
+        if not succeeded:
+            final["error"] = errors_out[0]
+    jobs_update(db, job_id, uid, final)
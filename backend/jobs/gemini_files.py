@@ -0,0 +1,48 @@
+# gemini_files.py
+# The Gemini Files API registry of the app: the saved model images of
+# the users are uploaded once (when saved or listed), the jobs then send
+# them by reference. See gemini_api.files.
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Set
+from firestore import gemini_file_get, gemini_file_set, gemini_file_delete
+from gcs import gcs_uri
+from gemini_api import GeminiFileRegistry, fetch_gcs_input, gcs_input_scope, model_input_spec, INPUT_FETCH_DEADLINE
+from imaging import renditions
+
+from app import db, gemini_client
+
+gemini_files = GeminiFileRegistry(
+    gemini_client,
+    load=lambda key: gemini_file_get(db, key),
+    save=lambda key, entry: gemini_file_set(db, key, entry),
+    delete=lambda key: gemini_file_delete(db, key),
+)
+
+# registrations run in the background, one at a time
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gemini-files")
+_registered: Set[str] = set()
+
+
+def _register_model_image(gcs_path: str, model: str):
+    try:
+        # a model image path of the app, not of a client
+        with gcs_input_scope(gcs_path):
+            data, mime, timing = fetch_gcs_input(gcs_uri(gcs_path), time.monotonic() + INPUT_FETCH_DEADLINE)
+        # the bytes the jobs will send: the model input rendition
+        [(data, mime)] = renditions([(data, mime)], model_input_spec(model), [timing.get("image")])
+        gemini_files.register(data, mime)
+    except Exception as e:
+        _registered.discard(gcs_path)
+        print(f"[gemini-files] could not register {gcs_path}: {repr(e)}")
+
+
+def register_model_images(gcs_paths: List[str], model: str):
+    '''Upload the model images of a user to the Files API, in the background.'''
+    if not gemini_files.available:
+        return
+    for path in gcs_paths:
+        if path and path not in _registered:
+            _registered.add(path)
+            _executor.submit(contextvars.copy_context().run, _register_model_image, path, model)
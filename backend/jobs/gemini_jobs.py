@@ -1,11 +1,20 @@
 import uuid
+import mimetypes
 from gemini_api import generate_image
 from gcs import upload_bytes_signed
 from google.genai import errors
 from jobs import jobs_update
+from queue_manager.cancellation import JobTimeout, check_cancelled
+from .interrupts import interruptible, interrupted_payload
+from .result_uploads import upload_concurrently, partial_results_writer
+from imaging import apply_result_transforms
+from .gemini_files import gemini_files
+from .prompt_cache import prompt_cache
 
 from app import storage_client,gemini_client
 
+GEMINI_IMAGE_MODEL = "gemini-2.5-flash-image"
+
 
 def handle_error(e,errtype):
     if errtype == "api":
@@ -29,27 +38,31 @@ def handle_error(e,errtype):
     }
 
 
-def prepare_gemini_job_update(results,dest_gcs_folder):
+def prepare_gemini_job_update(results,dest_gcs_folder,on_item=None):
     '''
-    Stores the data on gcs and prepares for job update
+    Stores the data on gcs and prepares for job update.
+    The outputs are uploaded concurrently, on_item(item) is
+    called as each one is stored (see result_uploads)
     '''
-    gcs_res = {}
-    result_items = []
-    
-    for result in results.get("results",[]):  
+
+    def upload(result):
 
         generation_id = str(uuid.uuid4())
+
+        # CPU-bound transforms (RESULT_TRANSFORMS) run in the process pool
+        file_bytes, mimetype = apply_result_transforms(result.get("bytes"), result.get("mimetype"))
+        ext = ".png" if mimetype == "image/png" else (mimetypes.guess_extension(mimetype or "") or ".png")
     
         gcs_res = upload_bytes_signed(
             client=storage_client,
-            file_bytes=result.get("bytes"),
+            file_bytes=file_bytes,
             gcs_path=dest_gcs_folder,
-            filename=f"{generation_id}.png",
-            content_type=result.get("mimetype"),
+            filename=f"{generation_id}{ext}",
+            content_type=mimetype,
             expires_hours=24,
         )
     
-        result_items.append({
+        return {
             "generation_id": generation_id,
             "gcs_path":gcs_res.get('gcs_path'),
             "signed_url":gcs_res.get('signed_url'),
@@ -59,9 +72,17 @@ def prepare_gemini_job_update(results,dest_gcs_folder):
             #"inputs": res.get("inputs"),
             "url": gcs_res.get('signed_url'),     # remote URLs from Replicate 
             "error": gcs_res.get("error"),
-        })
+        }
 
-    return {"status": "succeeded", "results": result_items}
+    result_items = upload_concurrently(upload, results.get("results",[]), on_item)
+    payload = {"status": "succeeded", "results": result_items}
+    if results.get("input_fetch"):
+        # per input {input, bytes, ms}
+        payload["input_fetch"] = results["input_fetch"]
+    if results.get("prompt_cache"):
+        # per call {prefix, cached, status, prompt_tokens, cached_tokens, latency_ms, saved_ms_estimate}
+        payload["prompt_cache"] = results["prompt_cache"]
+    return payload
 
 
 
@@ -75,19 +96,24 @@ def generate_gemini_nano_banana(
     
     # try to generate the image
     
+    input_timings, prompt_usage = [], []
     img_bytes, mime_type = generate_image(
         client=gemini_client,
         prompt=prompt,
         image_urls=image_urls,
         model = model_slug,
-        aspect_ratio=aspect_ratio    
+        aspect_ratio=aspect_ratio,
+        input_timings=input_timings,
+        files=gemini_files,
+        prompt_cache=prompt_cache,
+        prompt_usage=prompt_usage,
     )
 
-    return {"results":[{"bytes":img_bytes,"mimetype":mime_type}]}
+    return {"results":[{"bytes":img_bytes,"mimetype":mime_type}], "input_fetch": input_timings, "prompt_cache": prompt_usage}
 
 
     
-
+@interruptible
 def run_gemini_nano_banana_job(db, job_id: str, uid: str, media: dict, prompt: str):
     
     print(f"updating job {job_id}")
@@ -99,12 +125,15 @@ def run_gemini_nano_banana_job(db, job_id: str, uid: str, media: dict, prompt: s
             image_urls=media,
             prompt=prompt,
             aspect_ratio=None,
-            model_slug="gemini-2.5-flash-image",
+            model_slug=GEMINI_IMAGE_MODEL,
         )
-        
+
+        # cancelled while generating: do not upload
+        check_cancelled()
         payload = prepare_gemini_job_update(
             results= results, 
-            dest_gcs_folder=f'user/{uid}/jobs/{job_id}/results'
+            dest_gcs_folder=f'user/{uid}/jobs/{job_id}/results',
+            on_item=partial_results_writer(db, job_id, uid),
         )
         jobs_update(db, job_id, uid, payload)
     
@@ -125,7 +154,7 @@ def run_sync_gemini_nano_banana(uid: str, media: dict, prompt: str):
             image_urls=media,
             prompt=prompt,
             aspect_ratio=None,
-            model_slug="gemini-2.5-flash-image",
+            model_slug=GEMINI_IMAGE_MODEL,
         )
         
         payload = prepare_gemini_job_update(
@@ -134,6 +163,9 @@ def run_sync_gemini_nano_banana(uid: str, media: dict, prompt: str):
         )
         return payload
     
+    except JobTimeout as e:
+        return interrupted_payload(e)
+
     except errors.APIError as e:
         return handle_error(e,errtype="api")
 
@@ -0,0 +1,93 @@
+# interrupts.py
+# Cancelled and timed-out jobs. Every runner is wrapped with
+# @interruptible: it gets a cancel token for the whole run, and
+# when it is cancelled or hits a provider deadline the job document
+# is marked and the partial results are removed from storage.
+import asyncio
+import inspect
+import functools
+from firestore import jobs_get, jobs_update
+from gcs import delete_gcs_folder
+from queue_manager.cancellation import job_context, JobInterrupted, JobCancelled
+from gemini_api import gcs_input_scope
+
+from app import storage_client
+
+CANCELED = "canceled"
+
+
+def results_folder(uid: str, job_id: str) -> str:
+    return f'user/{uid}/jobs/{job_id}/results'
+
+
+def interrupted_payload(e: JobInterrupted) -> dict:
+    if isinstance(e, JobCancelled):
+        return {"status": CANCELED, "results": []}
+    return {
+        "status": "failed",
+        "results": [],
+        "error": {
+            "status": "DEADLINE_EXCEEDED",
+            "reason": type(e).__name__,
+            "message": str(e),
+            "details": None,
+        },
+    }
+
+
+def record_interrupted(db, job_id: str, uid: str, e: JobInterrupted):
+    '''
+    Mark the job document and drop whatever the job already uploaded
+    '''
+    print(f"job {job_id} interrupted: {repr(e)}")
+    jobs_update(db, job_id, uid, interrupted_payload(e))
+    try:
+        delete_gcs_folder(storage_client, results_folder(uid, job_id))
+    except Exception as err:
+        print(f"could not clean up results of job {job_id}: {repr(err)}")
+
+
+def user_prefix(uid: str) -> str:
+    # jobs (user/<uid>/jobs/...) and saved models (user/<uid>/models/...)
+    return f"user/{uid}/" if uid and "/" not in uid else ""
+
+
+def canceled_before_start(db, job_id: str, uid: str) -> bool:
+    '''
+    Jobs cancelled while waiting in a queue this process
+    cannot reach (Cloud Tasks) are skipped when they arrive
+    '''
+    job = jobs_get(db, job_id, uid)
+    return bool(job) and job.get("status") == CANCELED
+
+
+def interruptible(run_fn):
+    '''
+    Decorator for job runners (db, job_id, uid, media, prompt, **options).
+    Keeps the runner name, so the job registry is not affected.
+    The runner may read the gs:// objects of the user only.
+    '''
+    if inspect.iscoroutinefunction(run_fn):
+        @functools.wraps(run_fn)
+        async def async_wrapper(db, job_id, uid, media, prompt, **options):
+            if await asyncio.to_thread(canceled_before_start, db, job_id, uid):
+                print(f"job {job_id} was cancelled before it started")
+                return
+            with job_context(job_id), gcs_input_scope(user_prefix(uid)):
+                try:
+                    return await run_fn(db, job_id, uid, media, prompt, **options)
+                except JobInterrupted as e:
+                    await asyncio.to_thread(record_interrupted, db, job_id, uid, e)
+        return async_wrapper
+
+    @functools.wraps(run_fn)
+    def wrapper(db, job_id, uid, media, prompt, **options):
+        if canceled_before_start(db, job_id, uid):
+            print(f"job {job_id} was cancelled before it started")
+            return
+        with job_context(job_id), gcs_input_scope(user_prefix(uid)):
+            try:
+                return run_fn(db, job_id, uid, media, prompt, **options)
+            except JobInterrupted as e:
+                record_interrupted(db, job_id, uid, e)
+    return wrapper
@@ -3,49 +3,73 @@ import uuid
 from firestore import jobs_update
 from .replicate_jobs import generate_nano_banana
 from gcs import upload_url_to_gcs_signed
+from queue_manager.cancellation import JobTimeout, check_cancelled
+from .interrupts import interruptible, interrupted_payload
+from .result_uploads import upload_concurrently, partial_results_writer
 from app import storage_client
 
-def prepare_job_update(results,dest_gcs_folder,upload_to_cdn=True):
+def prepare_job_update(results,dest_gcs_folder,upload_to_cdn=True,on_item=None):
     '''
-    Stores the data on gcs and prepares for job update
+    Stores the data on gcs and prepares for job update.
+    The outputs are uploaded concurrently, on_item(item) is
+    called as each one is stored (see result_uploads)
     '''
-    gcs_res = {}
-    replicate_items = []
-    
-    for generation_id, res in results.items():  
-        
+    outputs = [
+        (generation_id, url, res)
+        for generation_id, res in results.items()
+        for url in res.get('urls',[])
+    ]
+
+    def upload(output):
+        generation_id, url, res = output
+        gcs_res = {}
+
         # here we need to download the image and store to gcs
-        for url in res.get('urls',[]):
-            
-            if upload_to_cdn:
-                gcs_res = upload_url_to_gcs_signed(
-                    client= storage_client,
-                    file_url= url,
-                    gcs_path= dest_gcs_folder,
-                )
+        if upload_to_cdn:
+            gcs_res = upload_url_to_gcs_signed(
+                client= storage_client,
+                file_url= url,
+                gcs_path= dest_gcs_folder,
+            )
         
-            replicate_items.append({
-                "generation_id": generation_id,
-                "gcs_path":gcs_res.get('gcs_path'),
-                "signed_url":gcs_res.get('signed_url'),
-                "mimetype":gcs_res.get('content_type'),
-                "filename":gcs_res.get("filename"),
-                #"prompt": res.get("prompt"),
-                #"inputs": res.get("inputs"),
-                "url": url,     # remote URLs from Replicate 
-                "error": res.get("error"),
-            })
+        return {
+            "generation_id": generation_id,
+            "gcs_path":gcs_res.get('gcs_path'),
+            "signed_url":gcs_res.get('signed_url'),
+            "mimetype":gcs_res.get('content_type'),
+            "filename":gcs_res.get("filename"),
+            #"prompt": res.get("prompt"),
+            #"inputs": res.get("inputs"),
+            "url": url,     # remote URLs from Replicate 
+            "error": res.get("error"),
+        }
 
+    replicate_items = upload_concurrently(upload, outputs, on_item)
     return {"status": "succeeded", "results": replicate_items}
 
 
+@interruptible
 def run_nano_banana_job(db, job_id: str, uid: str, media: dict, prompt: str):
     
     print(f"updating job {job_id}")
     jobs_update(db, job_id, uid,  {"status": "running"})
     
     try:
-        results = generate_nano_banana(
+        items = []
+        on_item = partial_results_writer(db, job_id, uid)
+
+        def on_result(res):
+            # each prediction is stored as soon as it completes,
+            # nothing is uploaded once the job is cancelled
+            check_cancelled()
+            payload = prepare_job_update(
+                results= {res["jobid"]: res},
+                dest_gcs_folder=f'user/{uid}/jobs/{job_id}/results',
+                on_item=on_item,
+            )
+            items.extend(payload["results"])
+
+        generate_nano_banana(
             image_urls=media,
             prompt=prompt,
             aspect_ratio="4:3",
@@ -53,13 +77,12 @@ def run_nano_banana_job(db, job_id: str, uid: str, media: dict, prompt: str):
             model_slug="google/nano-banana",
             version=None,
             from_disk=False,
+            on_result=on_result,
         )
-        
-        payload = prepare_job_update(
-            results= results, 
-            dest_gcs_folder=f'user/{uid}/jobs/{job_id}/results'
-        )
-        jobs_update(db, job_id, uid, payload)
+
+        # cancelled while uploading: do not report success
+        check_cancelled()
+        jobs_update(db, job_id, uid, {"status": "succeeded", "results": items})
     
     except Exception as e:
         jobs_update(db, job_id, uid, {"status": "failed", "error": repr(e)})
@@ -85,6 +108,9 @@ def run_sync_nano_banana_job(uid: str, media: dict, prompt: str):
             dest_gcs_folder=f'tmp/uploads/users/{uid}'
         )
         return payload
-    
+
+    except JobTimeout as e:
+        return interrupted_payload(e)
+
     except Exception as e:
         return {"status": "failed", "error": repr(e)}
\ No newline at end of file
@@ -0,0 +1,173 @@
+# prestage.py
+# Speculative pre-staging of uploaded inputs: while the user is still
+# composing the job, the work the job would do with an upload runs in
+# the background (input cache, model renditions, Gemini Files API
+# upload, Replicate rendition in the bucket). The job claims the inputs
+# it uses; unclaimed ones are evicted after PRESTAGE_MAX_AGE seconds or
+# when their bytes exceed PRESTAGE_BUDGET_BYTES.
+import os
+import time
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from gcs import delete_gcs_file
+from gemini_api import remember_gcs_object, guess_mime_type
+from imaging import rendition, content_digest, input_renditions_enabled
+from replicate_api.models import MODEL_REGISTRY, model_input_spec
+from .gemini_files import gemini_files
+from .gemini_jobs import GEMINI_IMAGE_MODEL
+from .replicate_jobs import stored_rendition
+from .router import REPLICATE_NANO_BANANA
+
+from app import storage_client
+
+PRESTAGE_WORKERS = int(os.getenv("PRESTAGE_WORKERS", 2))
+# uploads waiting to be staged, more are not staged (it is only speculative)
+PRESTAGE_MAX_PENDING = int(os.getenv("PRESTAGE_MAX_PENDING", 32))
+# unclaimed uploads kept staged, in bytes and in seconds
+PRESTAGE_BUDGET_BYTES = int(os.getenv("PRESTAGE_BUDGET_BYTES", 512 * 1024 * 1024))
+PRESTAGE_MAX_AGE = float(os.getenv("PRESTAGE_MAX_AGE", 3600))
+
+
+def prestage_enabled() -> bool:
+    return os.getenv("PRESTAGE", "1").lower() in ("1", "true", "yes")
+
+
+def prestage_models() -> List[str]:
+    models = os.getenv("PRESTAGE_MODELS", f"{GEMINI_IMAGE_MODEL},{REPLICATE_NANO_BANANA}")
+    return [m.strip() for m in models.split(",") if m.strip()]
+
+
+@dataclass
+class StagedInput:
+    gcs_path: str
+    size: int
+    staged_at: float = field(default_factory=time.monotonic)
+    # artefacts created for this upload only, removed on eviction
+    gemini_keys: List[str] = field(default_factory=list)
+    rendition_paths: List[str] = field(default_factory=list)
+
+
+class Prestager:
+
+    def __init__(self, workers: int = PRESTAGE_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prestage")
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.staged: "OrderedDict[str, StagedInput]" = OrderedDict()
+        # claimed before their staging finished
+        self.claimed: Dict[str, float] = {}
+        self.counts = {"staged": 0, "claimed": 0, "evicted": 0, "skipped": 0, "failed": 0}
+
+    def submit(
+        self,
+        gcs_path: str,
+        data: bytes,
+        mimetype: Optional[str],
+        generation=None,
+        md5_hash: Optional[str] = None,
+        image: Optional[dict] = None,
+    ):
+        '''Stage an upload in the background (image: its probe). Dropped when too many are waiting.'''
+        if not prestage_enabled():
+            return
+        with self.lock:
+            if self.pending >= PRESTAGE_MAX_PENDING:
+                self.counts["skipped"] += 1
+                return
+            self.pending += 1
+        if image:
+            mime = image["mimetype"]
+        else:
+            mime = mimetype if mimetype and mimetype.startswith("image/") else guess_mime_type(gcs_path)
+        self.executor.submit(contextvars.copy_context().run, self._stage, gcs_path, data, mime, generation, md5_hash, image)
+
+    def _stage(self, gcs_path: str, data: bytes, mimetype: str, generation, md5_hash: Optional[str], image: Optional[dict]):
+        started = time.monotonic()
+        item = StagedInput(gcs_path, len(data))
+        try:
+            # the job reads a copy of the upload, found through its md5
+            remember_gcs_object(f"gcs:{gcs_path}", data, mimetype, str(generation) if generation else None, md5_hash, image)
+            for model in prestage_models():
+                cfg = MODEL_REGISTRY.get(model)
+                if cfg is None:
+                    continue
+                spec = model_input_spec(model) if input_renditions_enabled() else None
+                rendered, rendered_mime = rendition(data, mimetype, spec, image) if spec else (data, mimetype)
+                if cfg.provider == "gemini" and gemini_files.available:
+                    # content registered before (a saved model) is not ours to evict
+                    known = gemini_files.lookup(rendered) is not None
+                    gemini_files.register(rendered, rendered_mime)
+                    if not known:
+                        item.gemini_keys.append(content_digest(rendered))
+                elif cfg.provider == "replicate" and spec:
+                    stored = stored_rendition(data, rendered, rendered_mime, spec)
+                    if stored.get("uploaded"):
+                        item.rendition_paths.append(stored["gcs_path"])
+        except Exception as e:
+            with self.lock:
+                self.counts["failed"] += 1
+            print(f"[prestage] {gcs_path} failed: {repr(e)}")
+
+        with self.lock:
+            self.pending -= 1
+            self.counts["staged"] += 1
+            if self.claimed.pop(gcs_path, None) is None:
+                self.staged[gcs_path] = item
+        print(f"[prestage] {gcs_path} staged in {(time.monotonic() - started) * 1000:.0f}ms")
+        self.evict()
+
+    def claim(self, gcs_paths: List[str]):
+        '''A job uses these uploads: their artefacts are no longer speculative.'''
+        now = time.monotonic()
+        with self.lock:
+            for path in filter(None, gcs_paths):
+                if self.staged.pop(path, None) is not None:
+                    self.counts["claimed"] += 1
+                else:
+                    self.claimed[path] = now
+            for path, at in list(self.claimed.items()):
+                if now - at > PRESTAGE_MAX_AGE:
+                    del self.claimed[path]
+        self.evict()
+
+    def evict(self):
+        '''Drop the oldest unclaimed uploads past the age limit or the byte budget.'''
+        now = time.monotonic()
+        victims = []
+        with self.lock:
+            total = sum(item.size for item in self.staged.values())
+            while self.staged:
+                item = next(iter(self.staged.values()))
+                if now - item.staged_at <= PRESTAGE_MAX_AGE and total <= PRESTAGE_BUDGET_BYTES:
+                    break
+                self.staged.popitem(last=False)
+                total -= item.size
+                victims.append(item)
+            self.counts["evicted"] += len(victims)
+
+        for item in victims:
+            for key in item.gemini_keys:
+                gemini_files.forget(key)
+            for path in item.rendition_paths:
+                try:
+                    delete_gcs_file(storage_client, path)
+                except Exception as e:
+                    print(f"[prestage] could not delete {path}: {repr(e)}")
+            print(f"[prestage] evicted {item.gcs_path}")
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "pending": self.pending,
+                "staged": len(self.staged),
+                "staged_bytes": sum(item.size for item in self.staged.values()),
+                "budget_bytes": PRESTAGE_BUDGET_BYTES,
+                **self.counts,
+            }
+
+
+prestager = Prestager()
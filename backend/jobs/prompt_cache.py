@@ -0,0 +1,15 @@
+# prompt_cache.py
+# The Gemini context caches of the app: the dress and background
+# instructions every job starts with are cached once per model and
+# process, the jobs send only the user's part of the prompt.
+# See gemini_api.prompt_cache.
+import atexit
+from gemini_api import PromptCache
+from prompts import dress_prompt, background_prompt
+
+from app import gemini_client
+
+prompt_cache = PromptCache(gemini_client, {"dress": dress_prompt, "background": background_prompt})
+
+# storage of a cache is billed until it expires
+atexit.register(prompt_cache.close)
@@ -0,0 +1,39 @@
+# registry.py
+from .nano_banana_job import run_nano_banana_job
+from .gemini_jobs import run_gemini_nano_banana_job
+from .fanout_jobs import run_fanout_job
+from .async_jobs import run_gemini_nano_banana_job_async
+from .router import run_routed_job
+
+# job runners that can be executed by name, e.g. by the /run_job
+# worker when a task comes back from Cloud Tasks.
+# All of them share the signature run_fn(db, job_id, uid, media, prompt, **options),
+# coroutine runners are executed on the async job runner.
+JOB_RUNNERS = {
+    fn.__name__: fn
+    for fn in (
+        run_nano_banana_job,
+        run_gemini_nano_banana_job,
+        run_fanout_job,
+        run_gemini_nano_banana_job_async,
+        run_routed_job,
+    )
+}
+
+
+def get_job_runner(name: str):
+    """Return the runner registered under name, or None."""
+    return JOB_RUNNERS.get(name)
+
+
+# options a task may pass to each runner, the others are dropped
+JOB_RUNNER_OPTIONS = {
+    "run_fanout_job": ("variants", "aspect_ratios", "backend"),
+    "run_routed_job": ("aspect_ratio",),
+}
+
+
+def runner_options(name: str, options: dict) -> dict:
+    """The options of a task that runner `name` accepts."""
+    allowed = JOB_RUNNER_OPTIONS.get(name, ())
+    return {k: v for k, v in options.items() if k in allowed}
@@ -2,17 +2,28 @@
 
 from __future__ import annotations
 import os
-from typing import List, Dict, Any, Optional
+import hashlib
+import mimetypes
+from typing import Callable, List, Dict, Any, Optional
 
 from replicate_api import (
     generate_with_replicate_sequential,
     generate_with_replicate_threaded,
     upload_images_to_replicate_cdn
 )
+from replicate_api.models import model_input_spec
+from gcs import sign_gcs_uris, get_signed_url, upload_bytes_signed
+from gemini_api import fetch_inputs, check_gcs_input
+from imaging import renditions, rendition_name, input_renditions_enabled
+from app import storage_client
 
 
 DEFAULT_INPUT_KEY = "image"  # change to what your model expects (e.g., "image_url")
 
+# input renditions are stored once in the bucket, named after the
+# source content and the model target (safe to expire, re-created)
+RENDITIONS_PREFIX = "renditions"
+
 def _ensure_dir(path: str) -> str:
     os.makedirs(path, exist_ok=True)
     return path
@@ -48,6 +59,49 @@ def _normalize_payloads(
     return out
 
 
+def replicate_input_urls(image_urls: List[str], model_slug: Optional[str]) -> List[str]:
+    """
+    Urls Replicate can fetch for the inputs: signed urls of the model
+    input renditions when the model declares a target (see ModelConfig),
+    of the inputs themselves otherwise.
+    """
+    spec = model_input_spec(model_slug) if model_slug and input_renditions_enabled() else None
+    if not spec:
+        # signed with our credentials
+        for u in image_urls:
+            if u.startswith("gs://"):
+                check_gcs_input(u)
+        return sign_gcs_uris(storage_client, image_urls)
+
+    data, content_types, timings = fetch_inputs(image_urls)
+    images = [t.get("image") for t in timings]
+    return [
+        stored_rendition(source, rendered, mimetype, spec)["signed_url"]
+        for source, (rendered, mimetype) in zip(data, renditions(list(zip(data, content_types)), spec, images))
+    ]
+
+
+def stored_rendition(source: bytes, rendered: bytes, mimetype: str, spec: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Signed url ({"signed_url", "gcs_path"}) of the rendition of source
+    in the bucket, uploaded ("uploaded": True) unless it is there already.
+    """
+    key = hashlib.sha256(rendition_name(source, spec).encode("utf-8")).hexdigest()[:40]
+    filename = f"{key}{mimetypes.guess_extension(mimetype) or ''}"
+    try:
+        return get_signed_url(storage_client, f"{RENDITIONS_PREFIX}/{filename}", expires_hours=1)
+    except FileNotFoundError:
+        signed = upload_bytes_signed(
+            storage_client,
+            file_bytes=rendered,
+            gcs_path=RENDITIONS_PREFIX,
+            filename=filename,
+            content_type=mimetype,
+            expires_hours=1,
+        )
+        return {**signed, "uploaded": True}
+
+
 def generate_from_image_urls(
     image_urls: List[str],
     *,
@@ -60,10 +114,10 @@ def generate_from_image_urls(
     output_dir: Optional[str] = None,
     uploads_root: Optional[str] = None,  # fallback to ./uploads if not provided
     output_subdir: str = "generated",
-    max_workers: int = 4,
+    max_workers: Optional[int] = None,  # None: the model concurrency window
     retries: int = 2,
     base_sleep: float = 1.0,
-    stagger_ms: int = 150,
+    stagger_ms: int = 0,
 ) -> Dict[int, Dict[str, Any]]:
     """
     Kick off threaded Replicate jobs using the given image URLs.
@@ -81,6 +135,9 @@ def generate_from_image_urls(
     else:
         _ensure_dir(output_dir)
 
+    # Replicate only fetches over https
+    image_urls = replicate_input_urls(image_urls, model_slug)
+
     # Replicate expects a prompt per job
     prompts = [base_prompt] * len(image_urls)
 
@@ -117,22 +174,26 @@ def generate_nano_banana(
     version: Optional[str] = None,
     output_dir: Optional[str] = None,
     from_disk: Optional[bool] = False,
+    on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
 
 ) -> Dict[int, Dict[str, Any]]:
     """
     Calls google/nano-banana once with all image_urls in image_input.
-    Returns the standard results dict from generate_with_replicate_threaded.
+    Returns the standard results dict from generate_with_replicate_threaded,
+    on_result(res) is called as each prediction completes.
     """
 
     if not image_urls:
         return {}
     
 
-    upload_urls = image_urls
     if from_disk:
         # Upload your local files first
         # This will will upload the images to its cdn
         upload_urls = upload_images_to_replicate_cdn(image_urls)
+    else:
+        # Replicate only fetches over https
+        upload_urls = replicate_input_urls(image_urls, model_slug)
     
 
     # One prompt and one payload that bundles all images
@@ -150,6 +211,7 @@ def generate_nano_banana(
         version=version,
         payloads=payloads,
         output_dir=output_dir,
+        on_result=on_result,
         #max_workers=1,
         # retries=2,
         # base_sleep=1.0,
@@ -0,0 +1,56 @@
+# result_uploads.py
+# Generated outputs are uploaded to GCS concurrently, and each one is
+# appended to the job document as soon as it is stored (status
+# "partial"), so the first image shows up before the slowest is done.
+import os
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, List, Optional
+from google.cloud import firestore
+from firestore import jobs_update
+from queue_manager.cancellation import check_cancelled
+
+PARTIAL = "partial"
+
+# parallel GCS uploads per job
+RESULT_UPLOAD_WORKERS = int(os.getenv("RESULT_UPLOAD_WORKERS", 4))
+
+
+def upload_concurrently(
+    upload: Callable[[Any], dict],
+    outputs: List[Any],
+    on_item: Optional[Callable[[dict], None]] = None,
+) -> List[dict]:
+    '''
+    upload(output) -> result item, for every output at once.
+    on_item(item) runs as each upload lands; the items are
+    returned in the order of the outputs. Raises JobCancelled
+    (no further upload starts) once the job is cancelled.
+    '''
+    if not outputs:
+        return []
+
+    def guarded(output):
+        check_cancelled()
+        return upload(output)
+
+    items: List[Optional[dict]] = [None] * len(outputs)
+    with ThreadPoolExecutor(max_workers=min(len(outputs), RESULT_UPLOAD_WORKERS)) as ex:
+        # the uploads see the job context (cancel token of the retry sleeps)
+        futures = {
+            ex.submit(contextvars.copy_context().run, guarded, output): i
+            for i, output in enumerate(outputs)
+        }
+        for fut in as_completed(futures):
+            item = fut.result()
+            items[futures[fut]] = item
+            if on_item is not None:
+                on_item(item)
+    return items
+
+
+def partial_results_writer(db, job_id: str, uid: str) -> Callable[[dict], None]:
+    '''on_item callback appending each stored result to the job document'''
+    def write(item: dict):
+        jobs_update(db, job_id, uid, {"status": PARTIAL, "results": firestore.ArrayUnion([item])})
+    return write
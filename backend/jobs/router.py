@@ -0,0 +1,304 @@
+# router.py
+# nano-banana is served by Gemini (gemini-2.5-flash-image) and by
+# Replicate (google/nano-banana). The router orders the two backends
+# from live latency / success stats and the circuit breakers, and fails
+# over to the other one when the first fails. Both backends are
+# normalized to the bytes format of prepare_gemini_job_update.
+import os
+import time
+import random
+import threading
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
+from google.genai import errors
+from firestore import jobs_update
+from resilience import get_breaker, CircuitOpen, hedged_call, hedging_enabled
+from queue_manager.cancellation import check_cancelled, JobCancelled, JobTimeout
+from queue_manager.concurrency import error_status
+from gemini_api.inputs import fetch_input
+from .gemini_jobs import generate_gemini_nano_banana, prepare_gemini_job_update, handle_error, GEMINI_IMAGE_MODEL
+from .replicate_jobs import generate_nano_banana
+from .interrupts import interruptible, interrupted_payload
+from .result_uploads import partial_results_writer
+
+from app import gemini_client
+
+GEMINI = "gemini"
+REPLICATE = "replicate"
+BACKENDS = (GEMINI, REPLICATE)
+REPLICATE_NANO_BANANA = "google/nano-banana"
+# model each backend runs (e.g. part of the dedup key)
+BACKEND_MODELS = {GEMINI: GEMINI_IMAGE_MODEL, REPLICATE: REPLICATE_NANO_BANANA}
+
+# ROUTER_PREFERRED wins ties and is used before any stats exist
+ROUTER_PREFERRED = os.getenv("ROUTER_PREFERRED", GEMINI)
+# another backend must score this much better to take over (no flapping)
+ROUTER_SWITCH_MARGIN = float(os.getenv("ROUTER_SWITCH_MARGIN", 1.25))
+# share of requests sent to the other backend first, so its stats stay fresh
+ROUTER_EXPLORE = float(os.getenv("ROUTER_EXPLORE", 0.05))
+# seconds to download the outputs of a Replicate generation
+REPLICATE_OUTPUT_DEADLINE = 60
+
+# hedge target: "alternate" (the other backend when healthy) or "same"
+HEDGE_BACKEND = os.getenv("HEDGE_BACKEND", "alternate")
+HEDGE_KEY = "nano-banana"
+
+STATS_EWMA_ALPHA = 0.2
+# latency assumed for a backend without samples
+DEFAULT_LATENCY_S = 20.0
+
+
+def provider_routing_enabled() -> bool:
+    # opt-in: routing moves traffic to another model and another bill
+    return os.getenv("PROVIDER_ROUTING", "0").lower() in ("1", "true", "yes")
+
+
+class NoImageReturned(RuntimeError):
+    """The backend answered without an image (e.g. blocked by safety filters)."""
+
+
+class _BackendStats:
+
+    def __init__(self):
+        self.latency: Optional[float] = None
+        self.success_rate = 1.0
+        self.calls = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+
+    def record(self, ok: bool, latency: Optional[float], error: Optional[BaseException] = None):
+        self.calls += 1
+        self.success_rate += STATS_EWMA_ALPHA * ((1.0 if ok else 0.0) - self.success_rate)
+        if ok and latency is not None:
+            self.latency = latency if self.latency is None else self.latency + STATS_EWMA_ALPHA * (latency - self.latency)
+        if not ok:
+            self.failures += 1
+            self.last_error = repr(error)
+
+
+class ProviderRouter:
+
+    def __init__(self, backends=BACKENDS, preferred: str = ROUTER_PREFERRED):
+        self.backends = tuple(backends)
+        self.preferred = preferred if preferred in self.backends else self.backends[0]
+        self.stats = {b: _BackendStats() for b in self.backends}
+        self.failovers = 0
+        self.lock = threading.Lock()
+
+    def score(self, backend: str) -> float:
+        '''Expected seconds per successful image, lower is better.'''
+        if get_breaker(backend).is_open:
+            return float("inf")
+        s = self.stats[backend]
+        latency = s.latency if s.latency is not None else DEFAULT_LATENCY_S
+        return latency / max(0.05, s.success_rate)
+
+    def order(self) -> List[str]:
+        '''Backends to try, best first.'''
+        with self.lock:
+            scores = {b: self.score(b) for b in self.backends}
+        scores[self.preferred] /= ROUTER_SWITCH_MARGIN
+        ordered = sorted(self.backends, key=lambda b: scores[b])
+        healthy = [b for b in ordered if scores[b] != float("inf")]
+        if len(healthy) > 1 and random.random() < ROUTER_EXPLORE:
+            ordered.remove(healthy[1])
+            ordered.insert(0, healthy[1])
+        return ordered
+
+    def choose(self) -> str:
+        return self.order()[0]
+
+    def record(self, backend: str, ok: bool, latency: Optional[float] = None, error: Optional[BaseException] = None):
+        with self.lock:
+            self.stats[backend].record(ok, latency, error)
+
+    def _hedge_backend(self, order: List[str], backend: str) -> str:
+        if HEDGE_BACKEND == "alternate":
+            for other in order:
+                if other != backend and self.score(other) != float("inf"):
+                    return other
+        return backend
+
+    def _attempt(self, backend, attempts, image_urls, prompt, aspect_ratio) -> Tuple[str, Dict[str, Any]]:
+        started = time.monotonic()
+        try:
+            results = GENERATORS[backend](image_urls, prompt, aspect_ratio)
+        except JobCancelled:
+            # the job or, when hedging, the winner of the race cancelled it
+            attempts.append({"backend": backend, "ok": False, "error": "cancelled"})
+            raise
+        except (Exception, JobTimeout) as e:
+            self.record(backend, False, error=e)
+            attempts.append({"backend": backend, "ok": False, "error": repr(e)})
+            raise
+        latency = time.monotonic() - started
+        self.record(backend, True, latency)
+        attempts.append({"backend": backend, "ok": True, "latency_s": round(latency, 2)})
+        return backend, results
+
+    def generate(
+        self,
+        image_urls: List[str],
+        prompt: str,
+        aspect_ratio: Optional[str] = None,
+    ) -> Tuple[str, Dict[str, Any], List[Dict[str, Any]]]:
+        '''
+        Generate with the best backend, fail over to the next one.
+        With HEDGE_REQUESTS=1 the first try is hedged (see resilience.hedge).
+        Returns (backend, {"results": [{"bytes", "mimetype"}]}, attempts).
+        Raises the last error when every backend failed.
+        '''
+        attempts, last_err = [], None
+        order = self.order()
+        for backend in order:
+            if any(a["backend"] == backend for a in attempts):
+                continue
+            check_cancelled()
+            attempt = partial(self._attempt, backend, attempts, image_urls, prompt, aspect_ratio)
+            try:
+                if not attempts and hedging_enabled():
+                    hedge = partial(self._attempt, self._hedge_backend(order, backend), attempts, image_urls, prompt, aspect_ratio)
+                    winner, results = hedged_call(attempt, hedge, key=HEDGE_KEY)
+                else:
+                    winner, results = attempt()
+                return winner, results, attempts
+            except (Exception, JobTimeout) as e:
+                last_err = e
+                if not fails_over(e):
+                    raise
+                print(f"[router] {backend} failed ({repr(e)}), failing over")
+                with self.lock:
+                    self.failovers += 1
+
+        raise last_err
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            backends = {
+                b: {
+                    "latency_s": round(s.latency, 2) if s.latency is not None else None,
+                    "success_rate": round(s.success_rate, 3),
+                    "calls": s.calls,
+                    "failures": s.failures,
+                    "last_error": s.last_error,
+                    "score": _rounded(self.score(b)),
+                    "breaker": get_breaker(b).snapshot()["state"],
+                }
+                for b, s in self.stats.items()
+            }
+            failovers = self.failovers
+        # order() takes the lock itself
+        return {"preferred": self.preferred, "order": self.order(), "failovers": failovers, "backends": backends}
+
+
+def _rounded(score: float) -> Optional[float]:
+    return round(score, 2) if score != float("inf") else None
+
+
+def fails_over(e: BaseException) -> bool:
+    '''
+    Errors of the backend itself move on to the other backend; a bad
+    request would fail the same way there, so it is raised.
+    '''
+    if isinstance(e, (CircuitOpen, JobTimeout, NoImageReturned)):
+        return True
+    status = error_status(e)
+    if status is not None and 400 <= status < 500 and status not in (408, 429):
+        return False
+    return not isinstance(e, (ValueError, TypeError))
+
+
+def _download(url: str) -> Tuple[bytes, str]:
+    # pooled session, INPUT_MAX_BYTES limit and header probe of the inputs
+    data, mime, _ = fetch_input(url, time.monotonic() + REPLICATE_OUTPUT_DEADLINE)
+    return data, mime
+
+
+def _generate_gemini(image_urls: List[str], prompt: str, aspect_ratio: Optional[str]) -> Dict[str, Any]:
+    results = generate_gemini_nano_banana(
+        gemini_client=gemini_client,
+        image_urls=image_urls,
+        prompt=prompt,
+        aspect_ratio=aspect_ratio,
+        model_slug=GEMINI_IMAGE_MODEL,
+    )
+    if not any(r.get("bytes") for r in results["results"]):
+        raise NoImageReturned("gemini returned no image")
+    return results
+
+
+def _generate_replicate(image_urls: List[str], prompt: str, aspect_ratio: Optional[str]) -> Dict[str, Any]:
+    results = generate_nano_banana(
+        image_urls=image_urls,
+        prompt=prompt,
+        aspect_ratio=aspect_ratio or "match_input_image",
+        output_format="png",
+        model_slug=REPLICATE_NANO_BANANA,
+    )
+    items = []
+    for res in results.values():
+        if res.get("error"):
+            raise RuntimeError(res["error"])
+        for url in res.get("urls", []):
+            img_bytes, mime_type = _download(url)
+            items.append({"bytes": img_bytes, "mimetype": mime_type})
+    if not items:
+        raise NoImageReturned("replicate returned no image")
+    return {"results": items}
+
+
+GENERATORS = {
+    GEMINI: _generate_gemini,
+    REPLICATE: _generate_replicate,
+}
+
+
+def _routed_payload(backend, results, attempts, dest_gcs_folder, on_item=None):
+    payload = prepare_gemini_job_update(results=results, dest_gcs_folder=dest_gcs_folder, on_item=on_item)
+    payload["routing"] = {"backend": backend, "attempts": attempts}
+    return payload
+
+
+@interruptible
+def run_routed_job(db, job_id: str, uid: str, media: dict, prompt: str, aspect_ratio: Optional[str] = None):
+    '''
+    Single nano-banana generation on the backend picked by the router.
+    '''
+    print(f"updating job {job_id}")
+    jobs_update(db, job_id, uid, {"status": "running"})
+
+    try:
+        backend, results, attempts = provider_router.generate(media, prompt, aspect_ratio)
+
+        # cancelled while generating: do not upload
+        check_cancelled()
+        payload = _routed_payload(
+            backend, results, attempts,
+            f'user/{uid}/jobs/{job_id}/results',
+            on_item=partial_results_writer(db, job_id, uid),
+        )
+        jobs_update(db, job_id, uid, payload)
+
+    except errors.APIError as e:
+        jobs_update(db, job_id, uid, handle_error(e, errtype="api"))
+    except Exception as e:
+        jobs_update(db, job_id, uid, handle_error(e, errtype="internal"))
+
+
+def run_sync_routed(uid: str, media: dict, prompt: str):
+
+    try:
+        backend, results, attempts = provider_router.generate(media, prompt)
+        return _routed_payload(backend, results, attempts, f'tmp/uploads/users/{uid}')
+
+    except JobTimeout as e:
+        return interrupted_payload(e)
+
+    except errors.APIError as e:
+        return handle_error(e, errtype="api")
+
+    except Exception as e:
+        return handle_error(e, errtype="internal")
+
+
+provider_router = ProviderRouter()
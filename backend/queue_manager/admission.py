@@ -0,0 +1,138 @@
+# admission.py
+# Admission control for generation endpoints. Looks at the queued and
+# running jobs of a provider in the pool a new job goes to (scheduler,
+# or the async runner for coroutine runners) plus the synchronous calls
+# in flight, and refuses new work with a Retry-After once the backlog is
+# larger than what the provider can drain in reasonable time.
+import os
+import math
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+from .scheduler import scheduler as default_scheduler
+from .async_runner import async_runner_stats
+
+# used until the first jobs of a provider have completed
+DEFAULT_JOB_DURATION_S = 30.0
+
+# backlog (queued + running + sync in flight) accepted per provider.
+# override with ADMISSION_MAX_DEPTH_<PROVIDER>
+DEFAULT_MAX_DEPTH = {
+    "gemini": 40,
+    "replicate": 40,
+    "default": 40,
+}
+
+# synchronous generations that may block request threads at once.
+# override with ADMISSION_MAX_SYNC_<PROVIDER>
+DEFAULT_MAX_SYNC = {
+    "gemini": 4,
+    "replicate": 4,
+    "default": 4,
+}
+
+
+class Overloaded(Exception):
+    """Raised when a provider backlog is above its admission threshold."""
+
+    def __init__(self, message: str, retry_after: int, info: dict):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.info = info
+
+
+def _limit(table: Dict[str, int], prefix: str, provider: str) -> int:
+    default = table.get(provider, table["default"])
+    try:
+        return int(os.getenv(f"{prefix}_{provider.upper()}", default))
+    except ValueError:
+        return default
+
+
+class AdmissionController:
+
+    def __init__(self, scheduler=default_scheduler):
+        self.scheduler = scheduler
+        self.lock = threading.Lock()
+        self.sync_in_flight: Dict[str, int] = {}
+        self.sync_avg_duration: Dict[str, float] = {}
+
+    def _provider_stats(self, provider: str, async_pool: bool = False) -> dict:
+        """
+        Stats of a provider in the pool the job is queued on: the
+        capacity of the other pool does not drain this backlog.
+        """
+        source = async_runner_stats() if async_pool else self.scheduler.stats()
+        return source.get(provider) or {}
+
+    def snapshot(self, provider: str, async_pool: bool = False) -> dict:
+        """
+        Current backlog and estimated wait for a new job of this provider,
+        async_pool: the job runs on the async runner (coroutine runner).
+        """
+        stats = self._provider_stats(provider, async_pool)
+        with self.lock:
+            sync = self.sync_in_flight.get(provider, 0)
+            sync_avg = self.sync_avg_duration.get(provider)
+
+        queued = stats.get("queued", 0)
+        running = stats.get("running", 0)
+        concurrency = max(1, stats.get("concurrency") or _limit(DEFAULT_MAX_SYNC, "ADMISSION_MAX_SYNC", provider))
+        avg = stats.get("avg_duration_s") or sync_avg or DEFAULT_JOB_DURATION_S
+
+        depth = queued + running + sync
+        # jobs are served in waves of `concurrency`, a new job waits
+        # for the waves ahead of it to finish
+        waves = max(0, depth - concurrency + 1)
+        estimated_wait = math.ceil(waves / concurrency) * avg
+
+        return {
+            "provider": provider,
+            "pool": "async" if async_pool else "scheduler",
+            "queued": queued,
+            "running": running,
+            "sync_in_flight": sync,
+            "depth": depth,
+            "max_depth": _limit(DEFAULT_MAX_DEPTH, "ADMISSION_MAX_DEPTH", provider),
+            "concurrency": concurrency,
+            "avg_duration_s": round(avg, 2),
+            "estimated_wait_s": round(estimated_wait, 1),
+        }
+
+    def check(self, provider: str, async_pool: bool = False) -> dict:
+        """Return the snapshot if a new job is admitted, raise Overloaded otherwise."""
+        info = self.snapshot(provider, async_pool)
+        excess = info["depth"] - info["max_depth"] + 1
+        if excess > 0:
+            retry_after = max(1, math.ceil(excess / info["concurrency"] * info["avg_duration_s"]))
+            raise Overloaded(f"{provider} queue is full, retry in {retry_after}s", retry_after, info)
+        return info
+
+    @contextmanager
+    def track_sync(self, provider: str):
+        """
+        Count a synchronous generation as in flight for its provider.
+        Raises Overloaded if too many request threads are already blocked.
+        """
+        info = self.check(provider)
+        max_sync = _limit(DEFAULT_MAX_SYNC, "ADMISSION_MAX_SYNC", provider)
+        with self.lock:
+            in_flight = self.sync_in_flight.get(provider, 0)
+            if in_flight >= max_sync:
+                retry_after = max(1, math.ceil(info["avg_duration_s"]))
+                raise Overloaded(f"too many {provider} generations in progress", retry_after, info)
+            self.sync_in_flight[provider] = in_flight + 1
+
+        started = time.monotonic()
+        try:
+            yield info
+        finally:
+            elapsed = time.monotonic() - started
+            with self.lock:
+                self.sync_in_flight[provider] -= 1
+                prev = self.sync_avg_duration.get(provider)
+                self.sync_avg_duration[provider] = elapsed if prev is None else prev + 0.2 * (elapsed - prev)
+
+
+admission = AdmissionController()
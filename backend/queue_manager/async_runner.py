@@ -0,0 +1,94 @@
+# async_runner.py
+# Runs coroutine job runners on one background event loop.
+# A job waiting on the network costs a coroutine, not an OS thread,
+# so a single process can keep hundreds of generations in flight.
+import os
+import time
+import asyncio
+import threading
+from typing import Any, Callable, Coroutine, Dict, Optional
+from .scheduler import QueueFull
+
+
+class AsyncJobRunner:
+
+    def __init__(self, max_in_flight: int = 200, max_pending: int = 1000, provider: str = "gemini"):
+        self.max_in_flight = max_in_flight
+        self.max_pending = max_pending
+        self.provider = provider
+        self.loop = asyncio.new_event_loop()
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.running = 0
+        self.avg_duration: Optional[float] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, name="jobs-async-loop", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        # loop-bound objects are created inside the loop thread
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._ready.set()
+        self.loop.run_forever()
+
+    async def _guarded(self, coro_fn: Callable[..., Coroutine], args, kwargs):
+        async with self._semaphore:
+            with self.lock:
+                self.pending -= 1
+                self.running += 1
+            started = time.monotonic()
+            try:
+                return await coro_fn(*args, **kwargs)
+            finally:
+                elapsed = time.monotonic() - started
+                with self.lock:
+                    self.running -= 1
+                    self.avg_duration = elapsed if self.avg_duration is None else self.avg_duration + 0.2 * (elapsed - self.avg_duration)
+
+    def submit(self, coro_fn: Callable[..., Coroutine], *args, **kwargs):
+        """Schedule coro_fn(*args, **kwargs) on the loop. Returns a concurrent Future."""
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise QueueFull("async job queue is full, try again later")
+            self.pending += 1
+        return asyncio.run_coroutine_threadsafe(self._guarded(coro_fn, args, kwargs), self.loop)
+
+    def run(self, coro_fn: Callable[..., Coroutine], *args, **kwargs) -> Any:
+        """Run a coroutine on the loop and block the calling thread until it is done."""
+        return self.submit(coro_fn, *args, **kwargs).result()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Same shape as FairScheduler.stats()"""
+        with self.lock:
+            return {
+                self.provider: {
+                    "queued": self.pending,
+                    "running": self.running,
+                    "concurrency": self.max_in_flight,
+                    "avg_duration_s": self.avg_duration,
+                }
+            }
+
+
+_async_runner: Optional[AsyncJobRunner] = None
+_async_runner_lock = threading.Lock()
+
+
+def get_async_runner() -> AsyncJobRunner:
+    """Process-wide runner, started on first use."""
+    global _async_runner
+    with _async_runner_lock:
+        if _async_runner is None:
+            _async_runner = AsyncJobRunner(
+                max_in_flight=int(os.getenv("ASYNC_MAX_IN_FLIGHT", 200)),
+                max_pending=int(os.getenv("ASYNC_MAX_PENDING", 1000)),
+            )
+        return _async_runner
+
+
+def async_runner_stats() -> Dict[str, Dict[str, Any]]:
+    """Stats of the runner, empty if it was never started."""
+    return _async_runner.stats() if _async_runner is not None else {}
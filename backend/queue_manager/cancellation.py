@@ -0,0 +1,194 @@
+# cancellation.py
+# Cancellation tokens and hard deadlines for running jobs.
+# The scheduler (or async runner) binds a token to the job it runs,
+# provider calls are wrapped with call_with_deadline so that a hung
+# request or a cancel request releases the job slot right away.
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+# seconds a single provider call may take, override with JOB_DEADLINE_<PROVIDER>
+DEFAULT_PROVIDER_DEADLINES = {
+    "gemini": 120,
+    "replicate": 300,
+    "default": 180,
+}
+
+# how often blocked waits look at the cancel token
+POLL_INTERVAL = 0.25
+
+
+class JobInterrupted(BaseException):
+    """
+    Base of cancel / timeout. Like asyncio.CancelledError it is not an
+    Exception, so the catch-all handlers of the runners let it through.
+    """
+
+
+class JobCancelled(JobInterrupted):
+    """The job was cancelled by the user."""
+
+
+class JobTimeout(JobInterrupted):
+    """A provider call exceeded its deadline."""
+
+
+class CancelToken:
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.event = threading.Event()
+        self.children = []
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        self.event.set()
+        with self.lock:
+            children = list(self.children)
+        for child in children:
+            child.cancel()
+
+    def child(self) -> "CancelToken":
+        '''Token of one part of the job (e.g. a hedged call), cancelled with the job or on its own.'''
+        token = CancelToken(self.job_id)
+        with self.lock:
+            self.children.append(token)
+        if self.cancelled:
+            token.cancel()
+        return token
+
+    def release(self, child: "CancelToken"):
+        with self.lock:
+            if child in self.children:
+                self.children.remove(child)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled(f"job {self.job_id} was cancelled")
+
+
+_tokens: Dict[str, CancelToken] = {}
+_tokens_lock = threading.Lock()
+_current: contextvars.ContextVar = contextvars.ContextVar("current_cancel_token", default=None)
+
+
+def provider_deadline(provider: str) -> float:
+    default = DEFAULT_PROVIDER_DEADLINES.get(provider, DEFAULT_PROVIDER_DEADLINES["default"])
+    try:
+        return float(os.getenv(f"JOB_DEADLINE_{provider.upper()}", default))
+    except ValueError:
+        return float(default)
+
+
+@contextmanager
+def job_context(job_id: str):
+    """Bind a cancel token to the job running in this thread / task."""
+    token = CancelToken(job_id)
+    with _tokens_lock:
+        _tokens[job_id] = token
+    reset = _current.set(token)
+    try:
+        yield token
+    finally:
+        _current.reset(reset)
+        with _tokens_lock:
+            if _tokens.get(job_id) is token:
+                del _tokens[job_id]
+
+
+@contextmanager
+def bind_token(token: CancelToken):
+    """Make token the current one (e.g. a child token in a helper thread)."""
+    reset = _current.set(token)
+    try:
+        yield token
+    finally:
+        _current.reset(reset)
+
+
+def current_token() -> Optional[CancelToken]:
+    return _current.get()
+
+
+def check_cancelled():
+    """Raise JobCancelled if the job running here was cancelled."""
+    token = current_token()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+def cancel_running(job_id: str) -> bool:
+    """Signal a job running in this process. False if it is not running here."""
+    with _tokens_lock:
+        token = _tokens.get(job_id)
+    if token is None:
+        return False
+    token.cancel()
+    return True
+
+
+def call_with_deadline(fn: Callable[..., Any], *args, provider: str = "default", deadline: Optional[float] = None, **kwargs) -> Any:
+    """
+    Run fn(*args, **kwargs) in a helper thread and wait at most `deadline`
+    seconds (default: provider deadline). Raises JobTimeout or JobCancelled
+    as soon as either happens; the abandoned call finishes in the background
+    but no longer holds the job slot.
+    """
+    deadline = deadline or provider_deadline(provider)
+    token = current_token()
+    if token is not None:
+        token.raise_if_cancelled()
+
+    result: Dict[str, Any] = {}
+    done = threading.Event()
+    ctx = contextvars.copy_context()
+
+    def _target():
+        try:
+            result["value"] = ctx.run(fn, *args, **kwargs)
+        except BaseException as e:
+            result["error"] = e
+        finally:
+            done.set()
+
+    threading.Thread(target=_target, name=f"call-{provider}", daemon=True).start()
+
+    expires = time.monotonic() + deadline
+    while not done.wait(min(POLL_INTERVAL, max(0.0, expires - time.monotonic()))):
+        if token is not None and token.cancelled:
+            raise JobCancelled(f"job {token.job_id} was cancelled")
+        if time.monotonic() >= expires:
+            raise JobTimeout(f"{provider} call exceeded {deadline:g}s")
+
+    if "error" in result:
+        raise result["error"]
+    return result.get("value")
+
+
+async def await_with_deadline(coro, provider: str = "default", deadline: Optional[float] = None) -> Any:
+    """Coroutine counterpart of call_with_deadline: the awaited task is cancelled on timeout or cancel."""
+    deadline = deadline or provider_deadline(provider)
+    token = current_token()
+    task = asyncio.ensure_future(coro)
+    expires = time.monotonic() + deadline
+    try:
+        while True:
+            if token is not None and token.cancelled:
+                raise JobCancelled(f"job {token.job_id} was cancelled")
+            remaining = expires - time.monotonic()
+            if remaining <= 0:
+                raise JobTimeout(f"{provider} call exceeded {deadline:g}s")
+            done, _ = await asyncio.wait({task}, timeout=min(POLL_INTERVAL, remaining))
+            if done:
+                return task.result()
+    finally:
+        if not task.done():
+            task.cancel()
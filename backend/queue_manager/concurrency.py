@@ -0,0 +1,272 @@
+# concurrency.py
+# Adaptive (AIMD) concurrency limits for provider calls, per provider
+# and model. The window grows by one after a window worth of healthy
+# calls and is halved on 429/503 or when latency climbs well above its
+# baseline. Scheduler pools and fan-out executors follow the window.
+import os
+import time
+import asyncio
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from typing import Any, Callable, Dict, List, Optional
+from .cancellation import current_token, JobCancelled, JobTimeout
+
+# provider answers that mean "slow down"
+THROTTLE_STATUSES = (429, 503)
+
+DEFAULT_MIN_LIMIT = 1
+DEFAULT_MAX_LIMIT = 16
+# multiplicative decrease
+DECREASE_FACTOR = 0.5
+# latency above baseline * tolerance counts as congestion
+LATENCY_TOLERANCE = 2.0
+# ...and by at least this much, so jitter on fast calls is ignored
+LATENCY_MIN_EXCESS_S = 1.0
+LATENCY_EWMA_ALPHA = 0.2
+# the baseline follows faster calls right away, slower ones slowly
+BASELINE_EWMA_ALPHA = 0.05
+# after a decrease, ignore signals for this long (calls sent before the cut are still landing)
+MIN_COOLDOWN_S = 5
+
+
+def adaptive_concurrency_enabled() -> bool:
+    return os.getenv("ADAPTIVE_CONCURRENCY", "1").lower() not in ("0", "false", "no")
+
+
+def error_status(e: BaseException) -> Optional[int]:
+    '''
+    HTTP status of a provider error: genai APIError.code, ReplicateError.status,
+    google.api_core errors (.code), requests / httpx errors (.response)
+    '''
+    for attr in ("code", "status", "status_code"):
+        value = getattr(e, attr, None)
+        if isinstance(value, int):
+            return value
+    value = getattr(getattr(e, "response", None), "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+class AIMDLimiter:
+
+    def __init__(
+        self,
+        key: str,
+        initial: int,
+        min_limit: int = DEFAULT_MIN_LIMIT,
+        max_limit: int = DEFAULT_MAX_LIMIT,
+        adaptive: bool = True,
+    ):
+        self.key = key
+        # a fixed window when not adaptive, calls are only counted
+        self.adaptive = adaptive
+        self.min_limit = min_limit
+        self.max_limit = max(min_limit, max_limit)
+        self.limit = min(self.max_limit, max(min_limit, initial))
+        self.in_flight = 0
+        self.successes_in_window = 0
+        # the window was filled since the last change: only then is growing it useful
+        self.saturated = False
+        self.latency: Optional[float] = None
+        self.baseline: Optional[float] = None
+        self.cooldown_until = 0.0
+        self.counts = {"ok": 0, "throttled": 0, "errors": 0, "slow": 0, "cancelled": 0}
+        self.last_change: Optional[Dict[str, Any]] = None
+        self.listeners: List[Callable[[str, int], None]] = []
+        self.cond = threading.Condition()
+
+    # ---------------- slots ----------------
+
+    def try_acquire(self) -> bool:
+        with self.cond:
+            if self.in_flight < self.limit:
+                self.in_flight += 1
+                self.saturated = self.saturated or self.in_flight >= self.limit
+                return True
+            return False
+
+    def acquire(self):
+        '''Block until a slot of the window is free (interrupted by job cancel).'''
+        token = current_token()
+        with self.cond:
+            while self.in_flight >= self.limit:
+                self.cond.wait(0.25)
+                if token is not None and token.cancelled:
+                    raise JobCancelled(f"job {token.job_id} was cancelled")
+            self.in_flight += 1
+            self.saturated = self.saturated or self.in_flight >= self.limit
+
+    async def acquire_async(self):
+        while not self.try_acquire():
+            token = current_token()
+            if token is not None and token.cancelled:
+                raise JobCancelled(f"job {token.job_id} was cancelled")
+            await asyncio.sleep(0.05)
+
+    def release(self, latency: Optional[float], outcome: str):
+        '''outcome: "ok", "throttled", "slow" (deadline), "cancelled" (counted only) or "error"'''
+        with self.cond:
+            self.in_flight -= 1
+            self._record(latency, outcome)
+            self.cond.notify_all()
+
+    # ---------------- aimd ----------------
+
+    def _record(self, latency: Optional[float], outcome: str):
+        now = time.monotonic()
+        self.counts["errors" if outcome == "error" else outcome] += 1
+
+        if latency is not None and outcome == "ok":
+            self.latency = latency if self.latency is None else self.latency + LATENCY_EWMA_ALPHA * (latency - self.latency)
+            if self.baseline is None or latency < self.baseline:
+                self.baseline = latency
+            else:
+                self.baseline += BASELINE_EWMA_ALPHA * (latency - self.baseline)
+
+        if not self.adaptive or now < self.cooldown_until:
+            return
+
+        if outcome in ("throttled", "slow"):
+            self._decrease(now, outcome)
+        elif outcome == "ok":
+            if self.baseline is not None and self.latency > max(self.baseline * LATENCY_TOLERANCE, self.baseline + LATENCY_MIN_EXCESS_S):
+                self._decrease(now, f"latency {self.latency:.1f}s > {LATENCY_TOLERANCE:g}x baseline {self.baseline:.1f}s")
+                return
+            self.successes_in_window += 1
+            if self.saturated and self.successes_in_window >= self.limit and self.limit < self.max_limit:
+                self._set_limit(self.limit + 1, "healthy window")
+
+    def _decrease(self, now: float, reason: str):
+        self._set_limit(max(self.min_limit, int(self.limit * DECREASE_FACTOR)), reason)
+        self.cooldown_until = now + max(MIN_COOLDOWN_S, self.latency or 0)
+
+    def _set_limit(self, limit: int, reason: str):
+        self.successes_in_window = 0
+        self.saturated = False
+        if limit == self.limit:
+            return
+        print(f"[concurrency] {self.key} {self.limit} -> {limit} ({reason})")
+        self.last_change = {"at": time.time(), "from": self.limit, "to": limit, "reason": reason}
+        self.limit = limit
+        for fn in self.listeners:
+            try:
+                fn(self.key, limit)
+            except Exception as e:
+                print(f"[concurrency] listener of {self.key} failed: {repr(e)}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.cond:
+            return {
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                "latency_s": round(self.latency, 2) if self.latency is not None else None,
+                "baseline_s": round(self.baseline, 2) if self.baseline is not None else None,
+                "adaptive": self.adaptive,
+                "cooling_down": time.monotonic() < self.cooldown_until,
+                "counts": dict(self.counts),
+                "last_change": self.last_change,
+            }
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+class ConcurrencyController:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.limiters: Dict[str, AIMDLimiter] = {}
+        self.provider_listeners: List[Callable[[str, int], None]] = []
+
+    def limiter(self, provider: str, model: str) -> AIMDLimiter:
+        key = f"{provider}:{model}"
+        with self.lock:
+            lim = self.limiters.get(key)
+            if lim is None:
+                p = provider.upper()
+                lim = AIMDLimiter(
+                    key,
+                    initial=_env_int(f"AIMD_INITIAL_{p}", _env_int(f"QUEUE_CONCURRENCY_{p}", 4)),
+                    min_limit=_env_int(f"AIMD_MIN_{p}", DEFAULT_MIN_LIMIT),
+                    max_limit=_env_int(f"AIMD_MAX_{p}", DEFAULT_MAX_LIMIT),
+                    adaptive=adaptive_concurrency_enabled(),
+                )
+                lim.listeners.append(lambda _key, _limit: self._provider_changed(provider))
+                self.limiters[key] = lim
+            return lim
+
+    def window(self, provider: str, model: str) -> int:
+        return self.limiter(provider, model).limit
+
+    def provider_window(self, provider: str) -> Optional[int]:
+        '''Largest window among the models of a provider, None before its first call.'''
+        with self.lock:
+            limits = [l.limit for k, l in self.limiters.items() if k.startswith(provider + ":")]
+        return max(limits) if limits else None
+
+    def on_provider_change(self, fn: Callable[[str, int], None]):
+        self.provider_listeners.append(fn)
+
+    def _provider_changed(self, provider: str):
+        window = self.provider_window(provider)
+        for fn in self.provider_listeners:
+            fn(provider, window)
+
+    @contextmanager
+    def slot(self, provider: str, model: str):
+        '''
+        Hold one in-flight slot of provider:model around a call and feed
+        its latency and outcome back into the window.
+        '''
+        lim = self.limiter(provider, model)
+        lim.acquire()
+        started = time.monotonic()
+        outcome = "error"
+        try:
+            yield lim
+            outcome = "ok"
+        except JobTimeout:
+            outcome = "slow"
+            raise
+        except JobCancelled:
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            outcome = "throttled" if error_status(e) in THROTTLE_STATUSES else "error"
+            raise
+        finally:
+            lim.release(time.monotonic() - started if outcome == "ok" else None, outcome)
+
+    @asynccontextmanager
+    async def slot_async(self, provider: str, model: str):
+        lim = self.limiter(provider, model)
+        await lim.acquire_async()
+        started = time.monotonic()
+        outcome = "error"
+        try:
+            yield lim
+            outcome = "ok"
+        except JobTimeout:
+            outcome = "slow"
+            raise
+        except JobCancelled:
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            outcome = "throttled" if error_status(e) in THROTTLE_STATUSES else "error"
+            raise
+        finally:
+            lim.release(time.monotonic() - started if outcome == "ok" else None, outcome)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            limiters = dict(self.limiters)
+        return {key: lim.snapshot() for key, lim in limiters.items()}
+
+
+concurrency = ConcurrencyController()
@@ -0,0 +1,366 @@
+# journal.py
+# Durable on-disk journal of queued and running jobs (SQLite, WAL mode).
+# Every dev/worker job is written here before it is scheduled, claimed
+# with a lease when it starts and removed when it ends. Jobs whose lease
+# expires (process killed, deploy, crash) go back to the queue.
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from .cancellation import cancel_running
+
+QUEUED = "queued"
+RUNNING = "running"
+
+DEFAULT_LEASE_SECONDS = 120
+DEFAULT_MAX_ATTEMPTS = 3
+
+# unique per process, stored as the lease owner of running jobs
+OWNER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id        TEXT PRIMARY KEY,
+    uid           TEXT NOT NULL,
+    runner        TEXT NOT NULL,
+    media         TEXT NOT NULL,
+    prompt        TEXT NOT NULL,
+    options       TEXT NOT NULL,
+    provider      TEXT NOT NULL,
+    priority      TEXT NOT NULL,
+    state         TEXT NOT NULL,
+    owner         TEXT,
+    lease_expires REAL,
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    created_at    REAL NOT NULL,
+    updated_at    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, priority, created_at);
+CREATE TABLE IF NOT EXISTS cancels (
+    job_id       TEXT PRIMARY KEY,
+    requested_at REAL NOT NULL
+);
+"""
+
+# how often the lease keeper looks for cancel requests of its jobs
+CANCEL_POLL_SECONDS = 2
+
+
+def _row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+    job = dict(row)
+    job["media"] = json.loads(job["media"])
+    job["options"] = json.loads(job["options"])
+    return job
+
+
+class JobJournal:
+
+    def __init__(
+        self,
+        path: str,
+        lease_seconds: int = DEFAULT_LEASE_SECONDS,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    ):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite connections are not shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    # ---------------- producer side ----------------
+
+    def add(
+        self,
+        *,
+        job_id: str,
+        uid: str,
+        runner: str,
+        media: list,
+        prompt: str,
+        options: Optional[dict] = None,
+        provider: str = "default",
+        priority: str = "interactive",
+    ):
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO jobs (job_id, uid, runner, media, prompt, options, provider, priority,"
+            " state, owner, lease_expires, attempts, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, NULL, 0, ?, ?)",
+            (job_id, uid, runner, json.dumps(media), prompt, json.dumps(options or {}),
+             provider, priority, QUEUED, now, now),
+        )
+
+    # ---------------- consumer side ----------------
+
+    def claim(self, job_id: str, owner: str = OWNER_ID) -> bool:
+        """Take the lease of a queued (or stale) job. False if someone else holds it."""
+        now = time.time()
+        cur = self._conn().execute(
+            "UPDATE jobs SET state=?, owner=?, lease_expires=?, attempts=attempts+1, updated_at=?"
+            " WHERE job_id=? AND (state=? OR (state=? AND lease_expires < ?))",
+            (RUNNING, owner, now + self.lease_seconds, now, job_id, QUEUED, RUNNING, now),
+        )
+        return cur.rowcount == 1
+
+    def claim_next(self, owner: str = OWNER_ID, providers: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """Claim the oldest queued job, interactive first. Used by standalone workers."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            query = "SELECT * FROM jobs WHERE state=?"
+            params: List[Any] = [QUEUED]
+            if providers:
+                query += f" AND provider IN ({','.join('?' * len(providers))})"
+                params += providers
+            query += " ORDER BY priority='interactive' DESC, created_at LIMIT 1"
+            row = conn.execute(query, params).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET state=?, owner=?, lease_expires=?, attempts=attempts+1, updated_at=? WHERE job_id=?",
+                (RUNNING, owner, now + self.lease_seconds, now, row["job_id"]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return _row_to_job(row)
+
+    def heartbeat(self, job_ids: List[str], owner: str = OWNER_ID) -> int:
+        """Extend the lease of jobs held by owner. Returns how many were extended."""
+        if not job_ids:
+            return 0
+        now = time.time()
+        cur = self._conn().execute(
+            f"UPDATE jobs SET lease_expires=?, updated_at=? WHERE owner=? AND state=?"
+            f" AND job_id IN ({','.join('?' * len(job_ids))})",
+            (now + self.lease_seconds, now, owner, RUNNING, *job_ids),
+        )
+        return cur.rowcount
+
+    def finish(self, job_id: str):
+        """The job reached a final state (recorded in Firestore), forget it."""
+        conn = self._conn()
+        conn.execute("DELETE FROM jobs WHERE job_id=?", (job_id,))
+        conn.execute("DELETE FROM cancels WHERE job_id=?", (job_id,))
+
+    def request_cancel(self, job_id: str) -> Optional[str]:
+        """
+        Queued jobs are removed right away, running jobs get a cancel
+        request picked up by the lease keeper of their owner.
+        Returns the state the job was in, None if it is not journaled.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT state FROM jobs WHERE job_id=?", (job_id,)).fetchone()
+            if row is None:
+                state = None
+            elif row["state"] == QUEUED:
+                conn.execute("DELETE FROM jobs WHERE job_id=?", (job_id,))
+                state = QUEUED
+            else:
+                conn.execute("INSERT OR REPLACE INTO cancels (job_id, requested_at) VALUES (?, ?)", (job_id, time.time()))
+                state = RUNNING
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return state
+
+    def cancel_requests(self, job_ids: List[str]) -> List[str]:
+        """The subset of job_ids someone asked to cancel."""
+        if not job_ids:
+            return []
+        rows = self._conn().execute(
+            f"SELECT job_id FROM cancels WHERE job_id IN ({','.join('?' * len(job_ids))})", job_ids
+        ).fetchall()
+        return [r["job_id"] for r in rows]
+
+    def requeue_stale(self) -> Tuple[List[str], List[Dict[str, Any]]]:
+        """
+        Put running jobs with an expired lease back in the queue.
+        Jobs that already used max_attempts (or were cancelled) are
+        removed and returned as abandoned, so the caller can mark them.
+        """
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT jobs.*, cancels.job_id IS NOT NULL AS cancel_requested FROM jobs"
+                " LEFT JOIN cancels ON cancels.job_id = jobs.job_id"
+                " WHERE state=? AND lease_expires < ?", (RUNNING, now)
+            ).fetchall()
+            requeued, abandoned = [], []
+            for row in rows:
+                # a job cancelled while its worker died is not retried
+                if row["cancel_requested"] or row["attempts"] >= self.max_attempts:
+                    conn.execute("DELETE FROM jobs WHERE job_id=?", (row["job_id"],))
+                    conn.execute("DELETE FROM cancels WHERE job_id=?", (row["job_id"],))
+                    abandoned.append(_row_to_job(row))
+                else:
+                    conn.execute(
+                        "UPDATE jobs SET state=?, owner=NULL, lease_expires=NULL, updated_at=? WHERE job_id=?",
+                        (QUEUED, now, row["job_id"]),
+                    )
+                    requeued.append(row["job_id"])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return requeued, abandoned
+
+    def queued(self) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT * FROM jobs WHERE state=? ORDER BY priority='interactive' DESC, created_at", (QUEUED,)
+        ).fetchall()
+        return [_row_to_job(r) for r in rows]
+
+    def stats(self) -> Dict[str, int]:
+        rows = self._conn().execute("SELECT state, COUNT(*) AS n FROM jobs GROUP BY state").fetchall()
+        return {r["state"]: r["n"] for r in rows}
+
+
+class LeaseKeeper:
+    """
+    Background thread that renews the lease of every job
+    this process is running, every lease_seconds / 3, and
+    forwards cancel requests of those jobs to their runner.
+    """
+
+    def __init__(self, journal: JobJournal, owner: str = OWNER_ID):
+        self.journal = journal
+        self.owner = owner
+        self.job_ids = set()
+        self.lock = threading.Lock()
+        self._thread = threading.Thread(target=self._loop, name="journal-heartbeat", daemon=True)
+        self._thread.start()
+
+    def hold(self, job_id: str):
+        with self.lock:
+            self.job_ids.add(job_id)
+
+    def release(self, job_id: str):
+        with self.lock:
+            self.job_ids.discard(job_id)
+
+    def _loop(self):
+        heartbeat_every = max(1, self.journal.lease_seconds / 3)
+        last_heartbeat = time.monotonic()
+        while True:
+            time.sleep(CANCEL_POLL_SECONDS)
+            with self.lock:
+                job_ids = list(self.job_ids)
+            try:
+                for job_id in self.journal.cancel_requests(job_ids):
+                    cancel_running(job_id)
+                if time.monotonic() - last_heartbeat >= heartbeat_every:
+                    self.journal.heartbeat(job_ids, self.owner)
+                    last_heartbeat = time.monotonic()
+            except sqlite3.Error as e:
+                print(f"[journal] heartbeat failed: {repr(e)}")
+
+
+_journal: Optional[JobJournal] = None
+_lease_keeper: Optional[LeaseKeeper] = None
+_journal_lock = threading.Lock()
+
+
+def journal_enabled() -> bool:
+    return os.getenv("JOB_JOURNAL", "1").lower() not in ("0", "false", "no")
+
+
+def get_journal() -> Optional[JobJournal]:
+    """Process-wide journal (JOB_JOURNAL_PATH), None when JOB_JOURNAL=0."""
+    global _journal, _lease_keeper
+    if not journal_enabled():
+        return None
+    with _journal_lock:
+        if _journal is None:
+            path = os.getenv("JOB_JOURNAL_PATH", os.path.join(os.getcwd(), "journal", "jobs.sqlite3"))
+            _journal = JobJournal(
+                path,
+                lease_seconds=int(os.getenv("JOB_LEASE_SECONDS", DEFAULT_LEASE_SECONDS)),
+                max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)),
+            )
+            _lease_keeper = LeaseKeeper(_journal)
+        return _journal
+
+
+def get_lease_keeper() -> Optional[LeaseKeeper]:
+    get_journal()
+    return _lease_keeper
+
+
+# jobs handed to this process' scheduler / async runner and not finished yet
+_local_jobs = set()
+_local_jobs_lock = threading.Lock()
+
+
+def mark_local(job_id: str) -> bool:
+    """Remember a job as scheduled in this process. False if it already was."""
+    with _local_jobs_lock:
+        if job_id in _local_jobs:
+            return False
+        _local_jobs.add(job_id)
+        return True
+
+
+def unmark_local(job_id: str):
+    with _local_jobs_lock:
+        _local_jobs.discard(job_id)
+
+
+def run_journaled(run_fn, db, job_id: str, uid: str, media: list, prompt: str, **options):
+    """Run a job under a journal lease: claim, heartbeat while running, forget when done."""
+    journal, keeper = get_journal(), get_lease_keeper()
+    try:
+        if not journal.claim(job_id):
+            print(f"[journal] job {job_id} already claimed elsewhere, skipping")
+            return
+        keeper.hold(job_id)
+        try:
+            return run_fn(db, job_id, uid, media, prompt, **options)
+        finally:
+            keeper.release(job_id)
+            journal.finish(job_id)
+    finally:
+        unmark_local(job_id)
+
+
+async def run_journaled_async(run_fn, db, job_id: str, uid: str, media: list, prompt: str, **options):
+    """Coroutine twin of run_journaled."""
+    journal, keeper = get_journal(), get_lease_keeper()
+    try:
+        if not journal.claim(job_id):
+            print(f"[journal] job {job_id} already claimed elsewhere, skipping")
+            return
+        keeper.hold(job_id)
+        try:
+            return await run_fn(db, job_id, uid, media, prompt, **options)
+        finally:
+            keeper.release(job_id)
+            journal.finish(job_id)
+    finally:
+        unmark_local(job_id)
@@ -0,0 +1,80 @@
+# journal_worker.py
+# Standalone consumer of the job journal. Run it next to the web
+# process started with ENV=journal (which only writes the journal):
+#
+#   ENV=journal python -m queue_manager.journal_worker --threads 4
+#
+import time
+import inspect
+import argparse
+import threading
+
+
+def _work(db, journal, keeper, providers, poll_interval):
+    from jobs import get_job_runner
+    from .async_runner import get_async_runner
+    from .journal import OWNER_ID
+
+    while True:
+        job = journal.claim_next(OWNER_ID, providers=providers)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+
+        run_fn = get_job_runner(job["runner"])
+        if run_fn is None:
+            print(f"[journal_worker] unknown runner {job['runner']} for job {job['job_id']}, dropping")
+            journal.finish(job["job_id"])
+            continue
+
+        args = (db, job["job_id"], job["uid"], job["media"], job["prompt"])
+        keeper.hold(job["job_id"])
+        try:
+            if inspect.iscoroutinefunction(run_fn):
+                get_async_runner().run(run_fn, *args, **job["options"])
+            else:
+                run_fn(*args, **job["options"])
+        except Exception as e:
+            print(f"[journal_worker] job {job['job_id']} crashed: {repr(e)}")
+        finally:
+            keeper.release(job["job_id"])
+            journal.finish(job["job_id"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run jobs from the on-disk job journal")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--providers", nargs="*", default=None, help="only run jobs of these providers")
+    parser.add_argument("--poll", type=float, default=0.5, help="seconds between polls when idle")
+    args = parser.parse_args()
+
+    # initializes firebase, storage and gemini clients
+    from app import db
+    from .journal import get_journal, get_lease_keeper
+    from .queue_backend import mark_abandoned
+
+    journal, keeper = get_journal(), get_lease_keeper()
+    if journal is None:
+        raise SystemExit("job journal is disabled (JOB_JOURNAL=0)")
+
+    for i in range(args.threads):
+        threading.Thread(
+            target=_work,
+            args=(db, journal, keeper, args.providers, args.poll),
+            name=f"journal-worker-{i}",
+            daemon=True,
+        ).start()
+
+    print(f"[journal_worker] {args.threads} threads on {journal.path}")
+    while True:
+        # jobs of crashed workers go back to the queue
+        requeued, abandoned = journal.requeue_stale()
+        if abandoned:
+            mark_abandoned(db, abandoned)
+        if requeued:
+            print(f"[journal_worker] requeued {len(requeued)} stale jobs")
+        time.sleep(journal.lease_seconds / 2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+# local_tasks.py
+# In-process stand-in for a Cloud Tasks HTTP queue.
+# Tasks are POSTed to their target url with the same rate limit,
+# concurrency and retry semantics as a Cloud Tasks queue, so the
+# prod path (enqueue -> /run_job worker) can be exercised on one box.
+import os
+import time
+import heapq
+import itertools
+import threading
+import uuid
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+
+@dataclass
+class LocalTask:
+    name: str
+    url: str
+    body: bytes
+    headers: Dict[str, str] = field(default_factory=dict)
+    attempts: int = 0
+    created_at: float = field(default_factory=time.time)
+
+
+class LocalTaskQueue:
+    """
+    Mirrors the Cloud Tasks queue settings:
+      - max_dispatches_per_second: token bucket refill rate
+      - max_burst_size: token bucket size
+      - max_concurrent_dispatches: tasks in flight at the same time
+      - max_attempts / min_backoff / max_backoff / max_doublings: retry config
+    Any non-2xx response or connection error is retried with backoff.
+    """
+
+    def __init__(
+        self,
+        queue_name: str = "local",
+        max_dispatches_per_second: float = 500.0,
+        max_burst_size: Optional[int] = None,
+        max_concurrent_dispatches: int = 10,
+        max_attempts: int = 5,
+        min_backoff: float = 0.1,
+        max_backoff: float = 3600.0,
+        max_doublings: int = 16,
+        dispatch_deadline: float = 600.0,
+    ):
+        self.queue_name = queue_name
+        self.rate = float(max_dispatches_per_second)
+        self.burst = float(max_burst_size or max(1, int(self.rate)))
+        self.max_concurrent = max_concurrent_dispatches
+        self.max_attempts = max_attempts
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.max_doublings = max_doublings
+        self.dispatch_deadline = dispatch_deadline
+
+        self._heap = []  # (eta, seq, task)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._slots = threading.Semaphore(max_concurrent_dispatches)
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_concurrent_dispatches,
+            thread_name_prefix=f"tasks-{queue_name}",
+        )
+        self._tokens = self.burst
+        self._last_refill = time.monotonic()
+        self._started_at = time.time()
+        self._stats = {
+            "created": 0,
+            "dispatched": 0,
+            "succeeded": 0,
+            "retried": 0,
+            "failed": 0,
+            "in_flight": 0,
+            "total_latency_s": 0.0,
+        }
+
+        self._dispatcher = threading.Thread(
+            target=self._dispatch_loop, name=f"tasks-{queue_name}-dispatcher", daemon=True
+        )
+        self._dispatcher.start()
+
+    # ---------------- public api ----------------
+
+    def create_task(self, url: str, body: bytes, headers: Optional[Dict[str, str]] = None) -> str:
+        task = LocalTask(name=uuid.uuid4().hex, url=url, body=body, headers=dict(headers or {}))
+        with self._cond:
+            self._stats["created"] += 1
+            self._push(task, time.monotonic())
+        return task.name
+
+    def stats(self) -> dict:
+        with self._cond:
+            out = dict(self._stats)
+            out["queued"] = len(self._heap)
+        elapsed = max(1e-6, time.time() - self._started_at)
+        out["throughput_per_s"] = round(out["succeeded"] / elapsed, 3)
+        done = out["succeeded"] + out["failed"]
+        out["avg_latency_s"] = round(out.pop("total_latency_s") / done, 3) if done else None
+        return out
+
+    # ---------------- internals ----------------
+
+    def _push(self, task: LocalTask, eta: float):
+        heapq.heappush(self._heap, (eta, next(self._seq), task))
+        self._cond.notify()
+
+    def _backoff(self, attempts: int) -> float:
+        delay = self.min_backoff * (2 ** min(attempts - 1, self.max_doublings))
+        return min(delay, self.max_backoff)
+
+    def _take_token(self) -> float:
+        """Consume one dispatch token. Returns seconds to wait if none is available."""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def _dispatch_loop(self):
+        while True:
+            # wait for a free dispatch slot before picking a task
+            self._slots.acquire()
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    eta = self._heap[0][0]
+                    if eta > now:
+                        self._cond.wait(eta - now)
+                        continue
+                    wait = self._take_token()
+                    if wait > 0:
+                        self._cond.wait(wait)
+                        continue
+                    _, _, task = heapq.heappop(self._heap)
+                    self._stats["dispatched"] += 1
+                    self._stats["in_flight"] += 1
+                    break
+            self._pool.submit(self._dispatch, task)
+
+    def _dispatch(self, task: LocalTask):
+        headers = {
+            **task.headers,
+            "X-CloudTasks-QueueName": self.queue_name,
+            "X-CloudTasks-TaskName": task.name,
+            "X-CloudTasks-TaskRetryCount": str(task.attempts),
+        }
+        ok = False
+        try:
+            r = requests.post(task.url, data=task.body, headers=headers, timeout=self.dispatch_deadline)
+            ok = 200 <= r.status_code < 300
+            if not ok:
+                print(f"[local_tasks] task {task.name} -> HTTP {r.status_code}")
+        except requests.RequestException as e:
+            print(f"[local_tasks] task {task.name} -> {repr(e)}")
+        finally:
+            self._slots.release()
+
+        task.attempts += 1
+        with self._cond:
+            self._stats["in_flight"] -= 1
+            if ok:
+                self._stats["succeeded"] += 1
+                self._stats["total_latency_s"] += time.time() - task.created_at
+            elif task.attempts < self.max_attempts:
+                self._stats["retried"] += 1
+                self._push(task, time.monotonic() + self._backoff(task.attempts))
+            else:
+                self._stats["failed"] += 1
+                self._stats["total_latency_s"] += time.time() - task.created_at
+                print(f"[local_tasks] task {task.name} dropped after {task.attempts} attempts")
+
+
+_local_queue: Optional[LocalTaskQueue] = None
+_local_queue_lock = threading.Lock()
+
+
+def get_local_task_queue() -> LocalTaskQueue:
+    """Process-wide local queue, configured from LOCAL_TASKS_* env variables."""
+    global _local_queue
+    with _local_queue_lock:
+        if _local_queue is None:
+            _local_queue = LocalTaskQueue(
+                queue_name=os.getenv("TASKS_QUEUE", "local"),
+                max_dispatches_per_second=float(os.getenv("LOCAL_TASKS_RATE", 500)),
+                max_concurrent_dispatches=int(os.getenv("LOCAL_TASKS_CONCURRENCY", 10)),
+                max_attempts=int(os.getenv("LOCAL_TASKS_MAX_ATTEMPTS", 5)),
+                min_backoff=float(os.getenv("LOCAL_TASKS_MIN_BACKOFF", 0.1)),
+                max_backoff=float(os.getenv("LOCAL_TASKS_MAX_BACKOFF", 3600)),
+            )
+        return _local_queue
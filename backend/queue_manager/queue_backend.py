@@ -1,30 +1,309 @@
 # queue_backend.py
-import os, json, concurrent.futures
+import os, json, inspect, threading, time
 from google.cloud import tasks_v2
 from flask import current_app as app
+from .scheduler import scheduler, QueueFull, INTERACTIVE, BATCH, PRIORITIES
+from .local_tasks import get_local_task_queue
+from .admission import admission, Overloaded
+from .async_runner import get_async_runner
+from .journal import get_journal, mark_local, unmark_local, run_journaled, run_journaled_async
+from .cancellation import cancel_running, JobCancelled, JobTimeout
+from .concurrency import concurrency, adaptive_concurrency_enabled
 
-executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+# provider pools of the scheduler follow the adaptive concurrency window
+if adaptive_concurrency_enabled():
+    concurrency.on_provider_change(lambda provider, window: scheduler.set_concurrency(provider, window))
 
-def enqueue_job_dev(run_fn, *, db, job_id: str, uid: str, media: dict, prompt: str):
-    # background thread; write status via shared helpers
-    executor.submit(run_fn, db, job_id, uid, media, prompt)
 
-def enqueue_job_prod(*, job_id: str, media: dict, prompt: str):
+def _submit_local(run_fn, *, db, job_id, uid, media, prompt, provider, priority, options):
+    '''
+    Hand a job to this process: coroutine runners go to the event loop,
+    the others to the fair scheduler. Journaled jobs run under a lease.
+    '''
+    journaled = get_journal() is not None
+    if journaled and not mark_local(job_id):
+        return None
+
+    try:
+        if inspect.iscoroutinefunction(run_fn):
+            # coroutine runners do not need a thread, they go to the event loop
+            if journaled:
+                return get_async_runner().submit(run_journaled_async, run_fn, db, job_id, uid, media, prompt, **options)
+            return get_async_runner().submit(run_fn, db, job_id, uid, media, prompt, **options)
+
+        fn, args = (run_journaled, (run_fn, db, job_id, uid, media, prompt)) if journaled else (run_fn, (db, job_id, uid, media, prompt))
+        return scheduler.submit(
+            fn, *args,
+            job_id=job_id,
+            uid=uid,
+            provider=provider,
+            priority=priority,
+            **options,
+        )
+    except QueueFull:
+        if journaled:
+            unmark_local(job_id)
+        raise
+
+
+def enqueue_job_dev(
+    run_fn,
+    *,
+    db,
+    job_id: str,
+    uid: str,
+    media: dict,
+    prompt: str,
+    provider: str = "default",
+    priority: str = INTERACTIVE,
+    **options,
+):
+    # background thread; write status via shared helpers.
+    # the fair scheduler picks the thread (per provider, per user, per priority)
+    # options are extra keyword arguments of the runner (e.g. fan-out variants).
+    # the job is journaled first so that a restart does not lose it
+    journal = get_journal()
+    if journal is not None:
+        journal.add(
+            job_id=job_id, uid=uid, runner=run_fn.__name__, media=media, prompt=prompt,
+            options=options, provider=provider, priority=priority,
+        )
+
+    try:
+        return _submit_local(
+            run_fn, db=db, job_id=job_id, uid=uid, media=media, prompt=prompt,
+            provider=provider, priority=priority, options=options,
+        )
+    except QueueFull:
+        if journal is not None:
+            journal.finish(job_id)
+        raise
+
+
+def enqueue_job_journal(
+    run_fn,
+    *,
+    db=None,
+    job_id: str,
+    uid: str,
+    media: dict,
+    prompt: str,
+    provider: str = "default",
+    priority: str = INTERACTIVE,
+    **options,
+):
+    # only write the job to the journal, a standalone
+    # worker (queue_manager.journal_worker) runs it
+    journal = get_journal()
+    if journal is None:
+        raise RuntimeError("ENV=journal requires the job journal (JOB_JOURNAL=1)")
+    journal.add(
+        job_id=job_id, uid=uid, runner=run_fn.__name__, media=media, prompt=prompt,
+        options=options, provider=provider, priority=priority,
+    )
+
+
+def mark_abandoned(db, jobs):
+    '''
+    Jobs that kept dying mid-run are given up: record it on the job document
+    '''
+    from firestore import jobs_update
+    for job in jobs:
+        if job.get("cancel_requested"):
+            jobs_update(db, job["job_id"], job["uid"], {"status": "canceled"})
+            continue
+        print(f"[journal] giving up job {job['job_id']} after {job['attempts']} attempts")
+        jobs_update(db, job["job_id"], job["uid"], {
+            "status": "failed",
+            "error": {
+                "status": "ABORTED",
+                "reason": "WorkerLost",
+                "message": f"job was interrupted {job['attempts']} times",
+                "details": None,
+            },
+        })
+
+
+def cancel_job(job_id: str):
+    '''
+    Stop a job wherever this process can reach it. Returns "queued" when it
+    was dropped before starting, "running" when its runner was signalled
+    (the runner records the outcome) and None when the job is not held here.
+    '''
+    if scheduler.cancel(job_id) == "queued":
+        unmark_local(job_id)
+        journal = get_journal()
+        if journal is not None:
+            journal.finish(job_id)
+        return "queued"
+
+    if cancel_running(job_id):
+        return "running"
+
+    # journaled jobs of another process (ENV=journal workers)
+    journal = get_journal()
+    if journal is not None:
+        return journal.request_cancel(job_id)
+    return None
+
+
+def replay_journal(db):
+    '''
+    Re-schedule journaled jobs in this process: queued jobs that are not
+    scheduled here yet and running jobs whose lease expired.
+    '''
+    journal = get_journal()
+    if journal is None:
+        return 0
+
+    from jobs import get_job_runner
+
+    requeued, abandoned = journal.requeue_stale()
+    if abandoned:
+        mark_abandoned(db, abandoned)
+
+    replayed = 0
+    for job in journal.queued():
+        run_fn = get_job_runner(job["runner"])
+        if run_fn is None:
+            print(f"[journal] unknown runner {job['runner']} for job {job['job_id']}, dropping")
+            journal.finish(job["job_id"])
+            continue
+        try:
+            if _submit_local(
+                run_fn, db=db, job_id=job["job_id"], uid=job["uid"], media=job["media"],
+                prompt=job["prompt"], provider=job["provider"], priority=job["priority"],
+                options=job["options"],
+            ) is not None:
+                replayed += 1
+        except QueueFull:
+            # the rest stays in the journal for the next pass
+            break
+
+    if replayed or requeued:
+        print(f"[journal] replayed {replayed} jobs ({len(requeued)} stale leases)")
+    return replayed
+
+
+def start_journal_replayer(db, interval: float = None):
+    '''
+    Replay the journal now (startup) and then periodically,
+    so stale running jobs are picked up again
+    '''
+    journal = get_journal()
+    if journal is None:
+        return None
+    interval = interval or journal.lease_seconds
+
+    def _loop():
+        while True:
+            try:
+                replay_journal(db)
+            except Exception as e:
+                print(f"[journal] replay failed: {repr(e)}")
+            time.sleep(interval)
+
+    t = threading.Thread(target=_loop, name="journal-replayer", daemon=True)
+    t.start()
+    return t
+
+
+def worker_oidc():
+    '''
+    (service account, audience) of the OIDC token Cloud Tasks attaches
+    to the /run_job calls, None when WORKER_OIDC_SERVICE_ACCOUNT is unset.
+    '''
+    account = os.getenv("WORKER_OIDC_SERVICE_ACCOUNT")
+    if not account:
+        return None
+    audience = os.getenv("WORKER_OIDC_AUDIENCE") or os.getenv("WORKER_URL", "http://127.0.0.1:8080")
+    return account, audience
+
+
+def _worker_task(run_fn, *, job_id: str, uid: str, media: dict, prompt: str, provider: str, priority: str, options: dict):
+    '''
+    Builds the http task consumed by the /run_job worker.
+    The runner is referenced by name, see jobs.JOB_RUNNERS
+    '''
+    body = {
+        "runner": run_fn.__name__,
+        "job_id": job_id,
+        "uid": uid,
+        "media": media,
+        "prompt": prompt,
+        "provider": provider,
+        "priority": priority,
+        "options": options,
+    }
+    headers = {"Content-Type": "application/json"}
+    if os.getenv("WORKER_TOKEN"):
+        headers["X-Worker-Token"] = os.environ["WORKER_TOKEN"]
+
+    url = os.getenv("WORKER_URL", "http://127.0.0.1:8080") + "/run_job"
+    return url, json.dumps(body).encode("utf-8"), headers
+
+
+def enqueue_job_prod(
+    run_fn,
+    *,
+    db=None,
+    job_id: str,
+    uid: str,
+    media: dict,
+    prompt: str,
+    provider: str = "default",
+    priority: str = INTERACTIVE,
+    **options,
+):
+    # db is not serializable, the worker uses its own client
+    url, body, headers = _worker_task(
+        run_fn, job_id=job_id, uid=uid, media=media, prompt=prompt,
+        provider=provider, priority=priority, options=options,
+    )
     client = tasks_v2.CloudTasksClient()
     parent = client.queue_path(os.environ["GCP_PROJECT"], os.environ["GCP_LOCATION"], os.environ["TASKS_QUEUE"])
-    body = {"job_id": job_id, "media": media, "prompt": prompt}
     task = {
         "http_request": {
             "http_method": tasks_v2.HttpMethod.POST,
-            "url": os.environ["WORKER_URL"] + "/run_job",
-            "headers": {"Content-Type": "application/json"},
-            "body": json.dumps(body).encode("utf-8"),
+            "url": url,
+            "headers": headers,
+            "body": body,
         }
     }
-    client.create_task(request={"parent": parent, "task": task})
+    oidc = worker_oidc()
+    if oidc is not None:
+        # signed by Google as the service account, verified by the worker
+        task["http_request"]["oidc_token"] = {"service_account_email": oidc[0], "audience": oidc[1]}
+    return client.create_task(request={"parent": parent, "task": task})
+
+
+def enqueue_job_local_tasks(
+    run_fn,
+    *,
+    db=None,
+    job_id: str,
+    uid: str,
+    media: dict,
+    prompt: str,
+    provider: str = "default",
+    priority: str = INTERACTIVE,
+    **options,
+):
+    # same payload as prod, dispatched by the in-process Cloud Tasks stand-in
+    url, body, headers = _worker_task(
+        run_fn, job_id=job_id, uid=uid, media=media, prompt=prompt,
+        provider=provider, priority=priority, options=options,
+    )
+    return get_local_task_queue().create_task(url, body, headers)
+
 
 def enqueue(run_fn, **kwargs):
-    if os.getenv("ENV", "dev") == "prod":
-        return enqueue_job_prod(**kwargs)
+    env = os.getenv("ENV", "dev")
+    if env == "prod":
+        return enqueue_job_prod(run_fn, **kwargs)
+    elif env == "local_tasks":
+        return enqueue_job_local_tasks(run_fn, **kwargs)
+    elif env == "journal":
+        return enqueue_job_journal(run_fn, **kwargs)
     else:
         return enqueue_job_dev(run_fn, **kwargs)
@@ -0,0 +1,183 @@
+# rate_limiter.py
+# Token buckets shared by every worker of the host (gunicorn threads,
+# journal workers, ...). Bucket state lives in a small SQLite file, so
+# provider calls are paced before they are sent instead of being
+# rejected with a 429 and retried.
+import os
+import time
+import asyncio
+import sqlite3
+import threading
+from typing import Optional
+from .cancellation import current_token, JobCancelled
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key     TEXT PRIMARY KEY,
+    tokens  REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+# longest a call waits for a token before giving up
+DEFAULT_MAX_WAIT = 300
+
+
+class RateLimited(Exception):
+    """No token became available within max_wait."""
+
+
+class TokenBucketLimiter:
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def try_acquire(self, key: str, rate: float, burst: int, cost: float = 1) -> float:
+        '''
+        Take `cost` tokens from the bucket if it holds them.
+        Returns 0 when granted, otherwise the seconds until it will.
+        rate is in tokens per second, burst is the bucket size.
+        '''
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key=?", (key,)).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / rate
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                (key, tokens, now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def acquire(self, key: str, rate: float, burst: int, cost: float = 1, max_wait: float = DEFAULT_MAX_WAIT) -> float:
+        '''
+        Block until a token is granted. Returns the seconds waited.
+        The wait is interrupted if the current job is cancelled.
+        '''
+        started = time.monotonic()
+        while True:
+            wait = self.try_acquire(key, rate, burst, cost)
+            waited = time.monotonic() - started
+            if wait <= 0:
+                if waited > 1:
+                    print(f"[rate_limiter] {key} waited {waited:.2f}s for a token")
+                return waited
+            if waited + wait > max_wait:
+                raise RateLimited(f"no {key} token within {max_wait:g}s")
+            token = current_token()
+            if token is None:
+                time.sleep(wait)
+            elif token.event.wait(wait):
+                raise JobCancelled(f"job {token.job_id} was cancelled")
+
+    async def acquire_async(self, key: str, rate: float, burst: int, cost: float = 1, max_wait: float = DEFAULT_MAX_WAIT) -> float:
+        '''
+        Coroutine version of acquire, waits on the event loop. The SQLite
+        transaction (it may block on the file lock) runs in a thread.
+        '''
+        started = time.monotonic()
+        while True:
+            wait = await asyncio.to_thread(self.try_acquire, key, rate, burst, cost)
+            waited = time.monotonic() - started
+            if wait <= 0:
+                return waited
+            if waited + wait > max_wait:
+                raise RateLimited(f"no {key} token within {max_wait:g}s")
+            token = current_token()
+            if token is not None and token.cancelled:
+                raise JobCancelled(f"job {token.job_id} was cancelled")
+            await asyncio.sleep(wait)
+
+    def penalize(self, key: str, rate: float, seconds: float):
+        '''
+        The provider answered 429 anyway: empty the bucket so that
+        every worker holds off for about `seconds`.
+        '''
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+            (key, -rate * seconds, time.time()),
+        )
+
+
+_limiter: Optional[TokenBucketLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def rate_limits_enabled() -> bool:
+    return os.getenv("RATE_LIMITS", "1").lower() not in ("0", "false", "no")
+
+
+def get_rate_limiter() -> Optional[TokenBucketLimiter]:
+    """Host-wide limiter (RATE_LIMIT_PATH), None when RATE_LIMITS=0."""
+    global _limiter
+    if not rate_limits_enabled():
+        return None
+    with _limiter_lock:
+        if _limiter is None:
+            path = os.getenv("RATE_LIMIT_PATH", os.path.join(os.getcwd(), "journal", "rate_limits.sqlite3"))
+            _limiter = TokenBucketLimiter(path)
+        return _limiter
+
+
+# ---------------- per model helpers ----------------
+# limits are declared on the model configs, next to MODEL_REGISTRY
+
+def _model_limit(slug: str):
+    from replicate_api.models import model_rate_limit
+    return model_rate_limit(slug)
+
+
+def wait_for_model(slug: str) -> float:
+    """Wait for a call slot of a model. Returns the seconds waited."""
+    limiter, limit = get_rate_limiter(), _model_limit(slug)
+    if limiter is None or limit is None:
+        return 0.0
+    key, rate, burst = limit
+    return limiter.acquire(key, rate, burst)
+
+
+async def wait_for_model_async(slug: str) -> float:
+    limiter, limit = get_rate_limiter(), _model_limit(slug)
+    if limiter is None or limit is None:
+        return 0.0
+    key, rate, burst = limit
+    return await limiter.acquire_async(key, rate, burst)
+
+
+def penalize_model(slug: str, seconds: float = 10):
+    """Hold every worker off a model that answered 429."""
+    limiter, limit = get_rate_limiter(), _model_limit(slug)
+    if limiter is None or limit is None:
+        return
+    key, rate, _ = limit
+    print(f"[rate_limiter] {key} throttled by the provider, pausing {seconds:g}s")
+    limiter.penalize(key, rate, seconds)
+
+
+async def penalize_model_async(slug: str, seconds: float = 10):
+    """penalize_model from the event loop (the SQLite write runs in a thread)."""
+    await asyncio.to_thread(penalize_model, slug, seconds)
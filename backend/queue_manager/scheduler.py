@@ -0,0 +1,309 @@
+# scheduler.py
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional, Tuple
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+
+# how many threads may run jobs of a given provider at the same time.
+# override with QUEUE_CONCURRENCY_<PROVIDER>, e.g. QUEUE_CONCURRENCY_GEMINI=8
+DEFAULT_PROVIDER_CONCURRENCY = {
+    "gemini": 4,
+    "replicate": 4,
+    "default": 4,
+}
+
+# smoothing factor of the moving average of job durations
+DURATION_EWMA_ALPHA = 0.2
+
+# after this many interactive picks in a row a waiting batch job
+# gets a turn, so bulk work is slowed down but never starved
+INTERACTIVE_WEIGHT = 3
+
+
+class QueueFull(Exception):
+    """Raised when the scheduler (or a single user) has too many pending jobs."""
+
+
+@dataclass
+class ScheduledJob:
+    job_id: str
+    uid: str
+    provider: str
+    priority: str
+    fn: Callable[..., Any]
+    args: Tuple[Any, ...] = ()
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+    enqueued_at: float = field(default_factory=time.time)
+
+
+class _Lane:
+    """
+    One priority lane. Jobs are grouped per user and users
+    are served round-robin, one job per turn.
+    """
+
+    def __init__(self):
+        self.users: "OrderedDict[str, deque]" = OrderedDict()
+        self.size = 0
+
+    def push(self, job: ScheduledJob):
+        self.users.setdefault(job.uid, deque()).append(job)
+        self.size += 1
+
+    def pop(self) -> Optional[ScheduledJob]:
+        if not self.users:
+            return None
+        uid, jobs = next(iter(self.users.items()))
+        job = jobs.popleft()
+        if jobs:
+            # this user goes to the back of the line
+            self.users.move_to_end(uid)
+        else:
+            del self.users[uid]
+        self.size -= 1
+        return job
+
+    def remove(self, job_id: str) -> Optional[ScheduledJob]:
+        for uid, jobs in self.users.items():
+            for job in jobs:
+                if job.job_id == job_id:
+                    jobs.remove(job)
+                    if not jobs:
+                        del self.users[uid]
+                    self.size -= 1
+                    return job
+        return None
+
+    def __len__(self):
+        return self.size
+
+
+class _ProviderQueue:
+    """
+    Pending and running jobs of one provider, served by
+    a set of worker threads sized to the provider concurrency.
+    """
+
+    def __init__(self, name: str, concurrency: int):
+        self.name = name
+        self.concurrency = max(1, int(concurrency))
+        self.lanes = {p: _Lane() for p in PRIORITIES}
+        self.running = 0
+        self.threads = 0
+        self.interactive_streak = 0
+        self.avg_duration: Optional[float] = None
+
+    def record_duration(self, seconds: float):
+        if self.avg_duration is None:
+            self.avg_duration = seconds
+        else:
+            self.avg_duration += DURATION_EWMA_ALPHA * (seconds - self.avg_duration)
+
+    def pending(self) -> int:
+        return sum(len(lane) for lane in self.lanes.values())
+
+    def next_job(self) -> Optional[ScheduledJob]:
+        interactive, batch = self.lanes[INTERACTIVE], self.lanes[BATCH]
+        if len(interactive) and (not len(batch) or self.interactive_streak < INTERACTIVE_WEIGHT):
+            self.interactive_streak += 1
+            return interactive.pop()
+        self.interactive_streak = 0
+        return batch.pop()
+
+
+class FairScheduler:
+    """
+    In-process job scheduler used by the dev queue.
+
+    - one queue per provider, each with its own concurrency
+    - two priority lanes per provider (interactive before batch)
+    - round-robin between users inside a lane
+    - bounded: submit() raises QueueFull instead of growing forever
+    """
+
+    def __init__(
+        self,
+        concurrency: Optional[Dict[str, int]] = None,
+        max_pending: int = 100,
+        max_pending_per_user: int = 20,
+    ):
+        self.concurrency = dict(concurrency or DEFAULT_PROVIDER_CONCURRENCY)
+        self.max_pending = max_pending
+        self.max_pending_per_user = max_pending_per_user
+        self.providers: Dict[str, _ProviderQueue] = {}
+        self.pending_per_user: Dict[str, int] = {}
+        # job_id -> (job, "queued" | "running")
+        self.jobs: Dict[str, Tuple[ScheduledJob, str]] = {}
+        self.cond = threading.Condition()
+
+    # ---------------- public api ----------------
+
+    def submit(
+        self,
+        fn: Callable[..., Any],
+        *args,
+        job_id: str,
+        uid: str,
+        provider: str = "default",
+        priority: str = INTERACTIVE,
+        **kwargs,
+    ) -> ScheduledJob:
+        """Queue fn(*args, **kwargs). Raises QueueFull when the queue is saturated."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"unknown priority '{priority}'")
+
+        job = ScheduledJob(job_id, uid, provider, priority, fn, args, kwargs)
+
+        with self.cond:
+            if self._pending_total() >= self.max_pending:
+                raise QueueFull("job queue is full, try again later")
+            if self.pending_per_user.get(uid, 0) >= self.max_pending_per_user:
+                raise QueueFull(f"too many pending jobs for user {uid}")
+
+            pq = self._provider(provider)
+            pq.lanes[priority].push(job)
+            self.jobs[job_id] = (job, "queued")
+            self.pending_per_user[uid] = self.pending_per_user.get(uid, 0) + 1
+            self._spawn_workers(pq)
+            self.cond.notify_all()
+
+        return job
+
+    def set_concurrency(self, provider: str, concurrency: int):
+        """Resize a provider pool. Extra workers exit after their current job."""
+        with self.cond:
+            self.concurrency[provider] = max(1, int(concurrency))
+            pq = self._provider(provider)
+            pq.concurrency = self.concurrency[provider]
+            self._spawn_workers(pq)
+            self.cond.notify_all()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Queue depth and running jobs per provider."""
+        with self.cond:
+            return {
+                name: {
+                    "queued": pq.pending(),
+                    "queued_interactive": len(pq.lanes[INTERACTIVE]),
+                    "queued_batch": len(pq.lanes[BATCH]),
+                    "running": pq.running,
+                    "concurrency": pq.concurrency,
+                    "avg_duration_s": pq.avg_duration,
+                }
+                for name, pq in self.providers.items()
+            }
+
+    def find(self, job_id: str) -> Optional[Dict[str, str]]:
+        """Provider, priority and state of a job still held by the scheduler."""
+        with self.cond:
+            entry = self.jobs.get(job_id)
+            if entry is None:
+                return None
+            job, state = entry
+            return {"provider": job.provider, "priority": job.priority, "state": state}
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        '''
+        Drop a queued job before it starts. Returns the state the job was
+        in ("queued" or "running"), None if the scheduler does not hold it.
+        Running jobs are only reported, they stop through their cancel token.
+        '''
+        with self.cond:
+            entry = self.jobs.get(job_id)
+            if entry is None:
+                return None
+            job, state = entry
+            if state != "queued":
+                return state
+            self.providers[job.provider].lanes[job.priority].remove(job_id)
+            self.pending_per_user[job.uid] -= 1
+            if not self.pending_per_user[job.uid]:
+                del self.pending_per_user[job.uid]
+            del self.jobs[job_id]
+            return state
+
+    # ---------------- internals ----------------
+
+    def _pending_total(self) -> int:
+        return sum(pq.pending() for pq in self.providers.values())
+
+    def _provider(self, name: str) -> _ProviderQueue:
+        pq = self.providers.get(name)
+        if pq is None:
+            concurrency = self.concurrency.get(name, self.concurrency.get("default", 4))
+            pq = _ProviderQueue(name, concurrency)
+            self.providers[name] = pq
+        return pq
+
+    def _spawn_workers(self, pq: _ProviderQueue):
+        while pq.threads < pq.concurrency:
+            pq.threads += 1
+            t = threading.Thread(
+                target=self._worker,
+                args=(pq,),
+                name=f"jobs-{pq.name}-{pq.threads}",
+                daemon=True,
+            )
+            t.start()
+
+    def _take(self, pq: _ProviderQueue) -> Optional[ScheduledJob]:
+        """Block until a job is available. Returns None when the worker should exit."""
+        with self.cond:
+            while True:
+                if pq.threads > pq.concurrency:
+                    pq.threads -= 1
+                    return None
+                job = pq.next_job()
+                if job is not None:
+                    self.pending_per_user[job.uid] -= 1
+                    if not self.pending_per_user[job.uid]:
+                        del self.pending_per_user[job.uid]
+                    pq.running += 1
+                    self.jobs[job.job_id] = (job, "running")
+                    return job
+                self.cond.wait()
+
+    def _worker(self, pq: _ProviderQueue):
+        while True:
+            job = self._take(pq)
+            if job is None:
+                return
+            started = time.monotonic()
+            try:
+                job.fn(*job.args, **job.kwargs)
+            except BaseException as e:
+                # run functions record their own failures, this is a last resort
+                print(f"[scheduler] job {job.job_id} crashed: {repr(e)}")
+            finally:
+                with self.cond:
+                    pq.running -= 1
+                    pq.record_duration(time.monotonic() - started)
+                    self.jobs.pop(job.job_id, None)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def build_scheduler_from_env() -> FairScheduler:
+    concurrency = {
+        provider: _env_int(f"QUEUE_CONCURRENCY_{provider.upper()}", n)
+        for provider, n in DEFAULT_PROVIDER_CONCURRENCY.items()
+    }
+    return FairScheduler(
+        concurrency=concurrency,
+        max_pending=_env_int("QUEUE_MAX_PENDING", 100),
+        max_pending_per_user=_env_int("QUEUE_MAX_PENDING_PER_USER", 20),
+    )
+
+
+scheduler = build_scheduler_from_env()
@@ -1,6 +1,10 @@
 
 import io
+import os
+import time
 from typing import Tuple
+from urllib.parse import urlparse
+from gemini_api.inputs import fetch_input, INPUT_FETCH_DEADLINE
 from .replicate_generate import get_replicate_client
 
 def upload_images_to_replicate_cdn(image_urls):
@@ -17,6 +21,12 @@ def upload_images_to_replicate_cdn(image_urls):
     upload_urls = []
     client = get_replicate_client()
     for fpath in image_urls:  # file_inputs are local paths like "./uploads/img1.jpg"
+        if fpath.startswith(("http://", "https://")):
+            # remote input: bytes come through the input cache
+            data, _, _ = fetch_input(fpath, time.monotonic() + INPUT_FETCH_DEADLINE)
+            url, _ = upload_filelike_to_replicate(data, os.path.basename(urlparse(fpath).path) or "input")
+            upload_urls.append(url)
+            continue
         uploaded = client.files.create(fpath)
         print('uploaded',uploaded)
         upload_urls.append(uploaded.urls['get'])
@@ -2,9 +2,17 @@ import replicate
 import threading
 import time
 from copy import deepcopy
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, Optional
 from .models import _resolve_model_config
 from .output import collect_outputs, collect_urls
+from replicate.exceptions import ReplicateError
+from queue_manager.cancellation import current_token, provider_deadline, JobCancelled, JobTimeout
+from queue_manager.rate_limiter import wait_for_model, penalize_model
+from queue_manager.concurrency import concurrency
+from resilience import call_with_retry, get_policy, RetryPolicy
+
+# seconds between two status polls of a running prediction
+PREDICTION_POLL_INTERVAL = 1.0
 
 
 def _apply_aliases(payload: Dict[str, Any], aliases: Dict[str, str]) -> Dict[str, Any]:
@@ -45,6 +53,76 @@ def _merge_and_harmonize_inputs(
     return merged
 
 
+def _cancel_prediction(prediction):
+    try:
+        prediction.cancel()
+    except Exception as e:
+        print(f"could not cancel prediction {prediction.id}: {repr(e)}")
+
+
+def _run_prediction(
+    client: replicate.Client,
+    model_slug: str,
+    version: Optional[str],
+    inp: Dict[str, Any],
+    deadline: Optional[float] = None,
+    policy: Optional[RetryPolicy] = None,
+):
+    """
+    Same as client.run, but the prediction is polled here so that it can
+    be cancelled on Replicate when the deadline passes or the job is
+    cancelled (the thread is released and the prediction stops billing).
+    Transient errors retry the create and each status reload on their
+    own (replicate policy, or `policy`): a failed reload never starts a
+    second billed prediction next to the running one.
+    """
+    deadline = deadline or provider_deadline("replicate")
+    token = current_token()
+    if token is not None:
+        token.raise_if_cancelled()
+    throttled = False
+
+    def create():
+        nonlocal throttled
+        if throttled:
+            # the last attempt got a 429: wait for the quota again
+            wait_for_model(model_slug)
+        try:
+            if version:
+                return client.predictions.create(version=version, input=inp)
+            return client.predictions.create(model=model_slug, input=inp)
+        except ReplicateError as e:
+            if getattr(e, "status", None) == 429:
+                throttled = True
+                penalize_model(model_slug)
+            raise
+
+    # wait for a token of the model quota, shared by all workers, then
+    # hold a slot of its adaptive concurrency window until the prediction ends
+    wait_for_model(model_slug)
+    with concurrency.slot("replicate", model_slug):
+        prediction = call_with_retry(create, provider="replicate", policy=policy)
+
+        expires = time.monotonic() + deadline
+        try:
+            while prediction.status not in ("succeeded", "failed", "canceled"):
+                if token is not None and token.event.wait(PREDICTION_POLL_INTERVAL):
+                    raise JobCancelled(f"job {token.job_id} was cancelled")
+                if token is None:
+                    time.sleep(PREDICTION_POLL_INTERVAL)
+                if time.monotonic() >= expires:
+                    raise JobTimeout(f"replicate prediction {prediction.id} exceeded {deadline:g}s")
+                call_with_retry(prediction.reload, provider="replicate", policy=policy)
+        except BaseException:
+            # cancelled, timed out or unreachable: do not leave it billing
+            _cancel_prediction(prediction)
+            raise
+
+        if prediction.status != "succeeded":
+            raise RuntimeError(f"prediction {prediction.id} {prediction.status}: {prediction.error}")
+    return prediction.output
+
+
 def _replicate_call_once(
     jobid: str,
     prompt_text: str,
@@ -53,17 +131,17 @@ def _replicate_call_once(
     version: Optional[str],
     user_payload: Optional[Dict[str, Any]],
     output_dir: Optional[str],
-) -> Tuple[int, Dict[str, Any]]:
-    
+) -> Dict[str, Any]:
+    """
+    One generation, transient errors are retried by the replicate
+    policy (see resilience and _run_prediction). Errors are raised.
+    """
 
     inp = _merge_and_harmonize_inputs(model_slug, prompt_text, user_payload)
     print(f"[jobid={jobid} -> replicate.run({model_slug})")
 
     # run the generation
-    if version:
-        out = client.run(f"{model_slug}:{version}", input=inp) 
-    else:
-        out= client.run(model_slug, input=inp)
+    out = _run_prediction(client, model_slug, version, inp)
     
     # collect outputs
     outputs = collect_outputs(out)
@@ -85,46 +163,31 @@ def _replicate_call_with_retries(
     output_dir: Optional[str],
     retries: int,
     base_sleep: float,
-) -> Tuple[int, Dict[str, Any]]:
-    
+) -> Dict[str, Any]:
+    """
+    Same as _replicate_call_once with `retries` extra attempts (jittered
+    exponential backoff from base_sleep), but errors are returned in the
+    result dict: {"jobid", "prompt", "inputs", "error", "urls": [], "files": []}
+    """
     thread_name = threading.current_thread().name
-  
-    attempt, last_err,  = 0, None
+    default = get_policy("replicate")
+    policy = RetryPolicy(retries + 1, base_sleep, default.max_delay, default.budget_ratio, default.budget_min)
+    inp: Dict[str, Any] = {}
 
-    while attempt <= retries:
-        try:
-            inp = _merge_and_harmonize_inputs(model_slug, prompt_text, user_payload)
+    try:
+        inp = _merge_and_harmonize_inputs(model_slug, prompt_text, user_payload)
+        print(f"[{thread_name}] jobid={jobid} -> replicate.run({model_slug})")
 
-            print(f"[{thread_name}] jobid={jobid} attempt={attempt} -> replicate.run({model_slug})")
+        out = _run_prediction(client, model_slug, version, inp, policy=policy)
 
-            if version:
-                out = client.run(f"{model_slug}:{version}", input=inp) 
-            else:
-                out= client.run(model_slug, input=inp)
-            
-            print(out,type(out))
-
-            # collect outputs
-            outputs = collect_outputs(out)
-
-            # Collect URLs and optionally save
-            urls,files = collect_urls(outputs,jobid,output_dir)
-
-            return {"jobid":jobid, "prompt": prompt_text, "inputs": inp, "urls": urls, "files": files}
-
-        except Exception as e:
-            print(e)
-            last_err = e
-            attempt += 1
-            print(f"[{thread_name}] jobid={jobid} attempt={attempt} ERROR: {repr(e)}")
-            if attempt > retries:
-                return jobid, {
-                    "prompt": prompt_text,
-                    "inputs": inp if 'inp' in locals() else {},
-                    "error": repr(last_err),
-                    "urls": [],
-                    "files": [],
-                }
-            time.sleep(base_sleep * attempt)
-
-    return {"jobid":jobid, "prompt": prompt_text, "inputs": inp if 'inp' in locals() else {}, "error": "unknown_error", "urls": [], "files": []}
\ No newline at end of file
+        # collect outputs
+        outputs = collect_outputs(out)
+
+        # Collect URLs and optionally save
+        urls,files = collect_urls(outputs,jobid,output_dir)
+
+        return {"jobid":jobid, "prompt": prompt_text, "inputs": inp, "urls": urls, "files": files}
+
+    except Exception as e:
+        print(f"[{thread_name}] jobid={jobid} ERROR: {repr(e)}")
+        return {"jobid":jobid, "prompt": prompt_text, "inputs": inp, "error": repr(e), "urls": [], "files": []}
@@ -1,6 +1,6 @@
 from dataclasses import dataclass, field
 from copy import deepcopy
-from typing import Dict, Any, Optional, Set, Callable
+from typing import Dict, Any, Optional, Set, Callable, Tuple
 
 @dataclass
 class ModelConfig:
@@ -15,6 +15,19 @@ class ModelConfig:
     allow_unknown: bool = False
     # Optional adapter that can mutate the merged payload before sending to Replicate.
     adapter: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None
+    # Provider serving the model ("replicate" or "gemini").
+    provider: str = "replicate"
+    # Provider quota for this model, enforced by the shared token bucket
+    # (queue_manager.rate_limiter) across all workers. None = not paced.
+    requests_per_minute: Optional[float] = None
+    # Calls that may go out at once after an idle period.
+    burst: int = 1
+    # Input images are downscaled to this longest side (the most the model
+    # makes use of), EXIF-oriented and re-encoded, see imaging.renditions.
+    # None = inputs are sent as uploaded.
+    input_max_side: Optional[int] = None
+    input_format: str = "JPEG"
+    input_quality: int = 90
 
 
 def _resolve_model_config(slug: str) -> ModelConfig:
@@ -142,6 +155,9 @@ MODEL_REGISTRY: Dict[str, ModelConfig] = {
         },
         allow_unknown=False,
         adapter=_imagen_ultra_adapter,
+        requests_per_minute=30,
+        burst=5,
+        input_max_side=2048,
     ),
 
     "google/nano-banana": ModelConfig(
@@ -167,5 +183,34 @@ MODEL_REGISTRY: Dict[str, ModelConfig] = {
         },
         allow_unknown=False,
         adapter=_nano_banana_adapter,
+        requests_per_minute=60,
+        burst=10,
+        input_max_side=1536,
+    ),
+
+    # called through the genai client, only the quota applies
+    "gemini-2.5-flash-image": ModelConfig(
+        slug="gemini-2.5-flash-image",
+        provider="gemini",
+        allow_unknown=True,
+        requests_per_minute=60,
+        burst=10,
+        input_max_side=1536,
     ),
 }
+
+
+def model_rate_limit(slug: str) -> Optional[Tuple[str, float, int]]:
+    """(bucket key, tokens per second, burst) of a model, None if it is not paced."""
+    cfg = MODEL_REGISTRY.get(slug)
+    if cfg is None or not cfg.requests_per_minute:
+        return None
+    return f"{cfg.provider}:{slug}", cfg.requests_per_minute / 60.0, max(1, cfg.burst)
+
+
+def model_input_spec(slug: str) -> Optional[Dict[str, Any]]:
+    """prepare_input parameters of a model's input images, None to send them as is."""
+    cfg = MODEL_REGISTRY.get(slug)
+    if cfg is None or not cfg.input_max_side:
+        return None
+    return {"max_side": cfg.input_max_side, "format": cfg.input_format, "quality": cfg.input_quality}
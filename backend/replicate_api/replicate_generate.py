@@ -7,11 +7,13 @@ import os
 import time
 import pathlib
 import uuid
+import contextvars
 from datetime import datetime
-from typing import Dict, Any, Optional, List, Union
+from typing import Callable, Dict, Any, Optional, List, Union
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from .client import get_replicate_client
 from .generate import _replicate_call_once,_replicate_call_with_retries
+from queue_manager.concurrency import concurrency
 
 
 
@@ -38,10 +40,11 @@ def generate_with_replicate_threaded(
     version: Optional[str] = None,
     payloads: Optional[Union[Dict[str, Any], List[Optional[Dict[str, Any]]]]] = None,
     output_dir: Optional[str] = None,
-    max_workers: int = 4,
+    max_workers: Optional[int] = None,
     retries: int = 2,
     base_sleep: float = 1.0,
-    stagger_ms: int = 150,
+    stagger_ms: int = 0,
+    on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
 ) -> Dict[int, Dict[str, Any]]:
     """
     Threaded image generation on Replicate with per-model payload defaults.
@@ -49,6 +52,10 @@ def generate_with_replicate_threaded(
       - None -> only model defaults are used
       - dict -> same payload merged for all prompts
       - list[dict or None] -> per-prompt payload override
+    Calls are paced by the shared rate limiter of the model,
+    stagger_ms only adds an extra fixed delay between submissions.
+    max_workers defaults to the current concurrency window of the model.
+    on_result(res) is called as each prediction completes.
     """
 
     model_slug = model_slug or os.getenv("REPLICATE_MODEL_SLUG", "google/nano-banana")
@@ -69,15 +76,18 @@ def generate_with_replicate_threaded(
         if len(per_prompt_payloads) < len(prompts):
             per_prompt_payloads += [None] * (len(prompts) - len(per_prompt_payloads))
 
-    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+    max_workers = max_workers or concurrency.window("replicate", model_slug)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(prompts)))) as ex:
         futures = []
         jobid = generate_job_id()
 
         for (p, up) in zip(prompts, per_prompt_payloads):
             if stagger_ms:
                 time.sleep(stagger_ms / 1000.0)
+            # copy the job context so the calls see its cancel token
             futures.append(
                 ex.submit(
+                    contextvars.copy_context().run,
                     _replicate_call_with_retries,
                     jobid, p, client, model_slug, version,
                     up,                    # << user_payload per prompt
@@ -88,6 +98,8 @@ def generate_with_replicate_threaded(
         for fut in as_completed(futures):
             res = fut.result()
             results[res['jobid']] = res
+            if on_result is not None:
+                on_result(res)
 
     # Keep deterministic ordering
     return dict(sorted(results.items(), key=lambda kv: kv[0]))
@@ -100,6 +112,7 @@ def generate_with_replicate_sequential(
     version: Optional[str] = None,
     payloads: Optional[Union[Dict[str, Any], List[Optional[Dict[str, Any]]]]] = None,
     output_dir: Optional[str] = None,
+    on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
 ) -> Dict[int, Dict[str, Any]]:
     """
     Sequential (non-threaded) version of generate_with_replicate_threaded.
@@ -140,6 +153,8 @@ def generate_with_replicate_sequential(
             output_dir=output_dir,
         )
         results[jobid] = res
+        if on_result is not None:
+            on_result(res)
     
     # Deterministic ordering
     return dict(sorted(results.items(), key=lambda kv: kv[0]))
\ No newline at end of file
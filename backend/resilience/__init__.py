@@ -0,0 +1,3 @@
+from .breaker import *
+from .retry import *
+from .hedge import *
@@ -0,0 +1,125 @@
+# breaker.py
+# Circuit breakers per provider. After a run of failed calls the breaker
+# opens and calls fail at once with CircuitOpen instead of tying up a
+# worker thread; after a pause one probe call is let through.
+import os
+import time
+import threading
+from typing import Any, Dict
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# consecutive failures that open a breaker
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", 5))
+# seconds an open breaker waits before letting a probe through
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", 30))
+# breakers kept per process (one per remote host for fetches), idle
+# closed ones are dropped past it
+BREAKER_MAX_KEYS = 1000
+
+
+class CircuitOpen(Exception):
+    """The provider is failing, the call was not attempted."""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} is unavailable (circuit open), retry in {retry_in:.0f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+
+    def __init__(self, name: str, threshold: int = BREAKER_THRESHOLD, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.name = name
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.opens = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        '''Raises CircuitOpen unless the call may go through.'''
+        with self.lock:
+            if self.state == CLOSED:
+                return
+            retry_in = self.opened_at + self.reset_seconds - time.monotonic()
+            if self.state == OPEN and retry_in <= 0:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self.probing:
+                # one probe at a time, the others keep failing fast
+                self.probing = True
+                return
+            self.rejected += 1
+            raise CircuitOpen(self.name, max(0.0, retry_in))
+
+    def record_success(self):
+        with self.lock:
+            if self.state != CLOSED:
+                print(f"[breaker] {self.name} closed")
+            self.state = CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.threshold):
+                print(f"[breaker] {self.name} open after {self.failures} failures")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.opens += 1
+
+    def release(self):
+        '''The call ended without telling anything about the provider (cancelled, client error).'''
+        with self.lock:
+            self.probing = False
+
+    @property
+    def is_open(self) -> bool:
+        with self.lock:
+            return self.state == OPEN and time.monotonic() < self.opened_at + self.reset_seconds
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "opens": self.opens,
+                "rejected": self.rejected,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def _drop_idle_breakers():
+    # closed without failures: dropping it loses nothing
+    for name in list(_breakers):
+        if len(_breakers) < BREAKER_MAX_KEYS:
+            return
+        b = _breakers[name]
+        if b.state == CLOSED and b.failures == 0:
+            del _breakers[name]
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    with _breakers_lock:
+        b = _breakers.get(name)
+        if b is None:
+            _drop_idle_breakers()
+            b = _breakers[name] = CircuitBreaker(name)
+        return b
+
+
+def breaker_stats() -> Dict[str, Dict[str, Any]]:
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {name: b.snapshot() for name, b in breakers.items()}
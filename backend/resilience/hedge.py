@@ -0,0 +1,160 @@
+# hedge.py
+# Hedged calls: when a call has not answered by a percentile of its
+# recent latencies, a second one is sent (same or other backend) and
+# the first to succeed wins, the other is cancelled. Hedges are paid
+# from a budget earned by the calls, so spend never more than doubles.
+import os
+import time
+import queue
+import threading
+import contextvars
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+from queue_manager.cancellation import current_token, bind_token, CancelToken, JobCancelled, POLL_INTERVAL
+
+# latency percentile after which a hedge is sent
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", 95))
+# hedges allowed per call, capped at 1 (at most double the calls)
+HEDGE_BUDGET_RATIO = min(1.0, float(os.getenv("HEDGE_BUDGET_RATIO", 0.1)))
+# no hedging until this many latencies were seen
+HEDGE_MIN_SAMPLES = 20
+HEDGE_WINDOW = 200
+
+
+def hedging_enabled() -> bool:
+    return os.getenv("HEDGE_REQUESTS", "0").lower() in ("1", "true", "yes")
+
+
+class _HedgeStats:
+
+    def __init__(self):
+        self.latencies: Deque[float] = deque(maxlen=HEDGE_WINDOW)
+        # starts empty: every hedge is paid by earlier calls
+        self.tokens = 0.0
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def delay(self, percentile: float) -> Optional[float]:
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+
+_stats: Dict[str, _HedgeStats] = {}
+_stats_lock = threading.Lock()
+
+
+def _get_stats(key: str) -> _HedgeStats:
+    with _stats_lock:
+        stats = _stats.get(key)
+        if stats is None:
+            stats = _stats[key] = _HedgeStats()
+        return stats
+
+
+def hedge_stats() -> Dict[str, Dict[str, Any]]:
+    with _stats_lock:
+        items = list(_stats.items())
+        return {
+            key: {
+                "calls": s.calls,
+                "hedges": s.hedges,
+                "hedge_wins": s.hedge_wins,
+                "budget": round(s.tokens, 2),
+                "delay_s": round(s.delay(HEDGE_PERCENTILE), 2) if s.delay(HEDGE_PERCENTILE) is not None else None,
+            }
+            for key, s in items
+        }
+
+
+def _launch(name: str, fn: Callable[[], Any], token: CancelToken, results: queue.Queue):
+    ctx = contextvars.copy_context()
+
+    def run():
+        started = time.monotonic()
+        try:
+            value = ctx.run(_run_bound, token, fn)
+            results.put((name, True, value, time.monotonic() - started))
+        except BaseException as e:
+            results.put((name, False, e, None))
+
+    threading.Thread(target=run, name=f"hedge-{name}", daemon=True).start()
+
+
+def _run_bound(token: CancelToken, fn: Callable[[], Any]) -> Any:
+    with bind_token(token):
+        return fn()
+
+
+def _next_result(results: queue.Queue, timeout: Optional[float], parent: Optional[CancelToken]):
+    '''Next finished attempt, None on timeout. Raises JobCancelled with the job.'''
+    expires = None if timeout is None else time.monotonic() + timeout
+    while True:
+        wait = POLL_INTERVAL if expires is None else min(POLL_INTERVAL, expires - time.monotonic())
+        if wait <= 0:
+            return None
+        try:
+            return results.get(timeout=wait)
+        except queue.Empty:
+            if parent is not None and parent.cancelled:
+                raise JobCancelled(f"job {parent.job_id} was cancelled")
+
+
+def hedged_call(primary: Callable[[], Any], hedge: Optional[Callable[[], Any]] = None, *, key: str) -> Any:
+    '''
+    Run primary(); if it is still running after the HEDGE_PERCENTILE
+    latency of `key` and the budget allows, run hedge() (default: primary
+    again) next to it. Returns the first success, the loser is cancelled
+    through its own child cancel token. Raises the primary error when
+    both fail.
+    '''
+    stats = _get_stats(key)
+    with _stats_lock:
+        stats.calls += 1
+        stats.tokens = min(10.0, stats.tokens + HEDGE_BUDGET_RATIO)
+        delay = stats.delay(HEDGE_PERCENTILE)
+
+    parent = current_token()
+    tokens = {name: (parent.child() if parent is not None else CancelToken(key)) for name in ("primary", "hedge")}
+    results: queue.Queue = queue.Queue()
+    errors: Dict[str, BaseException] = {}
+    running = 1
+
+    try:
+        _launch("primary", primary, tokens["primary"], results)
+        outcome = _next_result(results, delay, parent) if delay is not None else None
+
+        if outcome is None and delay is not None:
+            with _stats_lock:
+                hedge_now = stats.tokens >= 1
+                if hedge_now:
+                    stats.tokens -= 1
+                    stats.hedges += 1
+            if hedge_now:
+                print(f"[hedge] {key} no answer after {delay:.1f}s, sending a hedge")
+                _launch("hedge", hedge or primary, tokens["hedge"], results)
+                running += 1
+
+        while True:
+            if outcome is None:
+                outcome = _next_result(results, None, parent)
+            name, ok, value, latency = outcome
+            outcome = None
+            running -= 1
+            if ok:
+                with _stats_lock:
+                    stats.latencies.append(latency)
+                    if name == "hedge":
+                        stats.hedge_wins += 1
+                return value
+            errors[name] = value
+            if running == 0:
+                raise errors.get("primary", value)
+    finally:
+        # cancel whatever still runs, its result is not needed anymore
+        for token in tokens.values():
+            token.cancel()
+            if parent is not None:
+                parent.release(token)
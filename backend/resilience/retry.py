@@ -0,0 +1,212 @@
+# retry.py
+# One retry policy for every outbound call: exponential backoff with
+# full jitter, a retry budget per provider (retries are capped to a
+# share of the calls, so an outage does not multiply the load) and the
+# circuit breaker of the provider.
+import os
+import time
+import random
+import asyncio
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlparse
+import requests
+from queue_manager.cancellation import current_token, JobCancelled, JobTimeout
+from queue_manager.concurrency import error_status
+from .breaker import get_breaker, CircuitOpen, BREAKER_MAX_KEYS
+
+# statuses worth another attempt: timeouts, throttling, server side errors
+RETRYABLE_STATUSES = (408, 429, 500, 502, 503, 504)
+
+RETRYABLE_EXCEPTIONS = (
+    ConnectionError,
+    TimeoutError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+try:
+    # transport errors of the genai async client (httpx comes with google-genai)
+    import httpx
+    RETRYABLE_EXCEPTIONS += (httpx.TransportError,)
+except ImportError:
+    pass
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 3
+    base_delay: float = 1.0
+    max_delay: float = 20.0
+    # retries allowed per first attempt, averaged over time
+    budget_ratio: float = 0.2
+    # retries always allowed, so a quiet provider can still retry
+    budget_min: float = 10
+
+    def backoff(self, attempt: int) -> float:
+        '''Full jitter: uniform between 0 and the exponential delay.'''
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+# per provider, override with RETRY_MAX_ATTEMPTS_<PROVIDER>
+DEFAULT_POLICIES = {
+    "gemini": RetryPolicy(max_attempts=3, base_delay=2.0),
+    "replicate": RetryPolicy(max_attempts=3, base_delay=1.0),
+    "fetch": RetryPolicy(max_attempts=3, base_delay=0.5, max_delay=5.0),
+    "gcs": RetryPolicy(max_attempts=4, base_delay=0.5, max_delay=10.0),
+    "default": RetryPolicy(),
+}
+
+
+def host_provider(kind: str, url: str) -> str:
+    '''
+    "<kind>:<host>" of a url, e.g. fetch:example.com. Breakers and retry
+    budgets are per host, so a failing host (inputs are user URLs) does
+    not fail the fetches of the others. The policy is the one of kind.
+    '''
+    return f"{kind}:{urlparse(url).netloc.lower()}"
+
+
+def get_policy(provider: str) -> RetryPolicy:
+    # fetch:<host> uses the fetch policy
+    kind = provider.split(":", 1)[0]
+    policy = DEFAULT_POLICIES.get(kind, DEFAULT_POLICIES["default"])
+    attempts = _env_int(f"RETRY_MAX_ATTEMPTS_{kind.upper()}", policy.max_attempts)
+    if attempts != policy.max_attempts:
+        policy = RetryPolicy(attempts, policy.base_delay, policy.max_delay, policy.budget_ratio, policy.budget_min)
+    return policy
+
+
+def is_retryable(e: BaseException) -> bool:
+    if isinstance(e, CircuitOpen):
+        return False
+    if isinstance(e, RETRYABLE_EXCEPTIONS):
+        return True
+    return error_status(e) in RETRYABLE_STATUSES
+
+
+class RetryBudget:
+
+    def __init__(self, ratio: float, minimum: float):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.tokens = minimum
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.minimum * 10, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+_budgets: Dict[str, RetryBudget] = {}
+_budgets_lock = threading.Lock()
+
+
+def get_budget(provider: str, policy: RetryPolicy) -> RetryBudget:
+    with _budgets_lock:
+        budget = _budgets.get(provider)
+        if budget is None:
+            # per host budgets: the oldest one is dropped (it starts over)
+            while len(_budgets) >= BREAKER_MAX_KEYS:
+                del _budgets[next(iter(_budgets))]
+            budget = _budgets[provider] = RetryBudget(policy.budget_ratio, policy.budget_min)
+        return budget
+
+
+def retry_budget_stats() -> Dict[str, float]:
+    with _budgets_lock:
+        return {provider: round(b.tokens, 1) for provider, b in _budgets.items()}
+
+
+def _should_retry(provider: str, policy: RetryPolicy, attempt: int, e: BaseException) -> bool:
+    if attempt + 1 >= policy.max_attempts or not is_retryable(e):
+        return False
+    if not get_budget(provider, policy).withdraw():
+        print(f"[retry] {provider} retry budget exhausted, not retrying {repr(e)}")
+        return False
+    return True
+
+
+def _record(provider: str, e: Optional[BaseException]):
+    breaker = get_breaker(provider)
+    if e is None:
+        breaker.record_success()
+    elif isinstance(e, JobTimeout) or is_retryable(e):
+        breaker.record_failure()
+    else:
+        # a bad request or a cancelled job says nothing about the provider
+        breaker.release()
+
+
+def call_with_retry(fn: Callable[..., Any], *args, provider: str = "default", policy: Optional[RetryPolicy] = None, **kwargs) -> Any:
+    '''
+    Run fn(*args, **kwargs) under the retry policy and circuit breaker of
+    the provider. Raises CircuitOpen without calling fn when the provider
+    is failing, the last error once the attempts or the budget run out.
+    The backoff sleeps are interrupted if the current job is cancelled.
+    '''
+    policy = policy or get_policy(provider)
+    get_budget(provider, policy).deposit()
+    attempt = 0
+    while True:
+        get_breaker(provider).allow()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            _record(provider, e)
+            if not isinstance(e, Exception) or not _should_retry(provider, policy, attempt, e):
+                raise
+            delay = policy.backoff(attempt)
+            attempt += 1
+            print(f"[retry] {provider} attempt {attempt} failed ({repr(e)}), retrying in {delay:.2f}s")
+            token = current_token()
+            if token is None:
+                time.sleep(delay)
+            elif token.event.wait(delay):
+                raise JobCancelled(f"job {token.job_id} was cancelled")
+            continue
+        _record(provider, None)
+        return result
+
+
+async def call_with_retry_async(make_coro: Callable[[], Any], provider: str = "default", policy: Optional[RetryPolicy] = None) -> Any:
+    '''
+    Coroutine version of call_with_retry. make_coro builds a new
+    awaitable for each attempt (a coroutine can only be awaited once).
+    '''
+    policy = policy or get_policy(provider)
+    get_budget(provider, policy).deposit()
+    attempt = 0
+    while True:
+        get_breaker(provider).allow()
+        try:
+            result = await make_coro()
+        except BaseException as e:
+            _record(provider, e)
+            if not isinstance(e, Exception) or not _should_retry(provider, policy, attempt, e):
+                raise
+            delay = policy.backoff(attempt)
+            attempt += 1
+            print(f"[retry] {provider} attempt {attempt} failed ({repr(e)}), retrying in {delay:.2f}s")
+            token = current_token()
+            if token is not None and token.cancelled:
+                raise JobCancelled(f"job {token.job_id} was cancelled")
+            await asyncio.sleep(delay)
+            continue
+        _record(provider, None)
+        return result
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the backend packages (app, jobs, queue_manager...) are top-level imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GCS_BUCKET", "test-bucket")
+os.environ.setdefault("ENV", "test")
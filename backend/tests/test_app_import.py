@@ -0,0 +1,19 @@
+# Smoke test: the app and all its route modules import (names re-exported
+# by the packages, import cycles). Cloud clients are not created.
+from unittest import mock
+import pytest
+
+for module in ("flask", "flask_cors", "flask_limiter", "dotenv", "firebase_admin", "google.cloud.storage", "google.cloud.tasks_v2", "google.genai"):
+    pytest.importorskip(module)
+
+
+def test_app_imports():
+    with mock.patch("firebase_admin.initialize_app"), \
+            mock.patch("firebase_admin.firestore.client"), \
+            mock.patch("google.cloud.storage.Client"), \
+            mock.patch("google.genai.Client"):
+        import app
+        import queue_manager
+
+    assert app.app is not None
+    assert queue_manager.PRIORITIES == (queue_manager.INTERACTIVE, queue_manager.BATCH)
@@ -0,0 +1,39 @@
+import asyncio
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("google.cloud.tasks_v2")
+
+from queue_manager.cancellation import job_context, cancel_running, check_cancelled, JobCancelled
+from queue_manager.concurrency import ConcurrencyController
+
+
+def test_cancel_inside_slot():
+    controller = ConcurrencyController()
+    with pytest.raises(JobCancelled):
+        with job_context("job-1"):
+            with controller.slot("gemini", "model"):
+                cancel_running("job-1")
+                check_cancelled()
+
+    lim = controller.limiter("gemini", "model")
+    assert lim.in_flight == 0
+    assert lim.counts["cancelled"] == 1
+    assert lim.counts["errors"] == 0
+
+
+def test_cancel_inside_async_slot():
+    controller = ConcurrencyController()
+
+    async def run():
+        with job_context("job-2"):
+            async with controller.slot_async("gemini", "model"):
+                cancel_running("job-2")
+                check_cancelled()
+
+    with pytest.raises(JobCancelled):
+        asyncio.run(run())
+
+    lim = controller.limiter("gemini", "model")
+    assert lim.in_flight == 0
+    assert lim.counts["cancelled"] == 1
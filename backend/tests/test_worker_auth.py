@@ -0,0 +1,54 @@
+# The /run_job worker refuses unauthenticated tasks outside the local
+# modes, and only passes the options each runner accepts.
+from unittest import mock
+import pytest
+
+for module in ("flask", "flask_cors", "flask_limiter", "dotenv", "firebase_admin", "google.cloud.storage", "google.cloud.tasks_v2", "google.genai"):
+    pytest.importorskip(module)
+
+
+@pytest.fixture(scope="module")
+def client():
+    with mock.patch("firebase_admin.initialize_app"), \
+            mock.patch("firebase_admin.firestore.client"), \
+            mock.patch("google.cloud.storage.Client"), \
+            mock.patch("google.genai.Client"):
+        import app
+    return app.app.test_client()
+
+
+@pytest.fixture(autouse=True)
+def no_credentials(monkeypatch):
+    for name in ("WORKER_TOKEN", "WORKER_OIDC_SERVICE_ACCOUNT", "WORKER_OIDC_AUDIENCE"):
+        monkeypatch.delenv(name, raising=False)
+
+
+def test_no_credentials_in_prod(client, monkeypatch):
+    monkeypatch.setenv("ENV", "prod")
+    assert client.post("/run_job", json={}).status_code == 403
+
+
+def test_no_credentials_in_local_tasks(client, monkeypatch):
+    monkeypatch.setenv("ENV", "local_tasks")
+    # authorized, then rejected as malformed
+    assert client.post("/run_job", json={}).status_code == 400
+
+
+def test_worker_token(client, monkeypatch):
+    monkeypatch.setenv("ENV", "prod")
+    monkeypatch.setenv("WORKER_TOKEN", "secret")
+    assert client.post("/run_job", json={}, headers={"X-Worker-Token": "wrong"}).status_code == 403
+    assert client.post("/run_job", json={}, headers={"X-Worker-Token": "secret"}).status_code == 400
+
+
+def test_oidc_required(client, monkeypatch):
+    monkeypatch.setenv("ENV", "prod")
+    monkeypatch.setenv("WORKER_OIDC_SERVICE_ACCOUNT", "tasks@project.iam.gserviceaccount.com")
+    assert client.post("/run_job", json={}).status_code == 403
+
+
+def test_runner_options():
+    from jobs import runner_options
+    options = {"variants": ["a"], "backend": "replicate", "db": None, "uid": "other"}
+    assert runner_options("run_fanout_job", options) == {"variants": ["a"], "backend": "replicate"}
+    assert runner_options("run_nano_banana_job", options) == {}
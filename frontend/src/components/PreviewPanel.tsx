@@ -150,6 +150,10 @@ const PreviewPanel: React.FC<PreviewPanelProps> = ({
         updateThumb(thumbId, { alt: "Generation failed", status: "error", job_id: jobId });
         jobThumbRef.current.delete(jobId);
 
+      } else if (status === "partial" && data?._bestImage) {
+        // first results are stored: show them while the others finish
+        updateThumb(thumbId, { src: toAbsolute(data._bestImage), job_id: jobId });
+
       } else if (pollingHelpers.isInProgress(status)) {
         // optional: set a progress label/spinner if you want
       }
@@ -2,18 +2,50 @@
 import { BACKEND_URL } from "../config";
 
 type PollHandle = { abort: AbortController; timerId: number | null; delay: number };
+type StreamHandle = { es: EventSource | null; jobIds: Set<string>; timerId: number | null };
 type Listener = (evt: { jobId: string; status: string; data: any }) => void;
 
 const JOB_STATUS_PATH = "/job_status";
+const JOB_EVENTS_PATH = "/job_events";
 
 // --- helpers (no heavy interfaces)
 const buildJobStatusUrl = (jobId: string, uId: string) =>
     `${BACKEND_URL}${JOB_STATUS_PATH}?job_id=${encodeURIComponent(jobId)}&uid=${encodeURIComponent(uId)}`;
 
+const buildJobEventsUrl = (jobIds: string[], uId: string) =>
+    `${BACKEND_URL}${JOB_EVENTS_PATH}?uid=${encodeURIComponent(uId)}&job_id=${jobIds.map(encodeURIComponent).join(",")}`;
+
 const getStatus = (js: any) => String(js?.status ?? "").toLowerCase();
 
+const isFinal = (s: string) => s === "succeeded" || s === "failed" || s === "canceled";
+
+// --- /job_events deltas use firestore field paths ("fanout.done")
+const getPath = (obj: any, path: string) => path.split(".").reduce((o, k) => o?.[k], obj);
+
+const setPath = (obj: any, path: string, value: any) => {
+    const keys = path.split(".");
+    const out = { ...obj };
+    let node = out;
+    keys.slice(0, -1).forEach((k) => {
+        node[k] = { ...(node[k] ?? {}) };
+        node = node[k];
+    });
+    node[keys[keys.length - 1]] = value;
+    return out;
+};
+
+const applyUpdate = (doc: any, evt: any) => {
+    let out = { ...doc };
+    for (const [k, v] of Object.entries(evt.fields ?? {})) out = setPath(out, k, v);
+    for (const [k, items] of Object.entries(evt.appended ?? {}))
+        out = setPath(out, k, [...(getPath(out, k) ?? []), ...(items as any[])]);
+    for (const [k, n] of Object.entries(evt.incremented ?? {}))
+        out = setPath(out, k, (getPath(out, k) ?? 0) + (n as number));
+    return out;
+};
+
 const isInProgress = (s: string) =>
-    s === "created" || s === "queued" || s === "starting" || s === "processing" || s === "running";
+    s === "created" || s === "queued" || s === "starting" || s === "processing" || s === "running" || s === "partial";
 
 const extractBestImage = (js: any): string | undefined => {
     // const fromResults = js?.results?.items?.[0]?.urls?.[0];
@@ -35,6 +67,9 @@ const extractBestImage = (js: any): string | undefined => {
 class PollingService {
     private polls = new Map<string, PollHandle>();
     private listeners = new Set<Listener>();
+    // one /job_events stream per user, shared by all its jobs
+    private streams = new Map<string, StreamHandle>();
+    private docs = new Map<string, any>();
 
     subscribe(fn: Listener) {
         this.listeners.add(fn);
@@ -46,9 +81,94 @@ class PollingService {
     }
 
     start(jobId: string, uId: string) {
-        if (!jobId || this.polls.has(jobId)) return;
+        if (!jobId || this.polls.has(jobId) || this.streamOf(jobId)) return;
         if (!uId) return;
 
+        if (typeof EventSource !== "undefined") {
+            this.watch(jobId, uId);
+            return;
+        }
+        this.poll(jobId, uId);
+    }
+
+    // --- streaming (Server-Sent Events), falls back to polling
+    private streamOf(jobId: string) {
+        for (const s of this.streams.values()) if (s.jobIds.has(jobId)) return s;
+        return undefined;
+    }
+
+    private watch(jobId: string, uId: string) {
+        let s = this.streams.get(uId);
+        if (!s) {
+            s = { es: null, jobIds: new Set(), timerId: null };
+            this.streams.set(uId, s);
+        }
+        s.jobIds.add(jobId);
+        // jobs started together share one (re)connection
+        if (s.timerId) window.clearTimeout(s.timerId);
+        s.timerId = window.setTimeout(() => this.openStream(uId), 0);
+    }
+
+    private openStream(uId: string) {
+        const s = this.streams.get(uId);
+        if (!s) return;
+        s.timerId = null;
+        s.es?.close();
+        if (!s.jobIds.size) {
+            this.streams.delete(uId);
+            return;
+        }
+
+        const es = new EventSource(buildJobEventsUrl([...s.jobIds], uId));
+        s.es = es;
+
+        const onDoc = (jobId: string, doc: any) => {
+            if (!s.jobIds.has(jobId)) return;
+            this.docs.set(jobId, doc);
+            const status = getStatus(doc);
+            this.emit(jobId, status, { ...doc, job_id: jobId, _bestImage: extractBestImage(doc) });
+            if (isFinal(status)) this.unwatch(jobId);
+        };
+
+        es.addEventListener("snapshot", (e) => {
+            const evt = JSON.parse((e as MessageEvent).data);
+            onDoc(evt.job_id, evt.data ?? {});
+        });
+        es.addEventListener("update", (e) => {
+            const evt = JSON.parse((e as MessageEvent).data);
+            onDoc(evt.job_id, applyUpdate(this.docs.get(evt.job_id) ?? {}, evt));
+        });
+        es.addEventListener("deleted", (e) => {
+            const evt = JSON.parse((e as MessageEvent).data);
+            this.unwatch(evt.job_id);
+        });
+        es.addEventListener("end", () => es.close());
+        es.onerror = () => {
+            // network errors reconnect by themselves, a refused stream (503) does not
+            if (es.readyState !== EventSource.CLOSED || s.es !== es) return;
+            const jobIds = [...s.jobIds];
+            this.streams.delete(uId);
+            jobIds.forEach((id) => {
+                this.docs.delete(id);
+                this.poll(id, uId);
+            });
+        };
+    }
+
+    private unwatch(jobId: string) {
+        this.docs.delete(jobId);
+        for (const [uId, s] of this.streams) {
+            if (!s.jobIds.delete(jobId) || s.jobIds.size) continue;
+            if (s.timerId) window.clearTimeout(s.timerId);
+            s.es?.close();
+            this.streams.delete(uId);
+        }
+    }
+
+    // --- polling /job_status
+    private poll(jobId: string, uId: string) {
+        if (this.polls.has(jobId)) return;
+
         const handle: PollHandle = { abort: new AbortController(), timerId: null, delay: 1500 };
         this.polls.set(jobId, handle);
 
@@ -66,7 +186,7 @@ class PollingService {
                     _bestImage: extractBestImage(js),
                 });
 
-                if (status === "succeeded" || status === "failed" || status === "canceled") {
+                if (isFinal(status)) {
                     if (h.timerId) window.clearTimeout(h.timerId);
                     h.abort.abort();
                     this.polls.delete(jobId);
@@ -88,6 +208,7 @@ class PollingService {
     }
 
     stop(jobId: string) {
+        this.unwatch(jobId);
         const h = this.polls.get(jobId);
         if (!h) return;
         if (h.timerId) window.clearTimeout(h.timerId);
@@ -96,6 +217,12 @@ class PollingService {
     }
 
     stopAll() {
+        this.streams.forEach((s) => {
+            if (s.timerId) window.clearTimeout(s.timerId);
+            s.es?.close();
+        });
+        this.streams.clear();
+        this.docs.clear();
         this.polls.forEach((h) => {
             if (h.timerId) window.clearTimeout(h.timerId);
             h.abort.abort();
@@ -107,4 +234,4 @@ class PollingService {
 export const pollingService = new PollingService();
 
 // export helpers if other UIs need them
-export const pollingHelpers = { getStatus, extractBestImage, isInProgress };
+export const pollingHelpers = { getStatus, extractBestImage, isInProgress, isFinal };